@@ -11,20 +11,201 @@ Usage:
                  max_business = None,
                  logger_fn = 'api.log',
                  limit_attempts = 5,
-                 output_fn = 'output.json')
+                 output_fn = 'output.json',
+                 limit_per_host = 10)
 >>> asyncio.run(crawl_obj.run())
+
+All requests of one 'run()' share a single pooled HTTP session
+(see YelpCrawler/session.py), connections are kept alive between pages.
+Requests are executed by a bounded worker pool (see YelpCrawler/scheduler.py):
+'concurrency' caps requests in flight, 'limit_per_host' caps them per host,
+'queue_size' bounds the work queue and 'rate_limit' caps requests per second.
+Fetched pages are kept in a bounded LRU cache of 'cache_size' characters,
+with 'cache_fn' they are also stored in a SQLite file and reused by later
+runs while younger than 'cache_ttl' seconds (see YelpCrawler/cache.py).
+With 'validators_fn' ETag/Last-Modified of pages are stored in a SQLite
+file and sent back as conditional headers, '304 Not Modified' is served
+from the stored body.
+With 'adaptive=True' a crawler-wide AIMD limiter shrinks the window of
+requests in flight (and 'rate_limit') on 503, timeouts and latency spikes,
+grows it back on success and honours Retry-After, its state is in
+'limiter.stats()' (see YelpCrawler/scheduler.py).
+Concurrent requests of the same URL are coalesced into one request,
+their count is kept in 'coalesced'.
+With 'parse_workers' > 0 parsing and extraction run in a process pool
+('parse_executor'='thread' - in a thread pool), see YelpCrawler/parsers.py.
+Businesses are written to 'output_fn' as soon as they are gathered, as JSON
+array or NDJSON ('output_format'), optionally gzip-compressed
+('output_compress'), see YelpCrawler/output.py, or upserted into an indexed
+SQLite file ('sqlite', see YelpCrawler/store.py).
+With 'state_fn' progress is checkpointed to a SQLite file, 'resume=True'
+writes already finished businesses again and fetches only what is missing
+(see YelpCrawler/state.py).
+With 'previous_fn' (output or state file of an earlier run) business pages
+are fetched only for new or changed listings and for records older than
+'previous_ttl' seconds, unchanged records are carried over
+(see YelpCrawler/incremental.py).
+'run_batch()' crawls many (category_name, location) queries (see
+'read_queries') in one process with the same session, cache and scheduler,
+businesses found by several queries are fetched once ('businesses' keeps
+them, 'duplicates' counts the skipped ones), results go to 'output_fn' or
+to one file per query ('per_query=True').
+Request phases (DNS, connect, TTFB, download), parse time per page type,
+queue wait, retries and bytes are collected in 'metrics' (see
+YelpCrawler/metrics.py); the JSON summary is logged at the end of a run
+and written to 'metrics_fn', every 'stats_interval' seconds a stats line
+is printed, 'prometheus_fn' gets the metrics in Prometheus text format.
+With 'stream_parse=True' business pages are parsed while they download
+('stream_chunk_size' bytes at a time, see BusinessPageParser) and the rest
+of the body is not read once the website and 'max_reviews' reviews are
+found. Only pages read to the end are cached and get validators stored:
+a page cut short is fetched in full again by later runs, neither
+'cache_fn' nor 'validators_fn' saves it, so streaming trades savings of
+repeated runs for bytes and time of one run. Concurrent fetches of the
+same business page are coalesced like other requests.
+Reviews beyond the first business page are paged by 'reviews_per_page'
+('?start=N'): pages needed for min('max_reviews', number_of_reviews) are
+submitted to the scheduler together with the first page, so they are
+fetched concurrently, and their reviews are merged in order of their
+position (page start + index), a position served by two pages is kept
+once (see 'merge_reviews'). With 'max_reviews=None' only the first
+page is read.
+'deadline' (seconds), 'max_requests' and 'max_bytes' set a budget of the
+run (see YelpCrawler/budget.py): once it is exhausted no new request is
+sent, businesses already fetched are written and pages left out are kept
+in 'skipped' and written to 'skipped_fn'. 'priority' orders queued business
+page fetches by signals of the search page: 'reviews' (most reviewed
+first), 'rating' (best rated first), 'rank' (search rank) or a function
+of (business_body, rank) returning a number, lower first; search pages
+then go ahead of business pages.
+With 'egress' (HTTP proxy URLs or local source addresses) requests are
+spread across an egress pool (see YelpCrawler/egress.py): every request
+goes through the healthiest endpoint, an endpoint answering '503' or
+failing cools down for 'egress_cooldown' seconds (or Retry-After) and the
+retry goes through another one right away. Per-endpoint stats are
+reported at the end of a run.
 '''
 
-import json
 import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from lxml import html
-from YelpCrawler.structures import Business, Review
-from YelpCrawler.structures import get_digits, get_href
+from YelpCrawler.structures import Business
+from YelpCrawler.parsers import extract_business, parse_search_page, parse_business_page, BusinessPageParser
+from YelpCrawler.output import open_writer
+from YelpCrawler.state import CrawlState
+from YelpCrawler.incremental import PreviousCrawl
+from YelpCrawler.session import create_session
+from YelpCrawler.scheduler import Scheduler, AdaptiveLimiter, parse_retry_after
+from YelpCrawler.cache import Cache, ValidatorStore
+from YelpCrawler.metrics import Metrics
+from YelpCrawler.budget import Budget, BudgetExhausted
+from YelpCrawler.egress import EgressPool
+import json
 import logging
+import math
+import os
+import re
 import aiohttp
 import asyncio
+import random
 import time
 
+
+class AccessDenied(ConnectionError):
+    def __init__(self, msg, retry_after: float = None):
+        super(AccessDenied, self).__init__(msg)
+        self.retry_after = retry_after
+
+
+class HTTPStatusError(ConnectionError):
+    '''
+    The site answered with an unexpected status: the egress endpoint worked.
+    '''
+    def __init__(self, msg, status: int):
+        super(HTTPStatusError, self).__init__(msg)
+        self.status = status
+
+
+def normalize_url(url: str) -> str:
+    '''
+    Key of URL for request coalescing: lowercase scheme and host,
+    sorted query, no fragment.
+    '''
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)),
+                                   quote_via=urllib.parse.quote_plus)
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+
+def query_output_fn(fn: str, category_name: str, location: str) -> str:
+    '''
+    Output file of one query of a batch, e.g. 'output.json' ->
+    'output.Contractors.San-Francisco-CA.json'.
+    '''
+    suffix = ''
+    if fn.endswith('.gz'):
+        fn, suffix = fn[:-3], '.gz'
+    root, ext = os.path.splitext(fn)
+    slug = '.'.join(re.sub(r'[^\w]+', '-', part).strip('-') for part in (category_name, location))
+    return f'{root}.{slug}{ext}{suffix}'
+
+
+def review_page_url(url: str, start: int) -> str:
+    '''
+    Business page URL showing reviews from 'start', e.g. '.../biz/x?start=10'.
+    '''
+    parts = urllib.parse.urlsplit(url)
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True) if k!='start']
+    query.append(('start', str(start)))
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query, quote_via=urllib.parse.quote_plus)))
+
+
+def merge_reviews(pages: list, max_reviews: int = None, per_page: int = 10) -> list:
+    '''
+    Reviews of consecutive review pages in order, page k starts at review
+    k * per_page. A position served by several pages (a page longer than
+    'per_page') is kept once, equal reviews at different positions are
+    different reviews.
+    '''
+    seen = set()
+    reviews = []
+    for k, page in enumerate(pages):
+        for position, review in enumerate(page, k * per_page):
+            if position in seen:
+                continue
+            seen.add(position)
+            reviews.append(review)
+            if max_reviews and len(reviews) >= max_reviews:
+                return reviews
+    return reviews
+
+
+# order of business page fetches for 'priority', lower first
+priorities = {
+    'reviews': lambda business_body, rank: -(business_body.number_of_reviews or 0),
+    'rating': lambda business_body, rank: -(business_body.business_rating or 0),
+    'rank': lambda business_body, rank: rank,
+}
+
+
+def read_queries(fn: str) -> list:
+    '''
+    (category_name, location) pairs of a batch file: one query per line,
+    separated by a tab, blank lines and lines starting with '#' are skipped.
+    '''
+    queries = []
+    with open(fn, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            category_name, sep, location = line.partition('\t')
+            if not sep:
+                raise ValueError(f'Expected "category<TAB>location" in {fn}, got {line!r}')
+            queries.append((category_name.strip(), location.strip()))
+    return queries
+
+
 class Crawler():
     def __init__(self,
                  max_pages = None,
@@ -32,20 +213,146 @@ class Crawler():
                  max_business = None,
                  logger_fn = 'api.log',
                  limit_attempts = 5,
-                 output_fn = 'output.json'):
+                 output_fn = 'output.json',
+                 base_url = 'https://www.yelp.com',
+                 limit = 100,
+                 limit_per_host = 10,
+                 keepalive_timeout = 30,
+                 ttl_dns_cache = 300,
+                 timeout = 30,
+                 concurrency = 20,
+                 queue_size = 100,
+                 rate_limit = None,
+                 cache_size = 64 * 2**20,
+                 cache_fn = None,
+                 cache_ttl = None,
+                 parse_workers = 0,
+                 parse_executor = 'process',
+                 output_format = 'json',
+                 output_compress = False,
+                 flush_interval = 1.0,
+                 state_fn = None,
+                 resume = False,
+                 previous_fn = None,
+                 previous_ttl = None,
+                 validators_fn = None,
+                 adaptive = True,
+                 metrics_fn = None,
+                 stats_interval = None,
+                 prometheus_fn = None,
+                 stream_parse = False,
+                 stream_chunk_size = 16384,
+                 reviews_per_page = 10,
+                 deadline = None,
+                 max_requests = None,
+                 max_bytes = None,
+                 priority = None,
+                 skipped_fn = None,
+                 egress = None,
+                 egress_cooldown = 30):
         self.max_pages = max_pages
         self.max_reviews=max_reviews
         self.max_business = max_business
+        self.reviews_per_page = reviews_per_page
         logging.basicConfig(level=logging.INFO,
                             format='%(asctime)s - %(levelname)s - %(message)s',
                             filename=logger_fn,
-                            filemode='w')
+                            filemode='a')
         self.logger = logging.getLogger()
+        # business Yelp URL -> search page that claimed it, shared by all queries of a batch
         self.businesses = dict()
+        self.duplicates = 0
+        self._first = None
         self.limit_attempts = limit_attempts
         self.output_fn = output_fn
-        self._cache = dict()
-        self.tasks = []
+        self.output_format = output_format
+        self.output_compress = output_compress
+        self.flush_interval = flush_interval
+        self.state_fn = state_fn
+        self.resume = resume
+        self.state = None
+        self.previous_fn = previous_fn
+        self.previous_ttl = previous_ttl
+        self.previous = None
+        self._cache = Cache(max_size=cache_size, fn=cache_fn, ttl=cache_ttl)
+        self.validators = ValidatorStore(validators_fn) if validators_fn else None
+        self._search_pages = dict()
+        self._in_flight = dict()
+        self.coalesced = 0
+        self.budget = Budget(deadline, max_requests, max_bytes) \
+            if (deadline, max_requests, max_bytes)!=(None, None, None) else None
+        if isinstance(priority, str) and priority not in priorities:
+            raise ValueError(f'Unknown priority {priority}, expected one of {", ".join(priorities)}')
+        self.priority = priorities.get(priority, priority) if isinstance(priority, str) else priority
+        self.skipped_fn = skipped_fn
+        # url -> search page or business not finished yet, what is left when the budget runs out is skipped
+        self.pending = dict()
+        self.skipped = {'queries': [], 'search_pages': [], 'businesses': []}
+        # body bytes of all responses, read at once or streamed, for 'max_bytes'
+        self.bytes_received = 0
+        self.parse_workers = parse_workers
+        self.parse_executor = parse_executor
+        self.parse_pool = None
+        self.stream_parse = stream_parse
+        self.stream_chunk_size = stream_chunk_size
+        self.base_url = base_url.rstrip('/')
+        self.metrics = Metrics()
+        self.metrics_fn = metrics_fn
+        self.stats_interval = stats_interval
+        self.prometheus_fn = prometheus_fn
+        self._stats_task = None
+        # set by run.py --profile, see YelpCrawler/profiling.py
+        self.profiler = None
+        self.session_options = dict(limit=limit,
+                                    limit_per_host=limit_per_host,
+                                    keepalive_timeout=keepalive_timeout,
+                                    ttl_dns_cache=ttl_dns_cache,
+                                    timeout=timeout,
+                                    trace_configs=[self.metrics.trace_config()])
+        self.session = None
+        self.egress = EgressPool(egress, cooldown=egress_cooldown) if egress else None
+        self.scheduler = Scheduler(concurrency=concurrency,
+                                   per_host=limit_per_host,
+                                   queue_size=queue_size,
+                                   rate=rate_limit,
+                                   metrics=self.metrics)
+        self.limiter = AdaptiveLimiter(max_window=concurrency, bucket=self.scheduler.bucket) if adaptive else None
+
+    async def open_session(self):
+        if self.egress is not None:
+            # one session per endpoint instead
+            await self.egress.open(**self.session_options)
+            return None
+        if self.session is None or self.session.closed:
+            self.session = create_session(**self.session_options)
+        return self.session
+
+    async def close_session(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self.egress is not None:
+            await self.egress.close()
+
+    def open_parse_pool(self):
+        if self.parse_workers and self.parse_pool is None:
+            executor = ThreadPoolExecutor if self.parse_executor=='thread' else ProcessPoolExecutor
+            self.parse_pool = executor(max_workers=self.parse_workers)
+        return self.parse_pool
+
+    def close_parse_pool(self):
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown(cancel_futures=True)
+            self.parse_pool = None
+
+    async def parse(self, func, *args):
+        '''
+        Runs parser from YelpCrawler.parsers inline or in the parse pool.
+        '''
+        with self.metrics.timer(func.__name__):
+            if self.parse_pool is None:
+                return func(*args)
+            return await asyncio.get_running_loop().run_in_executor(self.parse_pool, func, *args)
 
     def _async_retry(func, retries=3, exceptions=(ConnectionError,), backoff=2):
         async def wrapper(*args, **kwargs):
@@ -56,39 +363,188 @@ class Crawler():
                 except exceptions as e:
                     msg = f"Caught exception: {e}. Retrying..."
                     print(msg)
-                    await asyncio.sleep(delay)
+                    args[0].metrics.inc('retries')
+                    egress = args[0].egress
+                    if egress is not None and egress.ready() and not isinstance(e, HTTPStatusError):
+                        # the failed endpoint cools down, another one is ready
+                        continue
+                    # jitter keeps retries of concurrent requests apart
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
                     delay *= backoff
             raise RuntimeError(f"Reached maximum retries ({retries}) for {func.__name__}")
 
         return wrapper
 
 
-    @_async_retry
-    async def fetch_url(self, url):
-        if not self._cache.get(url, False):
+    def _store(self, url: str, r: aiohttp.ClientResponse, text: str):
+        self._cache[url] = text
+        if self.validators is not None and ('ETag' in r.headers or 'Last-Modified' in r.headers):
+            self.validators.set(url, r.headers.get('ETag'), r.headers.get('Last-Modified'), text)
+
+    async def _read_business_page(self, url: str, r: aiohttp.ClientResponse, _start: float):
+        '''
+        Feeds the body into BusinessPageParser while it downloads and stops
+        reading once all fields are found. A page read to the end is cached
+        as usual, a cut one is not (and its connection is not reused).
+        '''
+        parser = BusinessPageParser(self.max_reviews, encoding=r.charset or 'utf-8')
+        chunks = []
+        headers_end = time.perf_counter()
+        # aiohttp traces body chunks only inside read(), streamed ones are counted here
+        async for chunk in r.content.iter_chunked(self.stream_chunk_size):
+            self.metrics.inc('bytes_received', len(chunk))
+            self.bytes_received += len(chunk)
+            parser.feed(chunk)
+            chunks.append(chunk)
+            if parser.done:
+                break
+        now = time.perf_counter()
+        self.metrics.observe('download', now - headers_end)
+        self.metrics.observe('request', now - _start)
+        complete = r.content.at_eof()
+        values = parser.close()
+        self.metrics.observe('parse_business_page_stream', parser.parse_time)
+        self.metrics.inc('stream_bytes_read', parser.bytes_read)
+        if complete:
+            self._store(url, r, b''.join(chunks).decode(r.charset or 'utf-8', errors='replace'))
+        else:
+            self.metrics.inc('stream_early_stops')
+            self.logger.info(f'Stopped reading {url} after {parser.bytes_read} bytes')
+        return values, parser.bytes_read
+
+    async def _request(self, session: aiohttp.ClientSession, url, stream: bool = False, proxy: str = None):
+        headers = self.validators.headers(url) if self.validators is not None else None
+        _start = time.perf_counter()
+        async with session.get(url, headers=headers, proxy=proxy) as r:
+            if r.status==200:
+                msg = f'Crawler requested to {url}'
+                self.logger.info(msg)
+                if stream:
+                    return await self._read_business_page(url, r, _start)
+                self.bytes_received += len(await r.read())
+                text = await r.text()
+                self._store(url, r, text)
+                return text
+            elif r.status==304 and headers:
+                msg = f'Not modified {url}. Code 304'
+                self.logger.info(msg)
+                text = self.validators.body(url)
+                self._cache[url] = text
+                self._cache.hits += 1
+                if stream:
+                    return await self.parse(parse_business_page, text, self.max_reviews), len(text.encode('utf-8'))
+                return text
+            elif r.status==503:
+                msg = f'Access denied to {url}. Code 503'
+                self.logger.error(msg)
+                raise AccessDenied(msg, parse_retry_after(r.headers.get('Retry-After')))
+            else:
+                msg = f'Request to {url} failed with code {r.status}'
+                self.logger.error(msg)
+                raise HTTPStatusError(msg, r.status)
+
+    async def _egress_request(self, url, stream: bool = False):
+        endpoint = await self.egress.acquire()
+        _start = time.monotonic()
+        try:
+            res = await self._request(endpoint.session, url, stream, proxy=endpoint.proxy)
+        except AccessDenied as e:
+            self.egress.failure(endpoint, denied=True, retry_after=e.retry_after)
+            raise
+        except HTTPStatusError:
+            # error of the site itself, the endpoint delivered it
+            self.egress.success(endpoint, time.monotonic() - _start)
+            raise
+        except asyncio.TimeoutError:
+            self.egress.failure(endpoint)
+            raise
+        except aiohttp.ClientError as e:
+            # proxy refused or broke the connection, retried through another endpoint
+            self.egress.failure(endpoint)
+            raise ConnectionError(f'Request to {url} through {endpoint.name} failed: {e!r}') from e
+        else:
+            self.egress.success(endpoint, time.monotonic() - _start)
+            return res
+        finally:
+            self.egress.release(endpoint)
+
+    async def _session_request(self, url, stream: bool = False):
+        if self.egress is not None and self.egress.opened:
+            return await self._egress_request(url, stream)
+        if self.session is None:
+            # standalone call outside of run(), no pool to reuse
             async with aiohttp.ClientSession() as session:
-                async with session.get(url) as r:
-                    if r.status==200:
-                        msg = f'Crawler requested to {url}'
-                        self.logger.info(msg)
-                        self._cache[url] = await r.text()
-                        return self._cache[url]
-                    elif r.status==503:
-                        msg = f'Access denied to {url}. Code 503'
-                        self.logger.error(msg)
-                        raise ConnectionError(msg)
-                    else:
-                        msg = f'Request to {url} failed with code {r.status}'
-                        self.logger.error(msg)
-                        raise ConnectionError(msg)
+                return await self._request(session, url, stream)
+        return await self._request(self.session, url, stream)
+
+    @_async_retry
+    async def _fetch_url(self, url, stream: bool = False):
+        if self.budget is not None:
+            self.budget.acquire(self.bytes_received)
+        if self.limiter is None:
+            try:
+                return await self._session_request(url, stream)
+            except asyncio.TimeoutError:
+                raise ConnectionError(f'Request to {url} timed out')
+        epoch = await self.limiter.acquire()
+        _start = time.monotonic()
+        try:
+            text = await self._session_request(url, stream)
+        except AccessDenied as e:
+            # with an egress pool Retry-After pauses only the endpoint that got it
+            self.limiter.failure(epoch, e.retry_after if self.egress is None else None)
+            raise
+        except asyncio.TimeoutError:
+            self.limiter.failure(epoch)
+            raise ConnectionError(f'Request to {url} timed out')
+        else:
+            self.limiter.success(epoch, time.monotonic() - _start)
+            return text
+        finally:
+            await self.limiter.release()
+
+    def _forget(self, key, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # failure is delivered to the callers, mark it retrieved
+            task.exception()
+
+    async def _single_flight(self, url, stream: bool = False):
+        # streamed and plain results differ, they are coalesced separately
+        key = (normalize_url(url), stream)
+        task = self._in_flight.get(key, None)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_url(url, stream))
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self._in_flight[key] = task
         else:
-            return self._cache[url]
+            self.coalesced += 1
+            self.logger.info(f'Coalesced request to {url}')
+        # one caller being cancelled must not cancel the shared request
+        return await asyncio.shield(task)
+
+    async def fetch_url(self, url):
+        text = self._cache.get(url, None)
+        if text is not None:
+            return text
+        return await self._single_flight(url)
+
+    async def fetch_business_page(self, url):
+        '''
+        Fields of a business page with the streaming parse: returns values
+        of parse_business_page and number of body bytes read.
+        '''
+        text = self._cache.get(url, None)
+        if text is not None:
+            return await self.parse(parse_business_page, text, self.max_reviews), len(text.encode('utf-8'))
+        return await self._single_flight(url, stream=True)
 
     def get_search_url(self,
                         desc='Contractors',
                         loc='San Francisco, CA',
                         page=0):
-        api_url = 'https://www.yelp.com/search?{query}'
+        api_url = self.base_url + '/search?{query}'
         api_query = {
             'find_desc': desc,
             'find_loc': loc,
@@ -102,11 +558,15 @@ class Crawler():
         url = self.get_search_url(
                         desc=desc,
                         loc=loc)
-        res = await self.fetch_url(url)
-        page = html.fromstring(res)
-        total_pages = get_digits(page.xpath('//div[contains(@class, "pagination_")]/div[2]/span/text()'))[-1]
-        self._cache[url]=res
-        return int(total_pages)
+        if self.state is not None and self.state.total_pages(url):
+            return self.state.total_pages(url)
+        text = await self.fetch_url(url)
+        page = await self.parse(parse_search_page, text, self.base_url, self.max_business)
+        # first page is parsed once, businesses are reused by the search stage
+        self._search_pages[url] = page
+        if self.state is not None:
+            self.state.set_total_pages(url, page['total_pages'] or 1)
+        return page['total_pages'] or 1
 
     async def generate_searches(self,
                     desc='Contractors',
@@ -125,95 +585,437 @@ class Crawler():
                         loc=loc,
                         page=page)
 
-    async def fetch_searches(self, *args, **kwargs):
-        urls = self.generate_searches(*args, **kwargs)
-        self.tasks = []
-        _urls = []
-        async for url in urls:
-            self.tasks.append(self.fetch_url(url))
-            _urls.append(url)
-        await asyncio.gather(*self.tasks)
-        return _urls
-
-    def generate_review_queue(self, _urls: list):
-        self.tasks = []
-        for url in _urls:
-            search_html = self._cache.get(url, None)
-            if search_html!=None:
-                page = html.fromstring(search_html)
-                businesses = page.xpath('//div[contains(@class, "mainAttributes")]')
-                if self.max_business:
-                    businesses = businesses[:self.max_business]
-                for business in businesses:
-                    business_url = business.xpath('.//div[1]/div/div/div/h3/span/a/@href')
-                    business_url = get_href(business_url)
-                    self.logger.info(f'Extracted business Yelp URL {business_url}')
-                    self.tasks.append(self.fetch_url(business_url))
-
-    def generate_business_obj_queue(self, _urls: list):
-        for url in _urls:
-            search_html = self._cache.get(url, None)
-            if search_html != None:
-                page = html.fromstring(search_html)
-                businesses = page.xpath('//div[contains(@class, "mainAttributes")]')[:self.max_business]
-                if self.max_business:
-                    businesses = businesses[:self.max_business]
-                for business in businesses:
-                    business_body = self.fetch_business(business)
-                    yield business_body
+    async def parse_search(self, url: str, text: str = None) -> list:
+        page = self._search_pages.pop(url, None)
+        if page is None:
+            text = text if text is not None else self._cache[url]
+            page = await self.parse(parse_search_page, text, self.base_url, self.max_business)
+        return [Business(None, domain=self.base_url).update(values) for values in page['businesses']]
 
     def fetch_business(self, business: html.HtmlElement):
-        business_body = Business(business)
-        business_body.business_name = './/div[1]/div/div/div/h3/span/a/text()'
-        business_body.business_yelp_url = './/div[1]/div/div/div/h3/span/a/@href'
-        business_body.business_rating = './/span[re:match(text(),"\d.\d")]/text()'
-        business_body.number_of_reviews = './/span[contains(text(),"review")]/text()'
-        return business_body
+        return extract_business(business, self.base_url)
+
+    def review_page_urls(self, business_body: Business) -> list:
+        '''
+        URLs of review pages after the first one needed for 'max_reviews' reviews.
+        '''
+        if not self.max_reviews or not business_body.number_of_reviews:
+            return []
+        needed = min(self.max_reviews, business_body.number_of_reviews)
+        return [review_page_url(business_body.business_yelp_url, start)
+                for start in range(self.reviews_per_page, needed, self.reviews_per_page)]
+
+    async def submit_review_pages(self, business_body: Business, priority: float = 0) -> list:
+        '''
+        Submits all further review pages of the business at once, so they
+        do not wait for each other.
+        '''
+        pages = []
+        for url in self.review_page_urls(business_body):
+            pages.append(await self.scheduler.submit_url(self.fetch_url, url, priority=priority))
+        self.metrics.inc('review_pages', len(pages))
+        return pages
+
+    async def business_values(self, future: asyncio.Future, pages: list = (), stream: bool = False) -> tuple:
+        '''
+        Fields of a business page with reviews of its further review pages
+        merged in, and number of body bytes of all pages.
+        '''
+        # every future is awaited, so a failure of one does not leave the others unretrieved
+        first, *texts = await asyncio.gather(future, *pages, return_exceptions=True)
+        for res in (first, *texts):
+            if isinstance(res, BaseException):
+                raise res
+        if stream:
+            values, size = first
+            # coalesced callers share the values of one streamed page
+            values = dict(values)
+        else:
+            size = len(first.encode('utf-8'))
+            values = await self.parse(parse_business_page, first, self.max_reviews)
+        if texts:
+            reviews = [values['reviews']]
+            for text in texts:
+                size += len(text.encode('utf-8'))
+                reviews.append((await self.parse(parse_business_page, text, self.max_reviews))['reviews'])
+            values['reviews'] = merge_reviews(reviews, self.max_reviews, self.reviews_per_page)
+        return values, size
+
+    async def _business_stage(self, business_body: Business, future: asyncio.Future, results: asyncio.Queue,
+                              pages: list = ()):
+        try:
+            values, size = await self.business_values(future, pages, self.stream_parse)
+            if self.previous is not None:
+                self.previous.fetched_page(size)
+            business_body.update(values)
+            if self.state is not None:
+                self.state.mark_business(business_body.business_yelp_url, dict(business_body))
+        except BudgetExhausted:
+            # stays pending, reported as skipped
+            return
+        except Exception as e:
+            business_body = e
+        await results.put(business_body)
+        if not isinstance(business_body, Exception):
+            self.pending.pop(business_body.business_yelp_url, None)
+
+    async def _search_stage(self, url: str, results: asyncio.Queue, spawn):
+        if self.state is not None and self.state.search_done(url):
+            self.logger.info(f'Resumed search page {url}')
+            businesses = [Business(None, domain=self.base_url).update(values)
+                          for values in self.state.pending_businesses(url)]
+        else:
+            try:
+                # with 'priority' search pages go first, they bring the signals
+                future = await self.scheduler.submit_url(self.fetch_url, url,
+                                                         priority=-math.inf if self.priority else 0)
+                businesses = await self.parse_search(url, await future)
+            except BudgetExhausted:
+                return
+            except Exception as e:
+                await results.put(e)
+                return
+            if self.state is not None:
+                self.state.mark_search(url, [dict(business_body) for business_body in businesses])
+        self.pending.pop(url, None)
+        start = int(dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query)).get('start', 0))
+        for rank, business_body in enumerate(businesses, start):
+            if self.state is not None and self.state.business_done(business_body.business_yelp_url):
+                continue
+            if business_body.business_yelp_url in self.businesses:
+                self.duplicates += 1
+                continue
+            self.businesses[business_body.business_yelp_url] = url
+            if self.previous is not None:
+                record = self.previous.carry_over(dict(business_body))
+                if record is not None:
+                    business_body = Business(None, domain=self.base_url).update(record)
+                    if self.state is not None:
+                        self.state.mark_business(business_body.business_yelp_url, record)
+                    await results.put(business_body)
+                    continue
+            self.logger.info(f'Extracted business Yelp URL {business_body.business_yelp_url}')
+            self.pending[business_body.business_yelp_url] = dict(business_body)
+            if self.budget is not None and self.budget.exhausted:
+                continue
+            priority = self.priority(business_body, rank) if self.priority else 0
+            fetch = self.fetch_business_page if self.stream_parse else self.fetch_url
+            future = await self.scheduler.submit_url(fetch, business_body.business_yelp_url, priority=priority)
+            pages = await self.submit_review_pages(business_body, priority)
+            spawn(self._business_stage(business_body, future, results, pages))
 
     async def fetch_details(self, *args, **kwargs):
-        res = await self.fetch_searches(*args, **kwargs)
-        self.generate_review_queue(res)
-        await asyncio.gather(*self.tasks)
-        for business in self.generate_business_obj_queue(res):
-            business_body = self.fetch_reviews(business)
-            print(business_body)
-            yield business_body
-
-    def fetch_reviews(self, business_body: Business):
-        page = html.fromstring(self._cache[business_body.business_yelp_url])
-        business_body.business_website = page.xpath('//a[contains(@href, "biz_redir")]/text()')
-        reviews = page.xpath('//ul[contains(@class, "undefined list")]/li/div')
-        reviews = list(filter(lambda x: b"user-passport-info" in html.tostring(x), reviews))
-        if self.max_reviews:
-            reviews = reviews[:self.max_reviews]
-
-        for review in reviews:
-            review_body = Review(review)
-            review_body.reviewer_name = './/div[contains(@class, "user-passport-info")]/span/a/text()'
-            review_body.reviewer_location = './/div[contains(@class, "user-passport-info")]/div/div/span/text()'
-            review_body.review_date = './/div[2]/div/div[2]/span/text()'
-            business_body.reviews.append(dict(review_body))
-        # print(business_body)
-        return business_body
+        '''
+        Streaming pipeline: a search page is parsed as soon as it arrives,
+        its business pages are queued right away and every business is
+        yielded as soon as its page is fetched (in order of completion).
+        '''
+        results = asyncio.Queue(maxsize=self.scheduler.queue_size)
+        tasks = set()
+        done = object()
+
+        def spawn(coro):
+            task = asyncio.create_task(coro)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        async def produce():
+            try:
+                async for url in self.generate_searches(*args, **kwargs):
+                    self.pending[url] = None
+                    spawn(self._search_stage(url, results, spawn))
+            except BudgetExhausted:
+                pass
+            except Exception as e:
+                await results.put(e)
+            while tasks:
+                await asyncio.wait(set(tasks))
+            await results.put(done)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                try:
+                    business_body = await asyncio.wait_for(results.get(), self._time_left())
+                except asyncio.TimeoutError:
+                    self.budget.check()
+                    self.logger.warning('Deadline of the crawl budget reached, pending pages are skipped')
+                    # businesses already fetched are still written
+                    while not results.empty():
+                        business_body = results.get_nowait()
+                        if isinstance(business_body, Business):
+                            print(business_body)
+                            yield business_body
+                    break
+                if business_body is done:
+                    break
+                if isinstance(business_body, Exception):
+                    raise business_body
+                print(business_body)
+                yield business_body
+        finally:
+            producer.cancel()
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(producer, *tasks, return_exceptions=True)
+
+    def _time_left(self) -> float:
+        return self.budget.remaining() if self.budget is not None else None
+
+    def _collect_skipped(self):
+        '''
+        Moves what is still pending into 'skipped' once the budget is exhausted.
+        '''
+        for url, record in self.pending.items():
+            if record is None:
+                self.skipped['search_pages'].append(url)
+            else:
+                self.skipped['businesses'].append(record)
+        self.pending.clear()
+
+    def _write_skipped(self, gathered: int):
+        if self.budget is None:
+            return
+        self._collect_skipped()
+        summary = {
+            'budget': self.budget.stats(self.bytes_received),
+            'gathered': gathered,
+            'skipped_queries': self.skipped['queries'],
+            'skipped_search_pages': self.skipped['search_pages'],
+            'skipped_businesses': self.skipped['businesses'],
+        }
+        self.logger.info(f'Crawl budget: {summary["budget"]}, skipped {len(self.skipped["search_pages"])} '
+                         f'search pages and {len(self.skipped["businesses"])} businesses')
+        if self.skipped_fn:
+            with open(self.skipped_fn, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+
+    def _profile_stage(self, name: str):
+        if self.profiler is not None:
+            self.profiler.stage(name)
+
+    async def _start(self):
+        # businesses are deduplicated within one run or batch
+        self.businesses.clear()
+        self.duplicates = 0
+        self.pending.clear()
+        self.skipped = {'queries': [], 'search_pages': [], 'businesses': []}
+        self.bytes_received = 0
+        self.metrics.reset()
+        if self.budget is not None:
+            self.budget.start()
+        if self.stats_interval:
+            self._stats_task = asyncio.create_task(self._report_stats())
+        if self.previous_fn:
+            # loaded before the state file is reset, it may be the same file
+            self.previous = PreviousCrawl(self.previous_fn, self.previous_ttl)
+            self.logger.info(f'Loaded {len(self.previous)} businesses of previous crawl from {self.previous_fn}')
+        if self.state_fn:
+            self.state = CrawlState(self.state_fn)
+            if not self.resume:
+                self.state.reset()
+        self._cache.open()
+        if self.validators is not None:
+            self.validators.open()
+        await self.open_session()
+        self.open_parse_pool()
+
+    def _gauges(self) -> dict:
+        cache = self._cache.stats()
+        lookups = cache['hits'] + cache['misses']
+        return {
+            'cache_hit_ratio': round(cache['hits'] / lookups, 4) if lookups else 0.0,
+            'queue_depth': self.scheduler.queue_depth,
+            'in_flight': self.scheduler.in_flight,
+        }
+
+    def _write_prometheus(self):
+        # replaced atomically, a scraper never reads a half-written file
+        with open(self.prometheus_fn + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(self.metrics.prometheus(**self._gauges()))
+        os.replace(self.prometheus_fn + '.tmp', self.prometheus_fn)
+
+    async def _report_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            line = self.metrics.line(**self._gauges())
+            print(f'Stats: {line}')
+            self.logger.info(f'Stats: {line}')
+            if self.prometheus_fn:
+                self._write_prometheus()
+
+    def _metrics_summary(self) -> dict:
+        summary = self.metrics.summary(cache=dict(self._cache.stats(), hit_ratio=self._gauges()['cache_hit_ratio']),
+                                       scheduler=self.scheduler.stats(),
+                                       coalesced=self.coalesced)
+        if self.limiter is not None:
+            summary['limiter'] = self.limiter.stats()
+        if self.budget is not None:
+            summary['budget'] = self.budget.stats(self.bytes_received)
+        if self.egress is not None:
+            summary['egress'] = self.egress.stats()
+        return summary
+
+    async def _finish(self):
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+            await asyncio.gather(self._stats_task, return_exceptions=True)
+            self._stats_task = None
+        summary = self._metrics_summary()
+        self.logger.info(f'Metrics: {json.dumps(summary)}')
+        if self.metrics_fn:
+            with open(self.metrics_fn, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+        if self.prometheus_fn:
+            self._write_prometheus()
+        self.logger.info(f'Scheduler stats: {self.scheduler.stats()}')
+        self.logger.info(f'Cache stats: {self._cache.stats()}')
+        self.logger.info(f'Coalesced requests: {self.coalesced}')
+        if self.duplicates:
+            self.logger.info(f'Duplicate businesses skipped: {self.duplicates}')
+        if self.limiter is not None:
+            self.logger.info(f'Adaptive limiter: {self.limiter.stats()}')
+        if self.validators is not None:
+            self.logger.info(f'Conditional requests: {self.validators.stats()}')
+        if self.egress is not None:
+            for stats in self.egress.stats():
+                self.logger.info(f'Egress endpoint: {stats}')
+        await self.scheduler.close()
+        await self.close_session()
+        self.close_parse_pool()
+        # pages written since the last commit are committed, the next run opens it again
+        self._cache.close()
+        if self.validators is not None:
+            self.validators.close()
+        if self.state is not None:
+            self.state.close()
+            self.state = None
+
+    def _resume(self, writer, search_prefix: str = None) -> int:
+        if self.state is None or not self.resume:
+            return 0
+        for record in self.state.finished(search_prefix=search_prefix):
+            writer.write(record)
+        self.logger.info(f'Resumed {writer.count} finished businesses from {self.state_fn}')
+        return writer.count
+
+    async def _gather(self, writer, category_name: str, location: str, _start: float):
+        async for business_body in self.fetch_details(desc=category_name, loc=location):
+            if self._first is None:
+                self._first = time.time()
+                self.logger.info(f'First business gathered in {round(self._first-_start, 3)} s.')
+                self._profile_stage('first_business')
+            writer.write(dict(business_body))
+
+    def _report(self, gathered: int, resumed: int, elapsed: float, queries: int = None):
+        print('Report'.center(20, '-'))
+        if queries is not None:
+            print('Queries:  ', queries)
+        print('Gathered: ', gathered)
+        if resumed:
+            print('Resumed:  ', resumed)
+        if self.duplicates:
+            print('Duplicates:', self.duplicates)
+        if self.previous is not None:
+            report = self.previous.report()
+            print('Unchanged:', report['skipped'])
+            print('Saved (KB):', report['saved_bytes'] // 1024)
+            self.logger.info(f'Incremental crawl: {report}')
+        if self.budget is not None and self.budget.exhausted:
+            print('Budget:   ', self.budget.exhausted)
+            print('Skipped:  ', len(self.skipped['businesses']))
+        if self.egress is not None:
+            for stats in self.egress.stats():
+                print(f'Egress:    {stats["endpoint"]}: {stats["successes"]}/{stats["requests"]} ok, '
+                      f'{stats["denied"]} denied, latency {stats["latency_ms"]} ms, {stats["cooldowns"]} cooldowns')
+        print('Time (s): ', round(elapsed, 3))
+
+        msg = f'Crawler finished. Gathered {gathered} for {round(elapsed, 3)} s.'
+        self.logger.info(msg)
 
     async def run(self,
             category_name: str ='Contractors',
             location: str ='San Francisco, CA', *args, **kwargs):
-        res = []
         _start = time.time()
-        async for business_body in self.fetch_details(desc=category_name, loc=location):
-            res.append(dict(business_body))
+        self._first = None
+        writer = open_writer(self.output_fn, self.output_format, self.output_compress, self.flush_interval)
+        await self._start()
+        self._profile_stage('setup')
+        try:
+            with writer:
+                resumed = self._resume(writer)
+                await self._gather(writer, category_name, location, _start)
+            self._profile_stage('crawl')
+        finally:
+            await self._finish()
+            self._profile_stage('finish')
+        self._write_skipped(writer.count)
+        self._report(writer.count, resumed, time.time() - _start)
 
-        with open(self.output_fn, 'w', encoding='utf-8') as f:
-            f.write(json.dumps(res, indent=2))
-        _end = time.time()
+    async def run_batch(self,
+            queries: list,
+            per_query: bool = False,
+            query_concurrency: int = 4):
+        '''
+        Crawls many (category_name, location) queries in one process: all of
+        them share the session, cache, scheduler and parse pool, up to
+        'query_concurrency' queries are crawled at once. A business found by
+        several queries is fetched and written once, by the first query.
+        Results stream to 'output_fn' or, with per_query=True, to one file
+        per query (see 'query_output_fn').
+        '''
+        _start = time.time()
+        self._first = None
+        queries = list(queries)
+        semaphore = asyncio.Semaphore(query_concurrency)
+        gathered = resumed = 0
+        combined = None
+        if not per_query:
+            combined = open_writer(self.output_fn, self.output_format, self.output_compress, self.flush_interval)
 
-        print('Report'.center(20, '-'))
-        print('Gathered: ', len(res))
-        print('Time (s): ', round(_end-_start, 3))
+        async def crawl(category_name, location):
+            nonlocal gathered, resumed
+            async with semaphore:
+                if self.budget is not None and self.budget.check(self.bytes_received):
+                    self.skipped['queries'].append([category_name, location])
+                    return
+                self.logger.info(f'Started query {category_name} in {location}')
+                if combined is not None:
+                    count = combined.count
+                    await self._gather(combined, category_name, location, _start)
+                    gathered += combined.count - count
+                    return
+                fn = query_output_fn(self.output_fn, category_name, location)
+                writer = open_writer(fn, self.output_format, self.output_compress, self.flush_interval)
+                with writer:
+                    # search URLs of the query differ only by trailing page offset
+                    prefix = self.get_search_url(desc=category_name, loc=location).rsplit('start=', 1)[0]
+                    count = self._resume(writer, prefix)
+                    resumed += count
+                    await self._gather(writer, category_name, location, _start)
+                gathered += writer.count - count
 
-        msg = f'Crawler finished. Gathered {len(res)} for {round(_end-_start, 3)} s.'
-        self.logger.info(msg)
+        await self._start()
+        self._profile_stage('setup')
+        try:
+            if combined is not None:
+                combined.open()
+                resumed = self._resume(combined)
+            tasks = [asyncio.create_task(crawl(category_name, location)) for category_name, location in queries]
+            try:
+                await asyncio.gather(*tasks)
+                self._profile_stage('crawl')
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            if combined is not None:
+                combined.close()
+            await self._finish()
+            self._profile_stage('finish')
+        self._write_skipped(gathered + resumed)
+        self._report(gathered + resumed, resumed, time.time() - _start, queries=len(queries))
 
 if __name__=='__main__':
     crwl = Crawler(max_reviews=5, max_pages=1, output_fn='sample.json')
@@ -0,0 +1,88 @@
+'''
+Crawl budgets of Yelp Crawler.
+
+A budget bounds one run (or batch) of the crawler:
+- deadline: seconds of wall time from the start of the run
+- max_requests: number of HTTP requests sent, retries included (pages
+  served from the cache are free)
+- max_bytes: number of body bytes received
+
+Once any limit is reached the budget stays exhausted for the rest of the
+run: no new request is sent ('acquire' raises 'BudgetExhausted'), the
+businesses already fetched are written and the search and business pages
+left out are listed in the skipped summary (Crawler 'skipped_fn').
+
+Example:
+    >>> from YelpCrawler.budget import Budget
+    >>> budget = Budget(deadline=600, max_requests=5000).start()
+    >>> budget.acquire(nbytes=0)  # before every request
+    >>> budget.stats(nbytes=0)
+    {'deadline': 600, 'max_requests': 5000, 'max_bytes': None, 'elapsed': 0.0, 'requests': 1, 'bytes': 0, 'exhausted': None}
+'''
+import time
+
+
+class BudgetExhausted(Exception):
+    def __init__(self, reason: str):
+        super(BudgetExhausted, self).__init__(f'Crawl budget exhausted: {reason}')
+        self.reason = reason
+
+
+class Budget(object):
+    def __init__(self, deadline: float = None, max_requests: int = None, max_bytes: int = None):
+        self.deadline = deadline
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.started = time.monotonic()
+        self.requests = 0
+        # 'deadline', 'requests' or 'bytes' once the budget is exhausted
+        self.exhausted = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.exhausted = None
+        return self
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        '''
+        Seconds left before the deadline, None without deadline.
+        '''
+        if self.deadline is None:
+            return None
+        return max(self.deadline - self.elapsed, 0.0)
+
+    def check(self, nbytes: int = 0) -> str:
+        if self.exhausted is None:
+            if self.deadline is not None and self.elapsed >= self.deadline:
+                self.exhausted = 'deadline'
+            elif self.max_requests is not None and self.requests >= self.max_requests:
+                self.exhausted = 'requests'
+            elif self.max_bytes is not None and nbytes >= self.max_bytes:
+                self.exhausted = 'bytes'
+        return self.exhausted
+
+    def acquire(self, nbytes: int = 0):
+        '''
+        Counts one request, raises BudgetExhausted when it is over the budget.
+        'nbytes' is the number of bytes received so far.
+        '''
+        reason = self.check(nbytes)
+        if reason is not None:
+            raise BudgetExhausted(reason)
+        self.requests += 1
+
+    def stats(self, nbytes: int = 0) -> dict:
+        return {
+            'deadline': self.deadline,
+            'max_requests': self.max_requests,
+            'max_bytes': self.max_bytes,
+            'elapsed': round(self.elapsed, 3),
+            'requests': self.requests,
+            'bytes': nbytes,
+            'exhausted': self.exhausted,
+        }
@@ -0,0 +1,262 @@
+'''
+Response cache used by Yelp Crawler.fetch_url.
+
+'MemoryCache' keeps pages in memory within a size budget:
+- max_size: total size of stored pages in characters, least recently used
+  pages are evicted first
+- ttl: seconds a page stays valid (None - forever)
+
+'DiskCache' keeps pages zlib-compressed in a SQLite file, so repeated runs
+over the same category reuse pages without hitting the network. Writes are
+committed at most every 'commit_interval' seconds and on 'close', a closed
+cache is opened again by 'open'.
+
+'Cache' puts the memory cache in front of optional disk cache, it behaves
+like a dict (get, [], in) and counts hits, misses and evictions.
+
+'ValidatorStore' keeps ETag/Last-Modified of pages for conditional requests,
+its writes are committed like those of 'DiskCache'.
+
+Example:
+    >>> from YelpCrawler.cache import Cache
+    >>> cache = Cache(max_size=32 * 2**20, fn='cache.db', ttl=24 * 3600)
+    >>> cache['https://www.yelp.com/biz/sample'] = '<html>...</html>'
+    >>> cache.get('https://www.yelp.com/biz/sample')
+    '<html>...</html>'
+    >>> cache.stats()
+    {'hits': 1, 'misses': 0, 'evictions': 0, 'size': 16, 'pages': 1}
+'''
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+
+
+class MemoryCache(object):
+    def __init__(self, max_size: int = 64 * 2**20, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self.evictions = 0
+        self._pages = OrderedDict()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, url: str):
+        item = self._pages.get(url, None)
+        if item is None:
+            return None
+        text, expires = item
+        if expires is not None and expires < time.time():
+            self.pop(url)
+            return None
+        self._pages.move_to_end(url)
+        return text
+
+    def set(self, url: str, text: str, ttl: float = None):
+        self.pop(url)
+        ttl = ttl if ttl is not None else self.ttl
+        self._pages[url] = (text, time.time() + ttl if ttl is not None else None)
+        self.size += len(text)
+        while self.size > self.max_size and len(self._pages) > 1:
+            _, (old, _) = self._pages.popitem(last=False)
+            self.size -= len(old)
+            self.evictions += 1
+
+    def pop(self, url: str):
+        item = self._pages.pop(url, None)
+        if item is not None:
+            self.size -= len(item[0])
+        return item
+
+    def clear(self):
+        self._pages.clear()
+        self.size = 0
+
+
+class DiskCache(object):
+    def __init__(self, fn: str, ttl: float = None, level: int = 6, commit_interval: float = 1.0):
+        self.fn = fn
+        self.ttl = ttl
+        self.level = level
+        self.commit_interval = commit_interval
+        self._db = None
+        self.open()
+
+    def open(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.fn)
+            self._db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                             'url TEXT PRIMARY KEY, body BLOB, stored_at REAL)')
+            self._db.commit()
+            self._committed = time.monotonic()
+        return self
+
+    def commit(self):
+        self._db.commit()
+        self._committed = time.monotonic()
+
+    def _written(self):
+        # one transaction per interval instead of one per page
+        if time.monotonic() - self._committed >= self.commit_interval:
+            self.commit()
+
+    def get(self, url: str):
+        row = self._db.execute('SELECT body, stored_at FROM pages WHERE url=?', (url,)).fetchone()
+        if row is None:
+            return None
+        body, stored_at = row
+        if self.ttl is not None and stored_at + self.ttl < time.time():
+            self.pop(url)
+            return None
+        return zlib.decompress(body).decode('utf-8')
+
+    def set(self, url: str, text: str):
+        body = zlib.compress(text.encode('utf-8'), self.level)
+        self._db.execute('INSERT OR REPLACE INTO pages (url, body, stored_at) VALUES (?, ?, ?)',
+                         (url, body, time.time()))
+        self._written()
+
+    def pop(self, url: str):
+        self._db.execute('DELETE FROM pages WHERE url=?', (url,))
+        self._written()
+
+    def clear(self):
+        self._db.execute('DELETE FROM pages')
+        self.commit()
+
+    def close(self):
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+
+class Cache(object):
+    def __init__(self, max_size: int = 64 * 2**20, fn: str = None, ttl: float = None):
+        self.memory = MemoryCache(max_size=max_size, ttl=ttl)
+        self.disk = DiskCache(fn, ttl=ttl) if fn else None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str, default=None):
+        text = self.memory.get(url)
+        if text is None and self.disk is not None:
+            text = self.disk.get(url)
+            if text is not None:
+                self.memory.set(url, text)
+        if text is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return text
+
+    def __getitem__(self, url: str):
+        text = self.get(url)
+        if text is None:
+            raise KeyError(url)
+        return text
+
+    def __setitem__(self, url: str, text: str):
+        self.memory.set(url, text)
+        if self.disk is not None:
+            self.disk.set(url, text)
+
+    def __contains__(self, url: str):
+        return self.memory.get(url) is not None or (self.disk is not None and self.disk.get(url) is not None)
+
+    def __len__(self):
+        return len(self.memory)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def open(self):
+        if self.disk is not None:
+            self.disk.open()
+        return self
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.memory.evictions,
+            'size': self.memory.size,
+            'pages': len(self.memory),
+        }
+
+
+class ValidatorStore(object):
+    '''
+    ETag/Last-Modified validators of fetched pages with their bodies, kept
+    in a SQLite file. Later runs send them as If-None-Match/If-Modified-Since
+    and serve the stored body on '304 Not Modified'.
+    '''
+    def __init__(self, fn: str, level: int = 6, commit_interval: float = 1.0):
+        self.fn = fn
+        self.level = level
+        self.commit_interval = commit_interval
+        self.not_modified = 0
+        self.bytes_saved = 0
+        self._db = None
+        self.open()
+
+    def open(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.fn)
+            self._db.execute('CREATE TABLE IF NOT EXISTS validators ('
+                             'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body BLOB, stored_at REAL)')
+            self._db.commit()
+            self._committed = time.monotonic()
+        return self
+
+    def commit(self):
+        self._db.commit()
+        self._committed = time.monotonic()
+
+    def headers(self, url: str) -> dict:
+        row = self._db.execute('SELECT etag, last_modified FROM validators WHERE url=?', (url,)).fetchone()
+        if row is None:
+            return {}
+        etag, last_modified = row
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def set(self, url: str, etag: str, last_modified: str, text: str):
+        body = zlib.compress(text.encode('utf-8'), self.level)
+        self._db.execute('INSERT OR REPLACE INTO validators (url, etag, last_modified, body, stored_at) '
+                         'VALUES (?, ?, ?, ?, ?)', (url, etag, last_modified, body, time.time()))
+        if time.monotonic() - self._committed >= self.commit_interval:
+            self.commit()
+
+    def body(self, url: str):
+        '''
+        Stored body served for '304 Not Modified', counted as saved bytes.
+        '''
+        row = self._db.execute('SELECT body FROM validators WHERE url=?', (url,)).fetchone()
+        if row is None:
+            return None
+        text = zlib.decompress(row[0]).decode('utf-8')
+        self.not_modified += 1
+        self.bytes_saved += len(text.encode('utf-8'))
+        return text
+
+    def close(self):
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+    def stats(self):
+        return {'not_modified': self.not_modified, 'bytes_saved': self.bytes_saved}
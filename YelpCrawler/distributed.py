@@ -0,0 +1,380 @@
+'''
+Sharded crawling by many worker processes over a shared work queue.
+
+'WorkQueue' keeps search-page and business-page jobs in a SQLite file, no
+external broker is needed. Workers lease jobs for 'lease_time' seconds, a
+job whose worker died is leased again once its lease expires. A job URL is
+queued once, so a business found on several search pages is fetched once.
+A finished job and the jobs it discovered are committed together. The
+queue keeps the id of its crawl ('crawl_id'), a new one is made when the
+queue is seeded again, shards of the crawl's workers carry it.
+
+'Worker' runs one Crawler (its session, cache, scheduler and parsers) over
+the queue:
+- search job: the page is fetched and parsed, its businesses are queued,
+  the first page of a query also queues the remaining pages
+- business job: the business page is fetched and parsed, the record is
+  written to the worker's shard ('shard_output_fn')
+
+'run_distributed' seeds the queue with queries, starts local worker
+processes and, once the queue is drained and no worker failed, merges the
+shards of the crawl into 'output_fn' ('merge_shards'). Every worker run
+writes a new shard, so a resumed crawl (resume=True) merges shards of the
+interrupted run too, along with records already merged into 'output_fn'.
+Shards are kept unless remove_shards=True.
+Workers on other hosts sharing the filesystem join the same queue with
+'run_worker' (use wal=False on network filesystems, SQLite WAL needs
+shared memory).
+
+Example:
+    >>> from YelpCrawler.distributed import run_distributed
+    >>> run_distributed([('Contractors', 'San Francisco, CA')], 'queue.db', workers=4,
+    ...                 output_fn='output.json', max_reviews=5)
+    {'pending': 0, 'leased': 0, 'done': 3010, 'failed': 0}
+'''
+import asyncio
+import glob
+import json
+import multiprocessing
+import os
+import socket
+import logging
+import sqlite3
+import time
+import uuid
+from YelpCrawler.api import Crawler
+from YelpCrawler.output import open_writer, read_records
+from YelpCrawler.parsers import parse_search_page
+from YelpCrawler.structures import Business
+
+SEARCH = 'search'
+BUSINESS = 'business'
+
+
+class WorkQueue(object):
+    def __init__(self, fn: str, lease_time: float = 60, max_attempts: int = 3, wal: bool = True):
+        self.fn = fn
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        # autocommit, transactions are opened explicitly with BEGIN IMMEDIATE
+        self._db = sqlite3.connect(fn, timeout=60, isolation_level=None)
+        if wal:
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                         'id INTEGER PRIMARY KEY, kind TEXT, url TEXT UNIQUE, payload TEXT, '
+                         "status TEXT DEFAULT 'pending', worker TEXT, lease_until REAL, "
+                         'attempts INTEGER DEFAULT 0, error TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _insert(self, jobs: list):
+        self._db.executemany('INSERT OR IGNORE INTO jobs (kind, url, payload) VALUES (?, ?, ?)',
+                             [(kind, url, json.dumps(payload)) for kind, url, payload in jobs])
+
+    def put(self, jobs: list):
+        '''
+        Queues (kind, url, payload) jobs, URLs already queued are ignored.
+        '''
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._insert(jobs)
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+    def lease(self, worker: str, count: int = 1) -> list:
+        '''
+        Leases up to 'count' pending (or expired) jobs, returns (id, kind, url, payload).
+        '''
+        now = time.time()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self._db.execute("SELECT id, kind, url, payload FROM jobs WHERE status='pending' "
+                                    "OR (status='leased' AND lease_until<?) ORDER BY id LIMIT ?",
+                                    (now, count)).fetchall()
+            self._db.executemany("UPDATE jobs SET status='leased', worker=?, lease_until=?, attempts=attempts+1 "
+                                 "WHERE id=?", [(worker, now + self.lease_time, row[0]) for row in rows])
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+        return [(job_id, kind, url, json.loads(payload)) for job_id, kind, url, payload in rows]
+
+    def complete(self, job_id: int, jobs: list = ()):
+        '''
+        Marks the job done and queues the jobs it discovered in one transaction.
+        '''
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._insert(jobs)
+            self._db.execute("UPDATE jobs SET status='done', lease_until=NULL WHERE id=?", (job_id,))
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+    def fail(self, job_id: int, error: str):
+        '''
+        Returns the job to the queue, after 'max_attempts' it is marked failed.
+        '''
+        self._db.execute("UPDATE jobs SET status=CASE WHEN attempts>=? THEN 'failed' ELSE 'pending' END, "
+                         "lease_until=NULL, error=? WHERE id=?", (self.max_attempts, error, job_id))
+
+    def stats(self):
+        res = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        for status, count in self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status'):
+            res[status] = count
+        return res
+
+    def finished(self) -> bool:
+        row = self._db.execute("SELECT 1 FROM jobs WHERE status IN ('pending', 'leased') LIMIT 1").fetchone()
+        return row is None
+
+    def crawl_id(self) -> str:
+        self._db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('crawl_id', ?)", (uuid.uuid4().hex[:8],))
+        return self._db.execute("SELECT value FROM meta WHERE key='crawl_id'").fetchone()[0]
+
+    def reset(self):
+        '''
+        Drops all jobs, the next seeded crawl gets a new 'crawl_id'.
+        '''
+        self._db.execute('DELETE FROM jobs')
+        self._db.execute("DELETE FROM meta WHERE key='crawl_id'")
+
+    def close(self):
+        self._db.close()
+
+
+def _tagged_fn(fn: str, tag: str) -> str:
+    suffix = ''
+    if fn.endswith('.gz'):
+        fn, suffix = fn[:-3], '.gz'
+    root, ext = os.path.splitext(fn)
+    return f'{root}.{tag}{ext}{suffix}'
+
+
+def shard_output_fn(fn: str, worker_id: str) -> str:
+    '''
+    Output shard of one worker, e.g. 'output.json' -> 'output.shard-1f2e3d4c-host-0.json'
+    (worker_id '1f2e3d4c-host-0': crawl id and worker).
+    '''
+    return _tagged_fn(fn, f'shard-{worker_id}')
+
+
+def merge_shards(output_fn: str, output_format: str = 'json', output_compress: bool = False,
+                 remove: bool = False, crawl_id: str = None, keep_existing: bool = False) -> int:
+    '''
+    Combines shards of 'output_fn' (of crawl 'crawl_id' or all of them)
+    into it, with keep_existing=True after the records already in
+    'output_fn'. A business written by several workers (a lease expired
+    while it was fetched) is kept once. A shard that can not be read yet (a
+    worker still writes it) is left for a later merge, merged shards are
+    deleted with remove=True. Returns the number of businesses written.
+    '''
+    shards = sorted(glob.glob(shard_output_fn(glob.escape(output_fn), f'{crawl_id}-*' if crawl_id else '*')))
+    if not shards:
+        logging.getLogger().warning(f'No shards of {output_fn} to merge')
+        return 0
+    seen = set()
+    merged = []
+
+    def write(records):
+        for record in records:
+            if record['business_yelp_url'] not in seen:
+                seen.add(record['business_yelp_url'])
+                writer.write(record)
+
+    # a SQLite output is updated in place, other formats are written next to
+    # output_fn and moved over it, output_fn may be read by the merge
+    merged_fn = output_fn if output_format=='sqlite' else _tagged_fn(output_fn, 'merge')
+    with open_writer(merged_fn, output_format, output_compress) as writer:
+        if keep_existing and merged_fn!=output_fn and os.path.exists(output_fn):
+            write(read_records(output_fn))
+        for shard in shards:
+            try:
+                write(read_records(shard))
+            except (ValueError, EOFError) as e:
+                logging.getLogger().warning(f'Shard {shard} is not complete, left for a later merge: {e!r}')
+                continue
+            merged.append(shard)
+    if merged_fn!=output_fn:
+        os.replace(merged_fn, output_fn)
+    if remove:
+        for shard in merged:
+            os.remove(shard)
+    return writer.count
+
+
+class Worker(object):
+    def __init__(self, crawler: Crawler, queue: WorkQueue, worker_id: str, poll_interval: float = 0.5):
+        self.crawler = crawler
+        self.queue = queue
+        self.worker_id = worker_id
+        self.poll_interval = poll_interval
+        self.done = 0
+        self.failed = 0
+
+    async def _search(self, payload: dict, url: str) -> list:
+        crawler = self.crawler
+        text = await (await crawler.scheduler.submit_url(crawler.fetch_url, url))
+        page = await crawler.parse(parse_search_page, text, crawler.base_url, crawler.max_business)
+        jobs = [(BUSINESS, business['business_yelp_url'], business) for business in page['businesses']]
+        if payload['page']==0:
+            total_pages = crawler.max_pages or page['total_pages'] or 1
+            for p in range(1, total_pages):
+                jobs.append((SEARCH, crawler.get_search_url(desc=payload['desc'], loc=payload['loc'], page=p),
+                             dict(payload, page=p)))
+        return jobs
+
+    async def _business(self, payload: dict, url: str) -> dict:
+        crawler = self.crawler
+        business_body = Business(None, domain=crawler.base_url).update(payload)
+        future = await crawler.scheduler.submit_url(crawler.fetch_url, url)
+        pages = await crawler.submit_review_pages(business_body)
+        values, _ = await crawler.business_values(future, pages)
+        business_body.update(values)
+        return dict(business_body)
+
+    async def _process(self, job: tuple, writer):
+        job_id, kind, url, payload = job
+        try:
+            if kind==SEARCH:
+                jobs = await self._search(payload, url)
+            else:
+                writer.write(await self._business(payload, url))
+                jobs = ()
+        except Exception as e:
+            self.crawler.logger.error(f'Job {kind} {url} failed: {e}')
+            self.queue.fail(job_id, str(e))
+            self.failed += 1
+            return
+        self.queue.complete(job_id, jobs)
+        self.done += 1
+
+    async def run(self, writer):
+        '''
+        Keeps up to 'concurrency' jobs of the crawler's scheduler in flight
+        until the queue has no pending or leased jobs.
+        '''
+        capacity = self.crawler.scheduler.concurrency
+        tasks = set()
+        try:
+            while True:
+                if len(tasks) < capacity:
+                    for job in self.queue.lease(self.worker_id, capacity - len(tasks)):
+                        tasks.add(asyncio.create_task(self._process(job, writer)))
+                if tasks:
+                    done, tasks = await asyncio.wait(tasks, timeout=self.poll_interval,
+                                                     return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                elif self.queue.finished():
+                    break
+                else:
+                    # jobs leased by other workers may still discover new ones
+                    await asyncio.sleep(self.poll_interval)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _work(queue_fn: str, worker_id: str, lease_time: float, wal: bool, crawler_options: dict):
+    crawler = Crawler(**crawler_options)
+    queue = WorkQueue(queue_fn, lease_time=lease_time, wal=wal)
+    worker = Worker(crawler, queue, worker_id)
+    shard_id = f'{queue.crawl_id()}-{worker_id}'
+    shard_fn = shard_output_fn(crawler.output_fn, shard_id)
+    # a shard of an earlier run of the same worker is not overwritten
+    n = 0
+    while os.path.exists(shard_fn):
+        n += 1
+        shard_fn = shard_output_fn(crawler.output_fn, f'{shard_id}.{n}')
+    writer = open_writer(shard_fn, crawler.output_format, crawler.output_compress, crawler.flush_interval)
+    await crawler.open_session()
+    crawler.open_parse_pool()
+    try:
+        with writer:
+            await worker.run(writer)
+    finally:
+        await crawler.scheduler.close()
+        await crawler.close_session()
+        crawler.close_parse_pool()
+        crawler._cache.close()
+        if crawler.validators is not None:
+            crawler.validators.close()
+        queue.close()
+    crawler.logger.info(f'Worker {worker_id} finished: {worker.done} jobs done, {worker.failed} failed, '
+                        f'{writer.count} businesses written')
+    return writer.count
+
+
+def run_worker(queue_fn: str, worker_id: str = None, lease_time: float = 60, wal: bool = True,
+               **crawler_options) -> int:
+    '''
+    Runs one worker until the queue is drained, returns number of businesses
+    written to its shard. 'crawler_options' are passed to Crawler.
+    '''
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    return asyncio.run(_work(queue_fn, worker_id, lease_time, wal, crawler_options))
+
+
+def seed(queue_fn: str, queries: list, reset: bool = True, wal: bool = True, **crawler_options):
+    '''
+    Queues first search pages of (category_name, location) queries.
+    '''
+    crawler = Crawler(**crawler_options)
+    queue = WorkQueue(queue_fn, wal=wal)
+    try:
+        if reset:
+            queue.reset()
+        queue.put([(SEARCH, crawler.get_search_url(desc=desc, loc=loc), {'desc': desc, 'loc': loc, 'page': 0})
+                   for desc, loc in queries])
+    finally:
+        queue.close()
+
+
+def run_distributed(queries: list, queue_fn: str, workers: int = 2, lease_time: float = 60,
+                    resume: bool = False, wal: bool = True, remove_shards: bool = False,
+                    **crawler_options) -> dict:
+    '''
+    Seeds the queue (unless resume=True), runs 'workers' local worker
+    processes and merges shards of the crawl into 'output_fn' once the queue
+    is drained; with resume=True records already in 'output_fn' are kept.
+    Nothing is merged when a worker failed. Returns queue stats.
+    '''
+    if not resume:
+        seed(queue_fn, queries, wal=wal, **crawler_options)
+    queue = WorkQueue(queue_fn, wal=wal)
+    try:
+        crawl_id = queue.crawl_id()
+    finally:
+        queue.close()
+    # spawned workers do not inherit the event loop and threads of the parent
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=run_worker, args=(queue_fn, None, lease_time, wal),
+                                 kwargs=crawler_options) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    failed = [process.exitcode for process in processes if process.exitcode]
+    if failed:
+        raise RuntimeError(f'{len(failed)} of {workers} workers failed with exit codes {failed}, '
+                           f'shards are kept, resume the crawl to finish it')
+    queue = WorkQueue(queue_fn, wal=wal)
+    try:
+        stats = queue.stats()
+        finished = queue.finished()
+    finally:
+        queue.close()
+    if finished:
+        options = dict(output_fn='output.json', output_format='json', output_compress=False)
+        options.update({k: v for k, v in crawler_options.items() if k in options})
+        merge_shards(**options, remove=remove_shards, crawl_id=crawl_id, keep_existing=resume)
+    else:
+        # workers on other hosts still hold leases, their shards are merged later ('merge_shards')
+        logging.getLogger().warning(f'Queue {queue_fn} is not drained, shards are not merged')
+    return stats
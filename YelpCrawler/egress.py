@@ -0,0 +1,156 @@
+'''
+Egress pool of Yelp Crawler: requests spread across HTTP proxies and
+local source addresses.
+
+An endpoint is either an HTTP proxy URL ('http://10.0.0.5:3128') or a
+local address requests are sent from ('192.168.1.12'), every endpoint
+gets its own pooled session (see YelpCrawler/session.py). Each endpoint
+keeps its health:
+- success rate of its requests (a new endpoint starts at 1/2, so it is tried)
+- latency: moving average of successful request time in seconds
+- cooldown: after a '503', connection error or timeout the endpoint is not
+  used for 'cooldown' seconds (or Retry-After), doubled for every further
+  failure in a row up to 'max_cooldown'
+
+'acquire' returns the healthiest endpoint out of cooldown: the highest
+success rate / (1 + latency), shared by requests in flight on it, so load
+spreads over equally healthy endpoints. While every endpoint cools down
+'acquire' waits for the first one to come back.
+
+Example:
+    >>> from YelpCrawler.egress import EgressPool
+    >>> pool = EgressPool(['http://10.0.0.5:3128', 'http://10.0.0.6:3128'], cooldown=60)
+    >>> await pool.open(limit_per_host=10)
+    >>> endpoint = await pool.acquire()
+    >>> async with endpoint.session.get(url, proxy=endpoint.proxy) as r:
+    ...     text = await r.text()
+    >>> pool.success(endpoint, 0.25)
+    >>> pool.release(endpoint)
+    >>> pool.stats()[0]
+    {'endpoint': 'http://10.0.0.5:3128', 'requests': 1, 'successes': 1, 'failures': 0, 'denied': 0, ...}
+    >>> await pool.close()
+'''
+import asyncio
+import time
+from YelpCrawler.session import create_session
+
+
+class Endpoint(object):
+    def __init__(self, name: str):
+        self.name = name
+        if '://' in name:
+            self.proxy = name
+            self.local_addr = None
+        else:
+            self.proxy = None
+            self.local_addr = (name, 0)
+        self.session = None
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.denied = 0
+        self.cooldowns = 0
+        self.in_flight = 0
+        self.latency = None
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def __repr__(self):
+        return f'Endpoint({self.name!r})'
+
+    @property
+    def success_rate(self) -> float:
+        # prior of one success in two requests
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    def score(self) -> float:
+        return self.success_rate / (1 + (self.latency or 0.0)) / (1 + self.in_flight)
+
+    def stats(self, now: float) -> dict:
+        return {
+            'endpoint': self.name,
+            'requests': self.requests,
+            'successes': self.successes,
+            'failures': self.failures,
+            'denied': self.denied,
+            'cooldowns': self.cooldowns,
+            'success_rate': round(self.successes / (self.successes + self.failures), 4)
+            if self.successes + self.failures else 0.0,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'cooldown_left': round(max(self.cooldown_until - now, 0.0), 3),
+        }
+
+
+class EgressPool(object):
+    def __init__(self, endpoints: list, cooldown: float = 30, max_cooldown: float = 600, alpha: float = 0.2):
+        if not endpoints:
+            raise ValueError('Egress pool needs at least one endpoint')
+        self.endpoints = [Endpoint(name) for name in endpoints]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        # weight of the last request in the latency moving average
+        self.alpha = alpha
+        self.waits = 0
+
+    async def open(self, **session_options):
+        for endpoint in self.endpoints:
+            if endpoint.session is None or endpoint.session.closed:
+                endpoint.session = create_session(local_addr=endpoint.local_addr, **session_options)
+        return self
+
+    @property
+    def opened(self) -> bool:
+        return any(endpoint.session is not None for endpoint in self.endpoints)
+
+    async def close(self):
+        for endpoint in self.endpoints:
+            if endpoint.session is not None:
+                await endpoint.session.close()
+                endpoint.session = None
+
+    def ready(self) -> bool:
+        '''
+        True while some endpoint is out of cooldown.
+        '''
+        now = time.monotonic()
+        return any(endpoint.cooldown_until <= now for endpoint in self.endpoints)
+
+    async def acquire(self) -> Endpoint:
+        while True:
+            now = time.monotonic()
+            ready = [endpoint for endpoint in self.endpoints if endpoint.cooldown_until <= now]
+            if ready:
+                endpoint = max(ready, key=Endpoint.score)
+                endpoint.requests += 1
+                endpoint.in_flight += 1
+                return endpoint
+            self.waits += 1
+            await asyncio.sleep(min(endpoint.cooldown_until for endpoint in self.endpoints) - now)
+
+    def release(self, endpoint: Endpoint):
+        endpoint.in_flight -= 1
+
+    def success(self, endpoint: Endpoint, latency: float):
+        endpoint.successes += 1
+        endpoint.consecutive_failures = 0
+        if endpoint.latency is None:
+            endpoint.latency = latency
+        else:
+            endpoint.latency += self.alpha * (latency - endpoint.latency)
+
+    def failure(self, endpoint: Endpoint, denied: bool = False, retry_after: float = None):
+        '''
+        Puts the endpoint into cooldown: 'retry_after' seconds if given,
+        otherwise 'cooldown' doubled for every failure in a row.
+        '''
+        endpoint.failures += 1
+        endpoint.denied += int(denied)
+        endpoint.consecutive_failures += 1
+        if retry_after is None:
+            retry_after = min(self.cooldown * 2 ** (endpoint.consecutive_failures - 1), self.max_cooldown)
+        endpoint.cooldown_until = time.monotonic() + retry_after
+        endpoint.cooldowns += 1
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        return [endpoint.stats(now) for endpoint in self.endpoints]
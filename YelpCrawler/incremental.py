@@ -0,0 +1,106 @@
+'''
+Incremental recrawl: reuse businesses whose listing did not change.
+
+'PreviousCrawl' loads results of an earlier run, either an output file
+(JSON array or NDJSON, optionally gzip-compressed, or a SQLite store, see
+YelpCrawler/store.py) or a crawl state file (see YelpCrawler/state.py). A business page is fetched again only when
+- the business is new
+- its listing fields on the search page ('business_rating',
+  'number_of_reviews' by default) changed
+- the stored copy is older than 'ttl' seconds (output files are dated by
+  their modification time, state files and SQLite stores per business)
+Otherwise the stored record is carried over.
+
+Example:
+    >>> from YelpCrawler.incremental import PreviousCrawl
+    >>> previous = PreviousCrawl('output.json', ttl=7 * 24 * 3600)
+    >>> previous.carry_over(business_body)
+    {'business_name': 'Prosper Construction', ...}
+    >>> previous.report()
+    {'skipped': 1, 'new': 0, 'changed': 0, 'expired': 0, 'fetched_bytes': 0, 'saved_bytes': 0}
+'''
+import os
+import time
+from YelpCrawler.output import read_records
+from YelpCrawler.state import CrawlState
+from YelpCrawler.store import ResultStore, is_result_store
+
+listing_fields = ('business_rating', 'number_of_reviews')
+
+
+def is_state_file(fn: str) -> bool:
+    with open(fn, 'rb') as f:
+        return f.read(16)==b'SQLite format 3\x00'
+
+
+class PreviousCrawl(object):
+    def __init__(self, fn: str, ttl: float = None, fields: tuple = listing_fields):
+        self.fn = fn
+        self.ttl = ttl
+        self.fields = fields
+        self.skipped = 0
+        self.new = 0
+        self.changed = 0
+        self.expired = 0
+        self.fetched = 0
+        self.fetched_bytes = 0
+        self._records = dict()
+        if os.path.exists(fn):
+            self.load()
+
+    def __len__(self):
+        return len(self._records)
+
+    def load(self):
+        if is_result_store(self.fn):
+            store = ResultStore(self.fn)
+            try:
+                for record, stored_at in store.records(with_time=True):
+                    self._records[record['business_yelp_url']] = (record, stored_at)
+            finally:
+                store.close()
+        elif is_state_file(self.fn):
+            state = CrawlState(self.fn)
+            try:
+                for record, stored_at in state.finished(with_time=True):
+                    self._records[record['business_yelp_url']] = (record, stored_at)
+            finally:
+                state.close()
+        else:
+            stored_at = os.path.getmtime(self.fn)
+            for record in read_records(self.fn):
+                self._records[record['business_yelp_url']] = (record, stored_at)
+
+    def carry_over(self, listing: dict):
+        '''
+        Returns the stored record if the business page need not be fetched again.
+        '''
+        item = self._records.get(listing['business_yelp_url'], None)
+        if item is None:
+            self.new += 1
+            return None
+        record, stored_at = item
+        if any(record.get(k)!=listing.get(k) for k in self.fields):
+            self.changed += 1
+            return None
+        if self.ttl is not None and stored_at + self.ttl < time.time():
+            self.expired += 1
+            return None
+        self.skipped += 1
+        return record
+
+    def fetched_page(self, size: int):
+        self.fetched += 1
+        self.fetched_bytes += size
+
+    def report(self):
+        # pages that were not fetched are estimated by the average fetched page
+        average = self.fetched_bytes / self.fetched if self.fetched else 0
+        return {
+            'skipped': self.skipped,
+            'new': self.new,
+            'changed': self.changed,
+            'expired': self.expired,
+            'fetched_bytes': self.fetched_bytes,
+            'saved_bytes': int(average * self.skipped),
+        }
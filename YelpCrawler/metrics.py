@@ -0,0 +1,208 @@
+'''
+Timing and counters of Yelp Crawler hot paths.
+
+'Metrics' aggregates observations into histograms with fixed buckets, so
+memory does not grow with the crawl:
+- dns, connect, ttfb, download, request: phases of every HTTP request,
+  taken from aiohttp trace hooks ('trace_config')
+- parse_search_page, parse_business_page: parsing and extraction per page type
+- queue_wait: time a job waited in the scheduler queue and for its
+  per-host and rate limits
+Counters keep requests, reused connections, errors, retries and bytes
+received. All values are in seconds and bytes.
+
+'summary()' is a JSON-serializable dict (count, mean and percentiles
+estimated from buckets), 'prometheus()' renders the same data in the
+Prometheus text format and 'line()' is a one-line progress summary.
+
+Example:
+    >>> from YelpCrawler.metrics import Metrics
+    >>> metrics = Metrics()
+    >>> with metrics.timer('parse_search_page'):
+    ...     parse_search_page(text)
+    >>> metrics.inc('retries')
+    >>> metrics.summary()['histograms']['parse_search_page']
+    {'count': 1, 'sum': 0.0121, 'mean': 0.0121, 'min': 0.0121, 'max': 0.0121, 'p50': 0.025, 'p90': 0.025, 'p99': 0.025}
+'''
+import bisect
+import contextlib
+import time
+import aiohttp
+
+# seconds, upper bounds of histogram buckets
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram(object):
+    def __init__(self, buckets: tuple = default_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        '''
+        Upper bound of the bucket holding the q-th observation (max for the last bucket).
+        '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 4),
+            'mean': round(self.sum / self.count, 4) if self.count else 0.0,
+            'min': round(self.min or 0.0, 4),
+            'max': round(self.max or 0.0, 4),
+            'p50': round(self.percentile(0.5), 4),
+            'p90': round(self.percentile(0.9), 4),
+            'p99': round(self.percentile(0.99), 4),
+        }
+
+
+class Metrics(object):
+    def __init__(self, buckets: tuple = default_buckets, prefix: str = 'yelp_crawler'):
+        self.buckets = buckets
+        self.prefix = prefix
+        self.histograms = dict()
+        self.counters = dict()
+        self.started = time.monotonic()
+
+    def reset(self):
+        self.histograms.clear()
+        self.counters.clear()
+        self.started = time.monotonic()
+
+    def observe(self, name: str, value: float):
+        histogram = self.histograms.get(name, None)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def inc(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        _start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - _start)
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        '''
+        aiohttp hooks timing DNS, connect, time to first byte and download of every request.
+        '''
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            ctx.start = time.perf_counter()
+            self.inc('requests')
+
+        async def on_dns_resolvehost_start(session, ctx, params):
+            ctx.dns_start = time.perf_counter()
+
+        async def on_dns_resolvehost_end(session, ctx, params):
+            self.observe('dns', time.perf_counter() - ctx.dns_start)
+
+        async def on_connection_create_start(session, ctx, params):
+            ctx.connect_start = time.perf_counter()
+
+        async def on_connection_create_end(session, ctx, params):
+            self.observe('connect', time.perf_counter() - ctx.connect_start)
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.inc('reused_connections')
+
+        async def on_request_end(session, ctx, params):
+            # headers of the response are received
+            ctx.headers_end = time.perf_counter()
+            self.observe('ttfb', ctx.headers_end - ctx.start)
+            self.inc(f'status_{params.response.status}')
+
+        async def on_response_chunk_received(session, ctx, params):
+            now = time.perf_counter()
+            self.inc('bytes_received', len(params.chunk))
+            if hasattr(ctx, 'headers_end'):
+                self.observe('download', now - ctx.headers_end)
+            self.observe('request', now - ctx.start)
+
+        async def on_request_exception(session, ctx, params):
+            self.inc('request_errors')
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+        trace.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+        trace.on_connection_create_start.append(on_connection_create_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_request_end.append(on_request_end)
+        trace.on_response_chunk_received.append(on_response_chunk_received)
+        trace.on_request_exception.append(on_request_exception)
+        return trace
+
+    def summary(self, **extra) -> dict:
+        res = {
+            'elapsed': round(time.monotonic() - self.started, 3),
+            'histograms': {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            'counters': dict(sorted(self.counters.items())),
+        }
+        res.update(extra)
+        return res
+
+    def prometheus(self, **gauges) -> str:
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            metric = f'{self.prefix}_{name}_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            total = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                total += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {total}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f'{metric}_sum {histogram.sum}')
+            lines.append(f'{metric}_count {histogram.count}')
+        for name, value in sorted(self.counters.items()):
+            metric = f'{self.prefix}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        for name, value in sorted(gauges.items()):
+            metric = f'{self.prefix}_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def line(self, **gauges) -> str:
+        '''
+        One-line progress summary for periodic stats.
+        '''
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        requests = self.counters.get('requests', 0)
+        parts = [f'{elapsed:.1f}s',
+                 f'{requests} requests ({requests / elapsed:.1f}/s)',
+                 f'{self.counters.get("bytes_received", 0) // 1024} KB']
+        for name in ('request', 'ttfb', 'queue_wait', 'parse_search_page', 'parse_business_page'):
+            histogram = self.histograms.get(name, None)
+            if histogram is not None and histogram.count:
+                parts.append(f'{name} p50 {histogram.percentile(0.5) * 1000:.1f} ms '
+                             f'p99 {histogram.percentile(0.99) * 1000:.1f} ms')
+        parts += [f'{name} {value}' for name, value in gauges.items()]
+        parts.append(f'retries {self.counters.get("retries", 0)}')
+        return ', '.join(parts)
@@ -0,0 +1,153 @@
+'''
+Streaming output of Yelp Crawler.
+
+Every business is written as soon as it is gathered, nothing is kept in
+memory for the final dump:
+- 'json': JSON array written incrementally, byte-compatible with
+  json.dumps(businesses, indent=2)
+- 'ndjson': one JSON document per line
+- 'sqlite': businesses are upserted into an indexed SQLite file, later runs
+  update it instead of replacing it (see YelpCrawler/store.py)
+
+With compress=True (or a '.gz' filename) output is gzip-compressed. The
+file is flushed at least every 'flush_interval' seconds, so a crash loses
+at most the last interval. 'read_records' reads such files back and
+'export_records' converts one output into another, e.g. a SQLite store
+into output.json.
+
+Example:
+    >>> from YelpCrawler.output import open_writer
+    >>> with open_writer('output.ndjson', 'ndjson') as writer:
+    ...     writer.write(dict(business_body))
+    >>> writer.count
+    1
+'''
+import gzip
+import json
+import time
+from YelpCrawler.store import ResultStore, is_result_store
+
+
+class Writer(object):
+    def __init__(self, fn: str, compress: bool = False, flush_interval: float = 1.0):
+        self.fn = fn
+        self.compress = compress or fn.endswith('.gz')
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._f = None
+        self._flushed = time.monotonic()
+
+    def open(self):
+        if self.compress:
+            self._f = gzip.open(self.fn, 'wt', encoding='utf-8')
+        else:
+            self._f = open(self.fn, 'w', encoding='utf-8')
+        return self
+
+    def _write(self, record: dict):
+        raise NotImplementedError
+
+    def write(self, record: dict):
+        self._write(record)
+        self.count += 1
+        if time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._f.flush()
+        self._flushed = time.monotonic()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonArrayWriter(Writer):
+    def open(self):
+        super(JsonArrayWriter, self).open()
+        self._f.write('[')
+        return self
+
+    def _write(self, record: dict):
+        # same layout as an element of json.dumps(list, indent=2)
+        body = json.dumps(record, indent=2).replace('\n', '\n  ')
+        self._f.write(('\n  ' if self.count==0 else ',\n  ') + body)
+
+    def close(self):
+        if self._f is not None:
+            self._f.write('\n]' if self.count else ']')
+        super(JsonArrayWriter, self).close()
+
+
+class NdjsonWriter(Writer):
+    def _write(self, record: dict):
+        self._f.write(json.dumps(record) + '\n')
+
+
+class SqliteWriter(Writer):
+    def open(self):
+        # 'flush_interval' is the longest time a batch of upserts waits for its transaction
+        self._f = ResultStore(self.fn, commit_interval=self.flush_interval)
+        return self
+
+    def _write(self, record: dict):
+        self._f.add(record)
+
+
+writers = {
+    'json': JsonArrayWriter,
+    'ndjson': NdjsonWriter,
+    'sqlite': SqliteWriter,
+}
+
+
+def read_records(fn: str):
+    '''
+    Yields businesses of an output file in any supported format.
+    '''
+    if is_result_store(fn):
+        store = ResultStore(fn)
+        try:
+            yield from store.records()
+        finally:
+            store.close()
+        return
+    with open(fn, 'rb') as f:
+        compressed = f.read(2)==b'\x1f\x8b'
+    with (gzip.open(fn, 'rt', encoding='utf-8') if compressed else open(fn, encoding='utf-8')) as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        if first=='[':
+            yield from json.loads(first + f.read())
+        elif first:
+            yield json.loads(first + f.readline())
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def open_writer(fn: str, output_format: str = 'json', compress: bool = False,
+                flush_interval: float = 1.0) -> Writer:
+    if output_format not in writers:
+        raise ValueError(f'Unknown output format {output_format}, expected one of {list(writers)}')
+    if output_format=='sqlite' and compress:
+        raise ValueError('SQLite output can not be compressed')
+    return writers[output_format](fn, compress=compress, flush_interval=flush_interval)
+
+
+def export_records(fn: str, output_fn: str, output_format: str = 'json', compress: bool = False) -> int:
+    '''
+    Writes businesses of output 'fn' (any format) to 'output_fn', returns their count.
+    '''
+    with open_writer(output_fn, output_format, compress) as writer:
+        for record in read_records(fn):
+            writer.write(record)
+    return writer.count
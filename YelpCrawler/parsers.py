@@ -0,0 +1,125 @@
+'''
+Parsing and field extraction of Yelp pages.
+
+The functions take page text and return compact dicts, so they can run
+either inline or in a process/thread pool (see Crawler 'parse_workers'):
+only the extracted values cross the pool boundary, never lxml trees.
+
+- parse_search_page: total pages and business cards of a search page
+- parse_business_page: business website and reviews of a business page
+- BusinessPageParser: the same fields of a business page fed in chunks
+  while it downloads, 'done' turns True as soon as the website link and
+  'max_reviews' reviews are complete, so the rest of the body can be skipped
+
+Fields are described by schemas compiled once at import
+('business_schema', 'business_page_schema', 'review_schema').
+
+Example:
+    >>> from YelpCrawler.parsers import parse_business_page
+    >>> parse_business_page(text, max_reviews=1)
+    {'business_website': 'prosperdevelopment.com', 'reviews': [{'reviewer_name': 'H C.', ...}]}
+'''
+import time
+from lxml import etree, html
+from YelpCrawler.structures import Business, SearchPage, Schema, Field, domain
+from YelpCrawler.structures import to_float, to_int, to_href, to_date
+
+business_schema = Schema(
+    business_name=Field('.//div[1]/div/div/div/h3/span/a/text()'),
+    business_yelp_url=Field('.//div[1]/div/div/div/h3/span/a/@href', to_href),
+    business_rating=Field(r'.//span[re:match(text(),"\d.\d")]/text()', to_float, default=None),
+    number_of_reviews=Field('.//span[contains(text(),"review")]/text()', to_int, default=0),
+)
+business_page_schema = Schema(
+    business_website=Field('//a[contains(@href, "biz_redir")]/text()', default=None),
+)
+review_schema = Schema(
+    reviewer_name=Field('.//div[contains(@class, "user-passport-info")]/span/a/text()'),
+    reviewer_location=Field('.//div[contains(@class, "user-passport-info")]/div/div/span/text()', default=None),
+    review_date=Field('.//div[2]/div/div[2]/span/text()', to_date),
+)
+# review blocks are the list items holding reviewer's passport
+_reviews = etree.XPath('//ul[contains(@class, "undefined list")]/li/div'
+                       '[.//div[contains(@class, "user-passport-info")]]')
+# the same selectors relative to one completed element, for streaming parse
+_review_blocks = etree.XPath('div[.//div[contains(@class, "user-passport-info")]]')
+_text = etree.XPath('text()', smart_strings=False)
+
+
+def extract_business(business: html.HtmlElement, domain: str = domain) -> Business:
+    return Business(business, domain=domain).update(business_schema.extract(business, domain=domain))
+
+
+def extract_reviews(page: html.HtmlElement, max_reviews: int = None) -> list:
+    reviews = _reviews(page)
+    if max_reviews:
+        reviews = reviews[:max_reviews]
+    return [review_schema.extract(review) for review in reviews]
+
+
+def parse_search_page(text: str, domain: str = domain, max_business: int = None) -> dict:
+    page = SearchPage(text, lambda el: extract_business(el, domain), max_business)
+    return {
+        'total_pages': page.total_pages,
+        'businesses': [dict(business_body) for business_body in page.businesses],
+    }
+
+
+def parse_business_page(text: str, max_reviews: int = None) -> dict:
+    page = html.fromstring(text)
+    res = business_page_schema.extract(page)
+    res['reviews'] = extract_reviews(page, max_reviews)
+    return res
+
+
+class BusinessPageParser(object):
+    '''
+    Incremental parse of a business page, same result as parse_business_page.
+    Fields are extracted when their elements end, review list items are
+    cleared right after, so the tree does not hold the reviews.
+    '''
+    def __init__(self, max_reviews: int = None, encoding: str = 'utf-8'):
+        self.max_reviews = max_reviews
+        self.website = None
+        self.reviews = []
+        self.bytes_read = 0
+        self.parse_time = 0.0
+        self._parser = etree.HTMLPullParser(events=('end',), encoding=encoding)
+
+    @property
+    def done(self) -> bool:
+        return (self.website is not None and bool(self.max_reviews)
+                and len(self.reviews) >= self.max_reviews)
+
+    def _element(self, el):
+        if el.tag=='a' and self.website is None and 'biz_redir' in el.get('href', ''):
+            text = _text(el)
+            if text:
+                self.website = text[0]
+        elif el.tag=='li' and not (self.max_reviews and len(self.reviews) >= self.max_reviews):
+            parent = el.getparent()
+            if parent is not None and parent.tag=='ul' and 'undefined list' in parent.get('class', ''):
+                for block in _review_blocks(el):
+                    self.reviews.append(review_schema.extract(block))
+                el.clear()
+
+    def feed(self, chunk: bytes):
+        _start = time.perf_counter()
+        self.bytes_read += len(chunk)
+        self._parser.feed(chunk)
+        for _, el in self._parser.read_events():
+            self._element(el)
+        self.parse_time += time.perf_counter() - _start
+
+    def close(self) -> dict:
+        _start = time.perf_counter()
+        try:
+            self._parser.close()
+        except etree.XMLSyntaxError:
+            # nothing was fed
+            pass
+        for _, el in self._parser.read_events():
+            self._element(el)
+        self.parse_time += time.perf_counter() - _start
+        reviews = self.reviews[:self.max_reviews] if self.max_reviews else self.reviews
+        return {'business_website': self.website, 'reviews': reviews}
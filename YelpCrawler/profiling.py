@@ -0,0 +1,156 @@
+'''
+Profiling of real Crawler runs.
+
+'Profiler' wraps a crawl (Crawler.run or run_batch) and writes, next to
+'prefix':
+- mode 'cprofile': '<prefix>.pstats' (pstats, snakeviz, flameprof or
+  gprof2dot read it) and '<prefix>.txt' with top functions by cumulative time
+- mode 'sampling': '<prefix>.collapsed', stacks of the main thread sampled
+  every 'interval' seconds in collapsed format (flamegraph.pl, speedscope)
+- '<prefix>.alloc.txt': tracemalloc snapshot taken at every stage boundary
+  of the crawl ('stage'), with top 'top' allocation sites grown since the
+  previous stage
+
+Parsing done in a process pool ('parse_workers') runs in other processes
+and is not profiled, profile with parse_workers=0 to see it.
+
+Example:
+    >>> from YelpCrawler.profiling import Profiler
+    >>> crawler = Crawler()
+    >>> with Profiler('profile', mode='cprofile') as crawler.profiler:
+    ...     asyncio.run(crawler.run())
+    >>> crawler.profiler.files
+    ['profile.pstats', 'profile.txt', 'profile.alloc.txt']
+'''
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+
+class Sampler(object):
+    '''
+    Samples the stack of one thread from a background thread.
+    '''
+    def __init__(self, interval: float = 0.005, thread_id: int = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id, None)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, fn: str):
+        with open(fn, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class Profiler(object):
+    def __init__(self, prefix: str = 'profile', mode: str = 'cprofile', top: int = 20,
+                 frames: int = 1, interval: float = 0.005, trace_malloc: bool = True):
+        if mode not in ('cprofile', 'sampling'):
+            raise ValueError(f'Unknown profile mode {mode}, expected cprofile or sampling')
+        self.prefix = prefix
+        self.mode = mode
+        self.top = top
+        self.frames = frames
+        self.interval = interval
+        self.trace_malloc = trace_malloc
+        self.files = []
+        self._profile = None
+        self._sampler = None
+        self._snapshot = None
+        self._stage_start = None
+        self._report = []
+
+    def start(self):
+        if self.trace_malloc:
+            tracemalloc.start(self.frames)
+            self._snapshot = self._take_snapshot()
+        self._stage_start = time.perf_counter()
+        if self.mode=='cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = Sampler(self.interval)
+            self._sampler.start()
+        return self
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ))
+
+    def stage(self, name: str):
+        '''
+        Closes the stage: its time and top allocation sites grown during it.
+        '''
+        now = time.perf_counter()
+        lines = [f'{name}: {now - self._stage_start:.3f} s']
+        self._stage_start = now
+        if self.trace_malloc and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            lines[0] += f', traced {current / 2**20:.1f} MB (peak {peak / 2**20:.1f} MB)'
+            snapshot = self._take_snapshot()
+            for stat in snapshot.compare_to(self._snapshot, 'lineno')[:self.top]:
+                lines.append(f'    {stat}')
+            self._snapshot = snapshot
+        self._report.append('\n'.join(lines))
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+            self._write_pstats()
+            self._profile = None
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler.write(self.prefix + '.collapsed')
+            self.files.append(self.prefix + '.collapsed')
+            self._sampler = None
+        if self.trace_malloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if self._report:
+            with open(self.prefix + '.alloc.txt', 'w', encoding='utf-8') as f:
+                f.write('\n\n'.join(self._report) + '\n')
+            self.files.append(self.prefix + '.alloc.txt')
+
+    def _write_pstats(self):
+        self._profile.dump_stats(self.prefix + '.pstats')
+        self.files.append(self.prefix + '.pstats')
+        text = io.StringIO()
+        pstats.Stats(self._profile, stream=text).sort_stats('cumulative').print_stats(self.top)
+        with open(self.prefix + '.txt', 'w', encoding='utf-8') as f:
+            f.write(text.getvalue())
+        self.files.append(self.prefix + '.txt')
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
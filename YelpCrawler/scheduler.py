@@ -0,0 +1,310 @@
+'''
+Bounded-concurrency scheduler used by Yelp Crawler.
+
+Jobs are put into a bounded queue and executed by a fixed pool of workers:
+- concurrency: number of workers, i.e. global cap of jobs in flight
+- per_host: cap of jobs in flight for one host (None - no cap)
+- queue_size: capacity of the work queue, 'submit' waits while it is full
+- rate: optional limit of job starts per second (token bucket)
+- metrics: optional Metrics, gets 'queue_wait' of every job
+
+Queued jobs are started in order of their 'priority' (lower first, jobs of
+equal priority in order of submission), so important jobs overtake the
+ones already waiting in the queue.
+
+Example:
+    >>> from YelpCrawler.scheduler import Scheduler
+    >>> scheduler = Scheduler(concurrency=10, per_host=5, rate=20)
+    >>> pages = await scheduler.map(crawler.fetch_url, urls)
+    >>> scheduler.stats()
+    {'queue_depth': 0, 'in_flight': 0, 'submitted': 24, 'completed': 24, 'failed': 0}
+    >>> await scheduler.close()
+
+'AdaptiveLimiter' is a crawler-wide AIMD window of requests in flight:
+it grows by 'increase' per window of successful requests and is cut by
+'decrease' on 503, timeouts and latency spikes (once per window, so a
+burst of failures of requests sent together is one signal). Retry-After
+pauses all requests. A token bucket passed as 'bucket' is scaled with
+the window, so requests per second follow it.
+
+    >>> limiter = AdaptiveLimiter(max_window=20)
+    >>> epoch = await limiter.acquire()
+    >>> limiter.failure(epoch, retry_after=5)
+    >>> await limiter.release()
+    >>> limiter.window
+    10.0
+'''
+import asyncio
+import email.utils
+import itertools
+import time
+import urllib.parse
+
+
+def parse_retry_after(value: str):
+    '''
+    Seconds to wait from Retry-After header (delay in seconds or HTTP date).
+    '''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class TokenBucket(object):
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        # created in the running loop, see AdaptiveLimiter.cond
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class AdaptiveLimiter(object):
+    def __init__(self,
+                 max_window: int = 20,
+                 min_window: int = 1,
+                 increase: float = 1.0,
+                 decrease: float = 0.5,
+                 latency_factor: float = 3.0,
+                 max_retry_after: float = 300,
+                 bucket: TokenBucket = None):
+        self.max_window = max_window
+        self.min_window = min_window
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.max_retry_after = max_retry_after
+        self.bucket = bucket
+        self.base_rate = bucket.rate if bucket is not None else None
+        self.window = float(max_window)
+        self.min_reached = self.window
+        self.in_flight = 0
+        self.epoch = 0
+        self.decreases = 0
+        self.pauses = 0
+        self.paused_until = 0
+        self.latency = None
+        self._samples = 0
+        self._cond = None
+
+    @property
+    def cond(self):
+        # asyncio primitives created before asyncio.run() are bound to another loop on Python 3.9
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def stats(self):
+        return {
+            'window': round(self.window, 2),
+            'min_window': round(self.min_reached, 2),
+            'in_flight': self.in_flight,
+            'decreases': self.decreases,
+            'pauses': self.pauses,
+            'latency': round(self.latency, 4) if self.latency is not None else None,
+        }
+
+    async def acquire(self) -> int:
+        '''
+        Waits for a free slot of the window, returns epoch of the window
+        to be passed to success()/failure().
+        '''
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            async with self.cond:
+                if self.in_flight < max(self.min_window, int(self.window)):
+                    self.in_flight += 1
+                    return self.epoch
+                await self.cond.wait()
+
+    async def release(self):
+        async with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def _resize(self, window: float):
+        self.window = min(self.max_window, max(self.min_window, window))
+        self.min_reached = min(self.min_reached, self.window)
+        if self.bucket is not None:
+            self.bucket.rate = self.base_rate * self.window / self.max_window
+
+    def _cut(self, epoch: int):
+        # requests sent before the last cut do not cut the window again
+        if epoch==self.epoch:
+            self.epoch += 1
+            self.decreases += 1
+            self._resize(self.window * self.decrease)
+
+    def success(self, epoch: int, latency: float):
+        spike = self._samples >= 10 and latency > self.latency_factor * self.latency
+        self._samples += 1
+        self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+        if spike:
+            self._cut(epoch)
+        else:
+            self._resize(self.window + self.increase / self.window)
+
+    def failure(self, epoch: int, retry_after: float = None):
+        self._cut(epoch)
+        if retry_after is not None:
+            self.pauses += 1
+            self.paused_until = max(self.paused_until,
+                                    time.monotonic() + min(retry_after, self.max_retry_after))
+
+
+class Scheduler(object):
+    def __init__(self,
+                 concurrency: int = 20,
+                 per_host: int = None,
+                 queue_size: int = 100,
+                 rate: float = None,
+                 metrics = None):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.queue_size = queue_size
+        self.rate = rate
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._queue = None
+        self._seq = itertools.count()
+        self._workers = []
+        self._hosts = dict()
+        self.bucket = TokenBucket(rate) if rate else None
+        self.metrics = metrics
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def running(self):
+        return len(self._workers) > 0
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+    def start(self):
+        if not self.running:
+            self._queue = asyncio.PriorityQueue(maxsize=self.queue_size)
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        return self
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def _host_semaphore(self, host):
+        if self.per_host is None or host is None:
+            return None
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host)
+        return self._hosts[host]
+
+    async def _run(self, func, args, kwargs, host, enqueued):
+        semaphore = self._host_semaphore(host)
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            if self.metrics is not None:
+                self.metrics.observe('queue_wait', time.monotonic() - enqueued)
+            self.in_flight += 1
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.in_flight -= 1
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    async def _worker(self):
+        while True:
+            _, _, future, func, args, kwargs, host, enqueued = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                try:
+                    res = await self._run(func, args, kwargs, host, enqueued)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    self.failed += 1
+                    # the caller may have cancelled the future while the job ran
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    self.completed += 1
+                    if not future.done():
+                        future.set_result(res)
+            finally:
+                self._queue.task_done()
+
+    async def submit(self, func, *args, host: str = None, priority: float = 0, **kwargs) -> asyncio.Future:
+        '''
+        Puts the job into the queue, waits while the queue is full.
+        Returns future of the job result.
+        '''
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        # sequence number keeps FIFO order within a priority, jobs themselves are not compared
+        await self._queue.put((priority, next(self._seq), future, func, args, kwargs, host, time.monotonic()))
+        self.submitted += 1
+        return future
+
+    async def submit_url(self, func, url: str, *args, **kwargs) -> asyncio.Future:
+        '''
+        Submits 'func(url)', the per-host cap is applied to the host of url.
+        '''
+        return await self.submit(func, url, *args, host=urllib.parse.urlsplit(url).netloc, **kwargs)
+
+    async def map(self, func, urls):
+        '''
+        Runs 'func(url)' for each url (list, generator or async generator),
+        results are returned in the order of urls.
+        '''
+        futures = []
+        if hasattr(urls, '__aiter__'):
+            async for url in urls:
+                futures.append(await self.submit_url(func, url))
+        else:
+            for url in urls:
+                futures.append(await self.submit_url(func, url))
+        return await asyncio.gather(*futures)
@@ -0,0 +1,56 @@
+'''
+Shared HTTP session used by Yelp Crawler.
+
+One 'aiohttp.ClientSession' is created per crawl and reused by every request,
+so TCP/TLS connections and resolved addresses are kept between pages:
+- limit: total number of simultaneous connections in the pool
+- limit_per_host: number of simultaneous connections to one host
+- keepalive_timeout: seconds an idle connection is kept open
+- ttl_dns_cache: seconds a resolved host is cached
+- timeout: total timeout of one request in seconds
+- trace_configs: aiohttp.TraceConfig hooks, e.g. Metrics.trace_config()
+- local_addr: (host, port) connections are made from, e.g. an egress
+  address (see YelpCrawler/egress.py)
+
+Responses compressed with gzip/deflate are decoded by aiohttp, brotli ('br')
+is announced only when 'brotli' or 'brotlicffi' package is installed.
+
+Example:
+    >>> from YelpCrawler.session import create_session
+    >>> session = create_session(limit_per_host=10)
+    >>> async with session.get('https://www.yelp.com') as r:
+    ...     text = await r.text()
+    >>> await session.close()
+'''
+import importlib.util
+import aiohttp
+
+_brotli = importlib.util.find_spec('brotli') is not None or importlib.util.find_spec('brotlicffi') is not None
+
+accept_encoding = 'gzip, deflate, br' if _brotli else 'gzip, deflate'
+default_headers = {
+    'Accept-Encoding': accept_encoding,
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/115.0 Safari/537.36',
+}
+
+
+def create_session(limit: int = 100,
+                   limit_per_host: int = 10,
+                   keepalive_timeout: float = 30,
+                   ttl_dns_cache: int = 300,
+                   timeout: float = 30,
+                   headers: dict = None,
+                   trace_configs: list = None,
+                   local_addr: tuple = None) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(limit=limit,
+                                     limit_per_host=limit_per_host,
+                                     keepalive_timeout=keepalive_timeout,
+                                     ttl_dns_cache=ttl_dns_cache,
+                                     use_dns_cache=True,
+                                     local_addr=local_addr)
+    return aiohttp.ClientSession(connector=connector,
+                                 headers=headers or default_headers,
+                                 timeout=aiohttp.ClientTimeout(total=timeout),
+                                 auto_decompress=True,
+                                 trace_configs=trace_configs)
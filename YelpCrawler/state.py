@@ -0,0 +1,120 @@
+'''
+Durable crawl state used to resume interrupted crawls.
+
+Progress of a crawl is kept in a SQLite file:
+- searches: fetched search pages (and total pages of the first one)
+- businesses: business URLs extracted from search pages with their listing
+  fields, and the finished record once the business page is done
+
+Writes are committed in batches (every 'commit_every' writes or
+'commit_interval' seconds, and on close), so a crash loses at most the
+last batch, which is simply fetched again on resume.
+
+Example:
+    >>> from YelpCrawler.state import CrawlState
+    >>> state = CrawlState('state.db')
+    >>> state.mark_search(url, [dict(business_body) for business_body in businesses])
+    >>> state.mark_business(business_body.business_yelp_url, dict(business_body))
+    >>> state.stats()
+    {'searches': 1, 'businesses': 10, 'finished': 1}
+    >>> state.close()
+'''
+import json
+import sqlite3
+import time
+
+
+class CrawlState(object):
+    def __init__(self, fn: str, commit_every: int = 100, commit_interval: float = 1.0):
+        self.fn = fn
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self._pending = 0
+        self._committed = time.monotonic()
+        self._db = sqlite3.connect(fn)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS searches ('
+                         'url TEXT PRIMARY KEY, total_pages INTEGER, done_at REAL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS businesses ('
+                         'url TEXT PRIMARY KEY, search_url TEXT, listing TEXT, record TEXT, done_at REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS businesses_search_url ON businesses (search_url)')
+        self._db.commit()
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= self.commit_every or time.monotonic() - self._committed >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self._db.commit()
+        self._pending = 0
+        self._committed = time.monotonic()
+
+    def reset(self):
+        self._db.execute('DELETE FROM searches')
+        self._db.execute('DELETE FROM businesses')
+        self.commit()
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+    def total_pages(self, url: str):
+        row = self._db.execute('SELECT total_pages FROM searches WHERE url=?', (url,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_total_pages(self, url: str, total_pages: int):
+        self._db.execute('INSERT INTO searches (url, total_pages) VALUES (?, ?) '
+                         'ON CONFLICT(url) DO UPDATE SET total_pages=excluded.total_pages', (url, total_pages))
+        self._written()
+
+    def search_done(self, url: str) -> bool:
+        row = self._db.execute('SELECT done_at FROM searches WHERE url=?', (url,)).fetchone()
+        return row is not None and row[0] is not None
+
+    def mark_search(self, url: str, businesses: list):
+        self._db.executemany('INSERT OR IGNORE INTO businesses (url, search_url, listing) VALUES (?, ?, ?)',
+                             [(business['business_yelp_url'], url, json.dumps(business))
+                              for business in businesses])
+        self._db.execute('INSERT INTO searches (url, done_at) VALUES (?, ?) '
+                         'ON CONFLICT(url) DO UPDATE SET done_at=excluded.done_at', (url, time.time()))
+        self._written()
+
+    def pending_businesses(self, url: str) -> list:
+        '''
+        Listing fields of businesses of the search page that are not finished yet.
+        '''
+        rows = self._db.execute('SELECT listing FROM businesses WHERE search_url=? AND record IS NULL '
+                                'ORDER BY rowid', (url,))
+        return [json.loads(listing) for listing, in rows]
+
+    def business_done(self, url: str) -> bool:
+        row = self._db.execute('SELECT 1 FROM businesses WHERE url=? AND record IS NOT NULL', (url,)).fetchone()
+        return row is not None
+
+    def mark_business(self, url: str, record: dict):
+        self._db.execute('INSERT INTO businesses (url, record, done_at) VALUES (?, ?, ?) '
+                         'ON CONFLICT(url) DO UPDATE SET record=excluded.record, done_at=excluded.done_at',
+                         (url, json.dumps(record), time.time()))
+        self._written()
+
+    def finished(self, with_time: bool = False, search_prefix: str = None):
+        '''
+        Finished records, with search_prefix only those found by search pages
+        whose URL starts with it (one query of a batch).
+        '''
+        if search_prefix is None:
+            rows = self._db.execute('SELECT record, done_at FROM businesses WHERE record IS NOT NULL '
+                                    'ORDER BY done_at')
+        else:
+            rows = self._db.execute('SELECT record, done_at FROM businesses WHERE record IS NOT NULL '
+                                    'AND substr(search_url, 1, ?)=? ORDER BY done_at',
+                                    (len(search_prefix), search_prefix))
+        for record, done_at in rows:
+            yield (json.loads(record), done_at) if with_time else json.loads(record)
+
+    def stats(self):
+        searches, = self._db.execute('SELECT COUNT(*) FROM searches WHERE done_at IS NOT NULL').fetchone()
+        businesses, finished = self._db.execute('SELECT COUNT(*), COUNT(record) FROM businesses').fetchone()
+        return {'searches': searches, 'businesses': businesses, 'finished': finished}
@@ -0,0 +1,173 @@
+'''
+Indexed SQLite store of crawled businesses.
+
+Results are kept in a SQLite file instead of one JSON document, so one
+business is found without loading the rest and later runs merge into it:
+- businesses: one row per 'business_yelp_url' (primary key) with listing
+  fields, website and time of the last update; indexed on name, rating
+  and number of reviews
+- reviews: reviews of a business in page order, keyed on
+  ('business_yelp_url', position)
+
+'add' upserts a business: a business stored by an earlier run is updated
+and its reviews are replaced. Records are written in batches, one
+transaction per 'batch_size' records or 'commit_interval' seconds (and on
+'flush'/'close'). 'records' reads businesses back in the order they were
+first stored, in the same layout as output.json.
+
+Example:
+    >>> from YelpCrawler.store import ResultStore
+    >>> store = ResultStore('output.db')
+    >>> store.add(dict(business_body))
+    >>> store.close()
+    >>> store = ResultStore('output.db')
+    >>> store.get('https://www.yelp.com/biz/prosper-construction-san-francisco')
+    {'business_name': 'Prosper Construction', 'business_rating': 5.0, ..., 'reviews': [...]}
+    >>> [record['business_name'] for record in store.find(min_rating=4.5, min_reviews=100, limit=3)]
+    ['Prosper Construction', ...]
+'''
+import itertools
+import operator
+import sqlite3
+import time
+from YelpCrawler.structures import Business, Review
+
+business_columns = tuple(k for k in Business._fields if k!='reviews')
+review_columns = Review._fields
+_review_values = operator.itemgetter(*review_columns)
+
+
+def is_result_store(fn: str) -> bool:
+    '''
+    True for a SQLite file holding a 'reviews' table (not a crawl state file).
+    '''
+    with open(fn, 'rb') as f:
+        if f.read(16)!=b'SQLite format 3\x00':
+            return False
+    db = sqlite3.connect(fn)
+    try:
+        return db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='reviews'").fetchone() is not None
+    finally:
+        db.close()
+
+
+class ResultStore(object):
+    def __init__(self, fn: str, batch_size: int = 500, commit_interval: float = 1.0):
+        self.fn = fn
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.upserts = 0
+        # business_yelp_url -> record, a business written twice in a batch is stored once
+        self._batch = dict()
+        self._committed = time.monotonic()
+        self._db = sqlite3.connect(fn)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        # 64 MB of pages, upserts touch indexes all over the file
+        self._db.execute('PRAGMA cache_size=-65536')
+        self._db.execute('CREATE TABLE IF NOT EXISTS businesses ('
+                         'business_yelp_url TEXT PRIMARY KEY, business_name TEXT, business_rating REAL, '
+                         'number_of_reviews INTEGER, business_website TEXT, updated_at REAL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS reviews ('
+                         'business_yelp_url TEXT NOT NULL, position INTEGER NOT NULL, reviewer_name TEXT, '
+                         'reviewer_location TEXT, review_date TEXT, '
+                         'PRIMARY KEY (business_yelp_url, position)) WITHOUT ROWID')
+        self._db.execute('CREATE INDEX IF NOT EXISTS businesses_name ON businesses (business_name)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS businesses_rating ON businesses (business_rating)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS businesses_reviews ON businesses (number_of_reviews)')
+        self._db.commit()
+        self._upsert = (f'INSERT INTO businesses ({", ".join(business_columns)}, updated_at) '
+                        f'VALUES ({", ".join("?" * (len(business_columns) + 1))}) '
+                        f'ON CONFLICT(business_yelp_url) DO UPDATE SET '
+                        + ', '.join(f'{k}=excluded.{k}' for k in business_columns + ('updated_at',)
+                                    if k!='business_yelp_url'))
+        self._insert_review = (f'INSERT INTO reviews (business_yelp_url, position, {", ".join(review_columns)}) '
+                               f'VALUES ({", ".join("?" * (len(review_columns) + 2))})')
+
+    def __len__(self):
+        self.commit()
+        return self._db.execute('SELECT COUNT(*) FROM businesses').fetchone()[0]
+
+    def add(self, record: dict):
+        self._batch[record['business_yelp_url']] = record
+        if len(self._batch) >= self.batch_size or time.monotonic() - self._committed >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        '''
+        Writes the batch in one transaction.
+        '''
+        if self._batch:
+            now = time.time()
+            records = list(self._batch.values())
+            with self._db:
+                self._db.executemany(self._upsert, [tuple(record.get(k) for k in business_columns) + (now,)
+                                                    for record in records])
+                self._db.executemany('DELETE FROM reviews WHERE business_yelp_url=?',
+                                     [(record['business_yelp_url'],) for record in records])
+                self._db.executemany(self._insert_review,
+                                     [(record['business_yelp_url'], position) + _review_values(review)
+                                      for record in records
+                                      for position, review in enumerate(record.get('reviews') or ())])
+            self.upserts += len(records)
+            self._batch.clear()
+        self._committed = time.monotonic()
+
+    flush = commit
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+    def _records(self, where: str = '', args: tuple = (), order: str = 'rowid', limit: int = None,
+                 with_time: bool = False):
+        # 'seq' keeps the order of businesses through the join with their reviews
+        businesses = (f'SELECT rowid AS seq, * FROM businesses {where} ORDER BY {order}'
+                      + (f' LIMIT {int(limit)}' if limit else ''))
+        rows = self._db.execute(f'SELECT b.seq, b.updated_at, {", ".join("b." + k for k in business_columns)}, '
+                                f'r.position, {", ".join("r." + k for k in review_columns)} '
+                                f'FROM ({businesses}) b '
+                                f'LEFT JOIN reviews r ON r.business_yelp_url=b.business_yelp_url '
+                                f'ORDER BY {order.replace("rowid", "seq")}, r.position', args)
+        n = len(business_columns) + 2
+        for _, group in itertools.groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            record = dict(zip(business_columns, group[0][2:n]))
+            # LEFT JOIN gives one row of NULLs for a business without reviews
+            record['reviews'] = [dict(zip(review_columns, row[n + 1:])) for row in group if row[n] is not None]
+            yield (record, group[0][1]) if with_time else record
+
+    def records(self, with_time: bool = False):
+        '''
+        All businesses in the order they were first stored, with_time=True
+        yields (record, time of the last update).
+        '''
+        self.commit()
+        yield from self._records(with_time=with_time)
+
+    def get(self, business_yelp_url: str):
+        self.commit()
+        return next(self._records('WHERE business_yelp_url=?', (business_yelp_url,)), None)
+
+    def find(self, name: str = None, min_rating: float = None, min_reviews: int = None,
+             order_by: str = 'number_of_reviews', limit: int = None):
+        '''
+        Businesses by name prefix, minimal rating and number of reviews,
+        best first by 'order_by' ('number_of_reviews' or 'business_rating').
+        '''
+        if order_by not in ('number_of_reviews', 'business_rating'):
+            raise ValueError(f'Unknown order {order_by}, expected number_of_reviews or business_rating')
+        conditions, args = [], []
+        if name is not None:
+            # range on the index instead of LIKE
+            conditions.append('business_name >= ? AND business_name < ?')
+            args += [name, name + '\U0010ffff']
+        if min_rating is not None:
+            conditions.append('business_rating >= ?')
+            args.append(min_rating)
+        if min_reviews is not None:
+            conditions.append('number_of_reviews >= ?')
+            args.append(min_reviews)
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        self.commit()
+        yield from self._records(where, tuple(args), order=f'{order_by} DESC, rowid', limit=limit)
@@ -14,6 +14,18 @@ Description of main data structures used in Yelp Crawler.
 - business_website: str
 - reviews: list = []
 
+'SearchPage' is a search page parsed exactly once:
+- total_pages: int (None if pagination is missing)
+- businesses: list of 'Business' extracted from the page
+
+'Schema' is a declarative extraction schema: field -> 'Field' (selector and
+converter). Selectors are compiled into lxml.etree.XPath once, when the
+schema is defined, and all fields are applied to an element in one pass:
+
+    >>> schema = Schema(number_of_reviews=Field('.//p/b/text()', to_int, default=0))
+    >>> schema.extract(el)
+    {'number_of_reviews': 0}
+
 Example:
     >>> from YelpCrawler.structures import Business
     >>> import lxml
@@ -39,13 +51,14 @@ Example:
 '''
 import json, re
 from datetime import datetime
-from lxml import html
+from lxml import etree, html
 from lxml.html import HtmlElement
 
 domain = 'https://www.yelp.com'
 date_format = '%m/%d/%Y'
+namespaces = {'re': 'http://exslt.org/regular-expressions'}
 get_digits = lambda x: re.findall('[0-9.]+',x[0])
-get_href = lambda name: domain+name[0].split('?')[0] if name[0].startswith('/') else None
+get_href = lambda name, domain=domain: domain+name[0].split('?')[0] if name[0].startswith('/') else None
 def is_serializable(obj):
     try:
         json.dumps(obj)
@@ -54,7 +67,49 @@ def is_serializable(obj):
         return False
 
 
+_float = re.compile('[0-9.]+')
+_int = re.compile('[0-9]+')
+required = object()
+
+first = lambda res, **context: res[0]
+to_float = lambda res, **context: float(''.join(_float.findall(res[0])))
+to_int = lambda res, **context: int(''.join(_int.findall(res[0])))
+to_href = lambda res, domain=domain, **context: get_href(res, domain=domain)
+to_date = lambda res, **context: str(datetime.strptime(res[0], date_format).date())
+
+
+class Field(object):
+    def __init__(self, selector: str, converter=first, default=required):
+        self.selector = selector
+        self.xpath = etree.XPath(selector, namespaces=namespaces, smart_strings=False)
+        self.converter = converter
+        self.default = default
+
+    def __call__(self, el: HtmlElement, **context):
+        res = self.xpath(el)
+        if len(res)==0:
+            if self.default is required:
+                raise KeyError(f'The value {self.selector} is missing from {html.tostring(el)}')
+            return self.default
+        return self.converter(res, **context)
+
+
+class Schema(object):
+    def __init__(self, **fields: Field):
+        self.fields = list(fields.items())
+
+    def extract(self, el: HtmlElement, **context) -> dict:
+        return {name: field(el, **context) for name, field in self.fields}
+
+
 class DataStructure(object):
+    '''
+    Compact record: attributes live in __slots__, '_fields' lists the
+    serialised fields in output order.
+    '''
+    __slots__ = ('_html_element',)
+    _fields = ()
+
     def __init__(self, el: HtmlElement):
         self._html_element = el
         pass
@@ -63,14 +118,28 @@ class DataStructure(object):
     def html_element(self):
         return self._html_element
 
+    def update(self, values: dict):
+        '''
+        Sets already extracted values, e.g. returned by YelpCrawler.parsers.
+        '''
+        for k, v in values.items():
+            setattr(self, '_'+k if hasattr(self, '_'+k) else k, v)
+        return self
+
+    def release(self):
+        '''
+        Drops the reference to HtmlElement once extraction is done,
+        so the page tree can be freed.
+        '''
+        self._html_element = None
+        return self
+
     def __str__(self):
-        serializable_objects = lambda o: {k.strip('_'):v for k, v in o.__dict__.items() if is_serializable(v)}
-        return json.dumps(self, default=serializable_objects, indent=2)
+        return json.dumps(dict(self), indent=2)
 
     def __iter__(self):
-        for k, v in self.__dict__.items():
-            if is_serializable(v):
-                yield (k.strip('_'), v)
+        for k in self._fields:
+            yield (k, getattr(self, k))
 
     def _search(self, xpath):
         res = self.html_element.xpath(xpath)
@@ -80,21 +149,22 @@ class DataStructure(object):
             return res
 
     def _search_re(self, xpath):
-        res = self.html_element.xpath(xpath, namespaces={
-        're': 'http://exslt.org/regular-expressions'})
+        res = self.html_element.xpath(xpath, namespaces=namespaces)
         if len(res)==0:
             raise KeyError(f'The value {xpath} is missing from {html.tostring(self.html_element)}')
         else:
             return res
 
     def _is_valid(self):
-        for k, v in self.__dict__.items():
-            if is_serializable(v):
-                if v==None:
-                    return False
+        for k, v in self:
+            if v==None:
+                return False
         return True
 
 class Review(DataStructure):
+    __slots__ = ('_reviewer_name', '_reviewer_location', '_review_date')
+    _fields = ('reviewer_name', 'reviewer_location', 'review_date')
+
     def __init__(self, el: HtmlElement):
         super(Review, self).__init__(el)
         self._reviewer_name: str = None
@@ -136,8 +206,14 @@ class Business(DataStructure):
     """
     Business object
     """
-    def __init__(self, el: HtmlElement):
+    __slots__ = ('_domain', '_business_name', '_business_rating', '_number_of_reviews',
+                 '_business_yelp_url', '_business_website', 'reviews')
+    _fields = ('business_name', 'business_rating', 'number_of_reviews',
+               'business_yelp_url', 'business_website', 'reviews')
+
+    def __init__(self, el: HtmlElement, domain: str = domain):
         super(Business, self).__init__(el)
+        self._domain = domain
         self._business_name: str = None
         self._business_rating: float = None
         self._number_of_reviews: int = None
@@ -188,7 +264,7 @@ class Business(DataStructure):
     def business_yelp_url(self, xpath: str):
         name = self._search(xpath)
         href = name[0].split('?')[0] if name[0].startswith('/') else None
-        self._business_yelp_url = domain+href #if isinstance(href, str) else None
+        self._business_yelp_url = self._domain+href #if isinstance(href, str) else None
 
     @property
     def business_website(self):
@@ -203,5 +279,17 @@ class Business(DataStructure):
         self._business_website = name #if isinstance(name, str) else None
 
 
-
-
+class SearchPage(object):
+    """
+    Search page parsed once: pagination and business cards are extracted
+    in a single pass by 'extract' (HtmlElement -> Business), the tree is
+    released right after.
+    """
+    def __init__(self, text: str, extract, max_business: int = None):
+        page = html.fromstring(text)
+        pagination = page.xpath('//div[contains(@class, "pagination_")]/div[2]/span/text()')
+        self.total_pages = int(get_digits(pagination)[-1]) if pagination else None
+        cards = page.xpath('//div[contains(@class, "mainAttributes")]')
+        if max_business:
+            cards = cards[:max_business]
+        self.businesses = [extract(card).release() for card in cards]
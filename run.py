@@ -1,17 +1,122 @@
 import asyncio
-from  YelpCrawler.api import Crawler
+from  YelpCrawler.api import Crawler, read_queries
+from YelpCrawler.distributed import run_distributed, run_worker, merge_shards, WorkQueue
+from YelpCrawler.output import export_records
+from YelpCrawler.profiling import Profiler
 
 if __name__=='__main__':
     import argparse
     parser = argparse.ArgumentParser(description="a yelp crawler that scraps all the businesses from Yelp website")
     parser.add_argument("-cn", "--category_name", type=str, default=None, help="Name of search category")
     parser.add_argument("-l", "--location", type=str, default=None, help="Location of search")
+    parser.add_argument("-bf", "--batch_fn", type=str, default=None, help="File of queries, one 'category<TAB>location' per line, crawled in one process")
+    parser.add_argument("-pq", "--per_query", action='store_true', help="Write results of each query of batch_fn to its own file")
+    parser.add_argument("-qc", "--query_concurrency", type=int, default=4, help="Number of queries of batch_fn crawled at once")
+    parser.add_argument("-qf", "--queue_fn", type=str, default=None, help="Filename (.db) of shared work queue, crawl with worker processes")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="Number of local worker processes of queue_fn")
+    parser.add_argument("-j", "--join", action='store_true', help="Only run one worker over an already seeded queue_fn (e.g. on another host)")
+    parser.add_argument("-m", "--merge", action='store_true', help="Only merge shards of output_fn written by workers (of the crawl in queue_fn if given)")
+    parser.add_argument("-rs", "--remove_shards", action='store_true', help="Delete shards once they are merged into output_fn")
     parser.add_argument("-o", "--output_fn", type=str, default='output.json', help="Filename (.json) of parsed results")
-    parser.add_argument("-mp", "--max_pages", type=int, default=None, help="Filename (.json) of parsed results")
-    parser.add_argument("-mb", "--max_business", type=int, default=None, help="Filename (.json) of parsed results")
-    parser.add_argument("-mr", "--max_reviews", type=int, default=5, help="Filename (.json) of parsed results")
+    parser.add_argument("-of", "--output_format", type=str, default='json', choices=['json', 'ndjson', 'sqlite'], help="Format of parsed results, sqlite upserts into an indexed database")
+    parser.add_argument("-ex", "--export", type=str, default=None, help="Only export results stored in this file (e.g. SQLite output) to output_fn in output_format")
+    parser.add_argument("-oc", "--output_compress", action='store_true', help="Compress parsed results with gzip")
+    parser.add_argument("-sf", "--state_fn", type=str, default=None, help="Filename (.db) of crawl checkpoint")
+    parser.add_argument("-r", "--resume", action='store_true', help="Resume the crawl checkpointed in state_fn")
+    parser.add_argument("-pf", "--previous_fn", type=str, default=None, help="Output or state file of previous crawl, unchanged businesses are carried over")
+    parser.add_argument("-pt", "--previous_ttl", type=float, default=None, help="Seconds a carried over business stays valid")
+    parser.add_argument("-fi", "--flush_interval", type=float, default=1.0, help="Seconds between flushes of parsed results")
+    parser.add_argument("-mp", "--max_pages", type=int, default=None, help="Maximum number of search pages")
+    parser.add_argument("-mb", "--max_business", type=int, default=None, help="Maximum number of businesses per search page")
+    parser.add_argument("-mr", "--max_reviews", type=int, default=5, help="Maximum number of reviews per business")
+    parser.add_argument("-dl", "--deadline", type=float, default=None, help="Seconds the crawl may run, then what finished is written")
+    parser.add_argument("-mrq", "--max_requests", type=int, default=None, help="Maximum number of requests of the crawl")
+    parser.add_argument("-mby", "--max_bytes", type=float, default=None, help="Maximum size of received pages (MB)")
+    parser.add_argument("-pri", "--priority", type=str, default=None, choices=['reviews', 'rating', 'rank'], help="Order of business page fetches")
+    parser.add_argument("-skf", "--skipped_fn", type=str, default=None, help="Filename (.json) of pages skipped when the budget runs out")
+    parser.add_argument("-c", "--concurrency", type=int, default=20, help="Maximum number of requests in flight")
+    parser.add_argument("-lph", "--limit_per_host", type=int, default=10, help="Maximum number of requests in flight to one host")
+    parser.add_argument("-rps", "--rate_limit", type=float, default=None, help="Maximum number of requests per second")
+    parser.add_argument("-na", "--no_adaptive", action="store_true", help="Keep concurrency fixed instead of adapting it to 503s, timeouts and latency")
+    parser.add_argument("-eg", "--egress", type=str, nargs='+', default=None, help="HTTP proxy URLs or local source addresses requests are spread across")
+    parser.add_argument("-egc", "--egress_cooldown", type=float, default=30, help="Seconds an egress endpoint rests after 503 or failure")
+    parser.add_argument("-cs", "--cache_size", type=int, default=64, help="Size of in-memory page cache (MB)")
+    parser.add_argument("-cf", "--cache_fn", type=str, default=None, help="Filename (.db) of on-disk page cache")
+    parser.add_argument("-ct", "--cache_ttl", type=float, default=None, help="Seconds a cached page stays valid")
+    parser.add_argument("-vf", "--validators_fn", type=str, default=None, help="Filename (.db) of ETag/Last-Modified store for conditional requests")
+    parser.add_argument("-pw", "--parse_workers", type=int, default=0, help="Number of parse workers (0 - parse inline)")
+    parser.add_argument("-mtf", "--metrics_fn", type=str, default=None, help="Filename (.json) of timing and metrics summary")
+    parser.add_argument("-si", "--stats_interval", type=float, default=None, help="Seconds between stats lines while crawling")
+    parser.add_argument("-pmf", "--prometheus_fn", type=str, default=None, help="Filename of metrics in Prometheus text format")
+    parser.add_argument("-pr", "--profile", type=str, default=None, choices=['cprofile', 'sampling'], help="Profile the crawl, with cProfile or a stack sampler")
+    parser.add_argument("-prf", "--profile_fn", type=str, default='profile', help="Prefix of profile files (.pstats/.collapsed, .txt, .alloc.txt)")
+    parser.add_argument("-prt", "--profile_top", type=int, default=20, help="Number of top functions and allocation sites in profile reports")
+    parser.add_argument("-sp", "--stream_parse", action='store_true', help="Parse business pages while they download and stop reading once all fields are found")
+    parser.add_argument("-pe", "--parse_executor", type=str, default='process', choices=['process', 'thread'], help="Kind of parse workers")
 
     args = parser.parse_args()
 
-    crwl = Crawler(output_fn=args.output_fn)
-    asyncio.run(crwl.run(category_name=args.category_name, location=args.location))
+    options = dict(max_pages=args.max_pages,
+                   max_business=args.max_business,
+                   max_reviews=args.max_reviews,
+                   output_fn=args.output_fn,
+                   output_format=args.output_format,
+                   output_compress=args.output_compress,
+                   flush_interval=args.flush_interval,
+                   state_fn=args.state_fn,
+                   resume=args.resume,
+                   previous_fn=args.previous_fn,
+                   previous_ttl=args.previous_ttl,
+                   concurrency=args.concurrency,
+                   limit_per_host=args.limit_per_host,
+                   rate_limit=args.rate_limit,
+                   adaptive=not args.no_adaptive,
+                   egress=args.egress,
+                   egress_cooldown=args.egress_cooldown,
+                   cache_size=args.cache_size * 2**20,
+                   cache_fn=args.cache_fn,
+                   cache_ttl=args.cache_ttl,
+                   validators_fn=args.validators_fn,
+                   parse_workers=args.parse_workers,
+                   parse_executor=args.parse_executor,
+                   metrics_fn=args.metrics_fn,
+                   stats_interval=args.stats_interval,
+                   prometheus_fn=args.prometheus_fn,
+                   stream_parse=args.stream_parse)
+    if args.export:
+        print(export_records(args.export, args.output_fn, args.output_format, args.output_compress))
+    elif args.merge:
+        crawl_id = None
+        if args.queue_fn:
+            queue = WorkQueue(args.queue_fn)
+            crawl_id = queue.crawl_id()
+            queue.close()
+        print(merge_shards(args.output_fn, args.output_format, args.output_compress, remove=args.remove_shards,
+                           crawl_id=crawl_id, keep_existing=args.resume))
+    elif args.queue_fn:
+        if args.join:
+            run_worker(args.queue_fn, **options)
+        else:
+            queries = read_queries(args.batch_fn) if args.batch_fn else [(args.category_name, args.location)]
+            print(run_distributed(queries, args.queue_fn, workers=args.workers, resume=args.resume,
+                                  remove_shards=args.remove_shards, **options))
+    else:
+        # budgets bound one process, workers of queue_fn stop when the queue is drained
+        crwl = Crawler(deadline=args.deadline,
+                       max_requests=args.max_requests,
+                       max_bytes=int(args.max_bytes * 2**20) if args.max_bytes else None,
+                       priority=args.priority,
+                       skipped_fn=args.skipped_fn,
+                       **options)
+        if args.batch_fn:
+            crawl = crwl.run_batch(read_queries(args.batch_fn),
+                                   per_query=args.per_query,
+                                   query_concurrency=args.query_concurrency)
+        else:
+            crawl = crwl.run(category_name=args.category_name, location=args.location)
+        if args.profile:
+            with Profiler(args.profile_fn, mode=args.profile, top=args.profile_top) as crwl.profiler:
+                asyncio.run(crawl)
+            print('Profile:  ', ', '.join(crwl.profiler.files))
+        else:
+            asyncio.run(crawl)
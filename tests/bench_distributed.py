@@ -0,0 +1,69 @@
+'''
+Benchmark of sharded crawling scaling with the number of worker processes.
+
+The local mock server runs in its own process (tests/mock_server.py), the
+same crawl is repeated by run_distributed with a growing number of
+workers over a fresh work queue. Reported are businesses per second and
+speedup over one worker.
+
+Usage:
+    python tests/bench_distributed.py -p 100 -pp 10 -w 1 2 4
+'''
+import contextlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from YelpCrawler.distributed import run_distributed
+
+
+@contextlib.contextmanager
+def mock_server(port: int, total_pages: int, per_page: int, latency: float):
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_server.py'),
+                               '-p', str(port), '-tp', str(total_pages), '-pp', str(per_page), '-lt', str(latency)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(url + '/biz/business-0-0').read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        yield url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench(total_pages: int, per_page: int, workers: list, latency: float, concurrency: int, port: int):
+    businesses = total_pages * per_page
+    print(f'Sharded crawl ({businesses} businesses, {os.cpu_count()} CPUs)'.center(60, '-'))
+    with mock_server(port, total_pages, per_page, latency) as url, tempfile.TemporaryDirectory() as tmp:
+        base = None
+        for w in workers:
+            _start = time.perf_counter()
+            with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+                stats = run_distributed([('Contractors', 'San Francisco, CA')], os.path.join(tmp, f'queue-{w}.db'),
+                                        workers=w, base_url=url, logger_fn=os.devnull, concurrency=concurrency,
+                                        output_fn=os.path.join(tmp, f'output-{w}.json'))
+            elapsed = time.perf_counter() - _start
+            base = base or businesses / elapsed
+            print(f'{w:>3} workers: {businesses / elapsed:8.1f} businesses/s, '
+                  f'x{businesses / elapsed / base:.2f}, {stats["failed"]} failed')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="sharded crawl throughput by worker count")
+    parser.add_argument("-p", "--total_pages", type=int, default=100, help="Number of search pages")
+    parser.add_argument("-pp", "--per_page", type=int, default=10, help="Businesses per search page")
+    parser.add_argument("-w", "--workers", type=int, nargs='+', default=[1, 2, 4], help="Worker counts")
+    parser.add_argument("-lt", "--latency", type=float, default=0.02, help="Delay of every mock response in seconds")
+    parser.add_argument("-c", "--concurrency", type=int, default=20, help="Requests in flight per worker")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the mock server")
+    args = parser.parse_args()
+    bench(args.total_pages, args.per_page, args.workers, args.latency, args.concurrency, args.port)
@@ -0,0 +1,62 @@
+'''
+Benchmark of per-element extraction cost on the stored fixture pages.
+
+'setters' assigns raw XPath strings to Business/Review property setters,
+so lxml compiles every expression for every element. 'schema' applies the
+precompiled schemas of YelpCrawler.parsers.
+
+Usage:
+    python tests/bench_extract.py -r 200
+'''
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lxml import html
+from YelpCrawler.structures import Business, Review
+from YelpCrawler.parsers import business_schema, review_schema
+from test_structures import read_fixture
+
+
+def business_setters(el):
+    business_body = Business(el)
+    business_body.business_name = './/div[1]/div/div/div/h3/span/a/text()'
+    business_body.business_yelp_url = './/div[1]/div/div/div/h3/span/a/@href'
+    business_body.business_rating = r'.//span[re:match(text(),"\d.\d")]/text()'
+    business_body.number_of_reviews = './/span[contains(text(),"review")]/text()'
+    return dict(business_body)
+
+
+def review_setters(el):
+    review_body = Review(el)
+    review_body.reviewer_name = './/div[contains(@class, "user-passport-info")]/span/a/text()'
+    review_body.reviewer_location = './/div[contains(@class, "user-passport-info")]/div/div/span/text()'
+    review_body.review_date = './/div[2]/div/div[2]/span/text()'
+    return dict(review_body)
+
+
+def measure(func, elements, rounds):
+    _start = time.perf_counter()
+    for _ in range(rounds):
+        for el in elements:
+            func(el)
+    return 1e6 * (time.perf_counter() - _start) / (rounds * len(elements))
+
+
+def bench(rounds: int):
+    cards = html.fromstring(read_fixture('search_page.html')).xpath('//div[contains(@class, "mainAttributes")]')
+    reviews = html.fromstring(read_fixture('business_page.html')).xpath(
+        '//ul[contains(@class, "undefined list")]/li/div[.//div[contains(@class, "user-passport-info")]]')
+    print(f'Extraction cost per element ({rounds} rounds)'.center(50, '-'))
+    for name, elements, setters, schema in (('business', cards, business_setters, business_schema.extract),
+                                            ('review', reviews, review_setters, review_schema.extract)):
+        print(f'{name:>9}: setters {measure(setters, elements, rounds):7.1f} us, '
+              f'schema {measure(schema, elements, rounds):7.1f} us')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="extraction cost per business card and review")
+    parser.add_argument("-r", "--rounds", type=int, default=200, help="Number of rounds over fixture elements")
+    args = parser.parse_args()
+    bench(args.rounds)
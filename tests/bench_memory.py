@@ -0,0 +1,95 @@
+'''
+Memory and serialisation benchmark of result records on synthetic businesses.
+
+'dict records' reproduces the former DataStructure: attributes in
+__dict__, a kept HtmlElement reference and serialisation that trial-dumps
+every attribute with json.dumps. 'slots records' is the current Business.
+
+Usage:
+    python tests/bench_memory.py -n 100000
+'''
+import gc
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lxml import html
+from YelpCrawler.structures import Business, is_serializable
+
+
+class DictBusiness(object):
+    def __init__(self, el):
+        self._html_element = el
+        self._domain = 'https://www.yelp.com'
+        self._business_name = None
+        self._business_rating = None
+        self._number_of_reviews = None
+        self._business_yelp_url = None
+        self._business_website = None
+        self.reviews = []
+
+    def update(self, values: dict):
+        for k, v in values.items():
+            setattr(self, '_'+k if hasattr(self, '_'+k) else k, v)
+        return self
+
+    def __iter__(self):
+        for k, v in self.__dict__.items():
+            if k not in ('_html_element', '_domain') and is_serializable(v):
+                yield (k.strip('_'), v)
+
+
+def synthetic(i: int) -> dict:
+    return {
+        'business_name': f'Business {i}',
+        'business_rating': 4.5,
+        'number_of_reviews': i % 500,
+        'business_yelp_url': f'https://www.yelp.com/biz/business-{i}',
+        'business_website': f'business-{i}.com',
+        'reviews': [{'reviewer_name': f'Reviewer {j}.', 'reviewer_location': 'San Francisco, CA',
+                     'review_date': '2023-07-31'} for j in range(5)],
+    }
+
+
+makers = {
+    'dict records': lambda i, el: DictBusiness(el).update(synthetic(i)),
+    'slots records': lambda i, el: Business(el).update(synthetic(i)).release(),
+}
+
+
+def measure(name: str, n: int):
+    # one search card per business, its tree stays alive while referenced
+    card = '<div class="mainAttributes"><h3><span><a href="/biz/x">Name</a></span></h3></div>'
+    make = makers[name]
+    gc.collect()
+    tracemalloc.start()
+    records = [make(i, html.fromstring(card)) for i in range(n)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    _start = time.perf_counter()
+    res = [dict(record) for record in records]
+    elapsed = time.perf_counter() - _start
+    assert res[0] == synthetic(0)
+    # python objects are traced by tracemalloc, lxml trees only show up in RSS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{name:>13}: {size / 2**20:7.1f} MB python objects, {rss:7.1f} MB peak RSS, '
+          f'serialised in {round(elapsed, 3)} s')
+
+
+def bench(n: int):
+    print(f'Result records ({n} businesses)'.center(50, '-'))
+    for name in makers:
+        process = multiprocessing.Process(target=measure, args=(name, n))
+        process.start()
+        process.join()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="memory and serialisation cost of result records")
+    parser.add_argument("-n", "--number", type=int, default=100000, help="Number of synthetic businesses")
+    args = parser.parse_args()
+    bench(args.number)
@@ -0,0 +1,69 @@
+'''
+Micro-benchmark of search page parsing on the stored fixture page.
+
+'legacy' repeats what the crawler did before SearchPage: the first page is
+parsed by get_total_pages, generate_review_queue and
+generate_business_obj_queue, every other page by the last two.
+'single parse' builds one SearchPage per page.
+
+Usage:
+    python tests/bench_parse.py -p 24
+'''
+import os
+import sys
+import time
+from unittest import mock
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lxml import html
+from YelpCrawler.api import Crawler
+from YelpCrawler.structures import SearchPage, get_digits, get_href
+from test_structures import read_fixture
+
+parses = 0
+_fromstring = html.fromstring
+
+
+def fromstring(text):
+    global parses
+    parses += 1
+    return _fromstring(text)
+
+
+def legacy(crawler: Crawler, text: str, first: bool):
+    if first:
+        page = fromstring(text)
+        get_digits(page.xpath('//div[contains(@class, "pagination_")]/div[2]/span/text()'))
+    page = fromstring(text)
+    for business in page.xpath('//div[contains(@class, "mainAttributes")]'):
+        get_href(business.xpath('.//div[1]/div/div/div/h3/span/a/@href'))
+    page = fromstring(text)
+    return [crawler.fetch_business(business) for business in page.xpath('//div[contains(@class, "mainAttributes")]')]
+
+
+def single_parse(crawler: Crawler, text: str, first: bool):
+    return SearchPage(text, crawler.fetch_business).businesses
+
+
+def bench(pages: int):
+    global parses
+    crawler = Crawler(logger_fn=os.devnull)
+    text = read_fixture('search_page.html')
+    print(f'Search page parse ({len(text) // 1024} KB, {pages} pages)'.center(50, '-'))
+    for name, func in (('legacy', legacy), ('single parse', single_parse)):
+        parses = 0
+        _start = time.perf_counter()
+        # SearchPage parses are counted too
+        with mock.patch('YelpCrawler.structures.html.fromstring', fromstring):
+            for page in range(pages):
+                func(crawler, text, page == 0)
+        elapsed = time.perf_counter() - _start
+        print(f'{name:>12}: {parses:4} parses, '
+              f'{1000 * elapsed / pages:7.2f} ms/page')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="parse count and time per search page")
+    parser.add_argument("-p", "--pages", type=int, default=24, help="Number of search pages")
+    args = parser.parse_args()
+    bench(args.pages)
@@ -0,0 +1,62 @@
+'''
+Benchmark of checkpoint and resume overhead on a synthetic crawl.
+
+Crawls the local mock server (10k businesses by default):
+- 'no state': plain crawl
+- 'checkpoint': the same crawl with state_fn, the difference is the
+  checkpointing overhead
+- 'resume, half done': resume after half of the businesses were lost
+- 'resume, all done': resume of a finished crawl, no page is fetched
+
+Usage:
+    python tests/bench_resume.py -p 1000 -pp 10
+'''
+import asyncio
+import contextlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from YelpCrawler.api import Crawler
+from mock_server import MockYelp
+
+
+async def crawl(server: MockYelp, tmp: str, state_fn: str = None, resume: bool = False):
+    crawler = Crawler(base_url=server.url, logger_fn=os.devnull, max_reviews=5, concurrency=50,
+                      output_fn=os.path.join(tmp, 'output.json'), state_fn=state_fn, resume=resume)
+    server.requests = 0
+    _start = time.perf_counter()
+    with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+        await crawler.run()
+    return time.perf_counter() - _start, server.requests
+
+
+async def bench(total_pages: int, per_page: int):
+    server = await MockYelp(total_pages=total_pages, per_page=per_page, reviews=10).start()
+    tmp = tempfile.TemporaryDirectory()
+    state_fn = os.path.join(tmp.name, 'state.db')
+    try:
+        print(f'Resume ({total_pages * per_page} businesses)'.center(50, '-'))
+        for name, resume in (('no state', None), ('checkpoint', False),
+                             ('resume, half done', True), ('resume, all done', True)):
+            if name == 'resume, half done':
+                db = sqlite3.connect(state_fn)
+                db.execute('UPDATE businesses SET record=NULL WHERE rowid % 2 = 0')
+                db.commit()
+                db.close()
+            elapsed, requests = await crawl(server, tmp.name, state_fn if resume is not None else None, resume)
+            print(f'{name:>17}: {round(elapsed, 3):8} s, {requests:6} requests')
+    finally:
+        await server.stop()
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="checkpoint and resume overhead")
+    parser.add_argument("-p", "--total_pages", type=int, default=1000, help="Number of search pages")
+    parser.add_argument("-pp", "--per_page", type=int, default=10, help="Businesses per search page")
+    args = parser.parse_args()
+    asyncio.run(bench(args.total_pages, args.per_page))
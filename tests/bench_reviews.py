@@ -0,0 +1,49 @@
+'''
+Regression benchmark of review detection on the stored business fixture page.
+
+'tostring' serialises every candidate list item with html.tostring and
+looks for 'user-passport-info' in the bytes (the former fetch_reviews).
+'selector' is the structural selector used by YelpCrawler.parsers.
+
+Usage:
+    python tests/bench_reviews.py -r 200
+'''
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lxml import html
+from YelpCrawler.parsers import extract_reviews, _reviews
+from test_structures import read_fixture
+
+
+def tostring(page):
+    reviews = page.xpath('//ul[contains(@class, "undefined list")]/li/div')
+    return list(filter(lambda x: b"user-passport-info" in html.tostring(x), reviews))
+
+
+def selector(page):
+    return _reviews(page)
+
+
+def bench(rounds: int):
+    page = html.fromstring(read_fixture('business_page.html'))
+    assert tostring(page) == selector(page), 'selector finds other review blocks'
+    print(f'Review detection ({len(selector(page))} reviews, {rounds} rounds)'.center(50, '-'))
+    for name, func in (('tostring', tostring), ('selector', selector)):
+        _start = time.perf_counter()
+        for _ in range(rounds):
+            func(page)
+        print(f'{name:>9}: {1000 * (time.perf_counter() - _start) / rounds:7.3f} ms/page')
+    _start = time.perf_counter()
+    for _ in range(rounds):
+        extract_reviews(page, max_reviews=5)
+    print(f'{"extract":>9}: {1000 * (time.perf_counter() - _start) / rounds:7.3f} ms/page (5 reviews)')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="cost of review detection per business page")
+    parser.add_argument("-r", "--rounds", type=int, default=200, help="Number of rounds")
+    args = parser.parse_args()
+    bench(args.rounds)
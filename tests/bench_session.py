@@ -0,0 +1,56 @@
+'''
+Benchmark of pooled session against a session per request.
+
+Fetches the same set of business pages from the local mock server twice:
+- 'per request': Crawler.fetch_url without open_session(), a new
+  ClientSession (and connection) is created for every URL
+- 'pooled': one shared session created by Crawler.open_session()
+
+Usage:
+    python tests/bench_session.py -n 500
+'''
+import asyncio
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from YelpCrawler.api import Crawler
+from mock_server import MockYelp
+
+
+async def fetch_all(crawler: Crawler, urls: list, pooled: bool):
+    crawler._cache.clear()
+    if pooled:
+        await crawler.open_session()
+    _start = time.perf_counter()
+    try:
+        await asyncio.gather(*[crawler.fetch_url(url) for url in urls])
+    finally:
+        await crawler.close_session()
+    return time.perf_counter() - _start
+
+
+async def bench(n: int):
+    server = await MockYelp(reviews=10).start()
+    tmp = tempfile.TemporaryDirectory()
+    crawler = Crawler(logger_fn=os.path.join(tmp.name, 'api.log'), base_url=server.url)
+    urls = [f'{server.url}/biz/business-{i}' for i in range(n)]
+    try:
+        print('Session benchmark'.center(40, '-'))
+        for name, pooled in (('per request', False), ('pooled', True)):
+            server.connections.clear()
+            elapsed = await fetch_all(crawler, urls, pooled)
+            print(f'{name:>12}: {n / elapsed:8.1f} req/s, '
+                  f'{len(server.connections)} connections, {round(elapsed, 3)} s')
+    finally:
+        await server.stop()
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="requests/sec with and without pooled session")
+    parser.add_argument("-n", "--number", type=int, default=500, help="Number of requests")
+    args = parser.parse_args()
+    asyncio.run(bench(args.number))
@@ -0,0 +1,91 @@
+'''
+Benchmark of the SQLite result store against the JSON output.
+
+Writes 'count' synthetic businesses (100k by default, 'reviews' reviews
+each, built from the sample output.json):
+- 'json': JSON array writer, the default output
+- 'sqlite, batch N': upserts into a new store, one transaction per N businesses
+- 'sqlite, upsert': the same businesses written again into a full store
+  (every row updated, reviews replaced)
+then reads them back:
+- 'lookup': 'get' of 1000 random businesses by URL
+- 'find': top 100 by number of reviews with rating >= 4 (indexes)
+- 'export': the store exported to output.json
+
+Usage:
+    python tests/bench_store.py -n 100000 -r 5
+'''
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from YelpCrawler.output import open_writer, export_records
+from YelpCrawler.store import ResultStore
+
+sample_fn = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'output.json')
+
+
+def businesses(count: int, reviews: int):
+    with open(sample_fn, encoding='utf-8') as f:
+        sample = [business for business in json.load(f) if len(business['reviews']) >= reviews]
+    for i in range(count):
+        business = dict(sample[i % len(sample)])
+        business['business_yelp_url'] = f'{business["business_yelp_url"]}-{i}'
+        business['number_of_reviews'] = (i * 7919) % 5000
+        business['reviews'] = business['reviews'][:reviews]
+        yield business
+
+
+def write(fn: str, output_format: str, records: list, **options) -> float:
+    _start = time.perf_counter()
+    with open_writer(fn, output_format) as writer:
+        if options:
+            writer._f.batch_size = options['batch_size']
+        for record in records:
+            writer.write(record)
+    return time.perf_counter() - _start
+
+
+def report(name: str, elapsed: float, count: int, fn: str = None):
+    size = f', {os.path.getsize(fn) / 2**20:7.1f} MB' if fn else ''
+    print(f'{name:>20}: {elapsed:7.3f} s, {count / elapsed:9.0f} businesses/s{size}')
+
+
+def bench(count: int, reviews: int):
+    records = list(businesses(count, reviews))
+    print(f'Result store ({count} businesses, {reviews} reviews each)'.center(70, '-'))
+    with tempfile.TemporaryDirectory() as tmp:
+        json_fn = os.path.join(tmp, 'output.json')
+        report('json', write(json_fn, 'json', records), count, json_fn)
+        for batch_size in (50, 500, 5000):
+            fn = os.path.join(tmp, f'output.{batch_size}.db')
+            report(f'sqlite, batch {batch_size}', write(fn, 'sqlite', records, batch_size=batch_size), count, fn)
+        report('sqlite, upsert', write(fn, 'sqlite', records, batch_size=500), count, fn)
+
+        store = ResultStore(fn)
+        urls = random.Random(0).sample([record['business_yelp_url'] for record in records], 1000)
+        _start = time.perf_counter()
+        for url in urls:
+            store.get(url)
+        elapsed = time.perf_counter() - _start
+        print(f'{"lookup":>20}: {elapsed / len(urls) * 1e6:7.1f} us per business')
+        _start = time.perf_counter()
+        top = list(store.find(min_rating=4, limit=100))
+        print(f'{"find":>20}: {(time.perf_counter() - _start) * 1000:7.1f} ms for top {len(top)}')
+        store.close()
+
+        _start = time.perf_counter()
+        exported = export_records(fn, os.path.join(tmp, 'exported.json'))
+        report('export', time.perf_counter() - _start, exported)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="SQLite result store insert and lookup throughput")
+    parser.add_argument("-n", "--count", type=int, default=100000, help="Number of businesses")
+    parser.add_argument("-r", "--reviews", type=int, default=5, help="Reviews per business")
+    args = parser.parse_args()
+    bench(args.count, args.reviews)
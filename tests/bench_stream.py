@@ -0,0 +1,54 @@
+'''
+Benchmark of streaming business page parse on the stored fixture page.
+
+Compares, per page, bytes read and parse time of
+- 'full': the whole body decoded and parsed by parse_business_page
+- 'stream': chunks fed to BusinessPageParser until website and
+  'max_reviews' reviews are found, the rest of the body is not read
+
+Usage:
+    python tests/bench_stream.py -n 200 -mr 5 -cs 16384
+'''
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from YelpCrawler.parsers import parse_business_page, BusinessPageParser
+from test_structures import read_fixture
+
+
+def full(body: bytes, max_reviews: int, chunk_size: int):
+    return parse_business_page(body.decode('utf-8'), max_reviews), len(body)
+
+
+def stream(body: bytes, max_reviews: int, chunk_size: int):
+    parser = BusinessPageParser(max_reviews)
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i:i + chunk_size])
+        if parser.done:
+            break
+    return parser.close(), parser.bytes_read
+
+
+def bench(n: int, max_reviews: int, chunk_size: int):
+    body = read_fixture('business_page.html').encode('utf-8')
+    print(f'Business page ({len(body) // 1024} KB, {max_reviews} reviews, {n} pages)'.center(60, '-'))
+    expected = parse_business_page(body.decode('utf-8'), max_reviews)
+    for name, func in (('full', full), ('stream', stream)):
+        res, bytes_read = func(body, max_reviews, chunk_size)
+        assert res == expected
+        _start = time.perf_counter()
+        for _ in range(n):
+            func(body, max_reviews, chunk_size)
+        elapsed = time.perf_counter() - _start
+        print(f'{name:>8}: {elapsed / n * 1000:8.3f} ms/page, {bytes_read // 1024:6} KB read')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="full vs streaming business page parse")
+    parser.add_argument("-n", "--number", type=int, default=200, help="Number of pages")
+    parser.add_argument("-mr", "--max_reviews", type=int, default=5, help="Reviews extracted per page")
+    parser.add_argument("-cs", "--chunk_size", type=int, default=16384, help="Bytes fed to the parser at a time")
+    args = parser.parse_args()
+    bench(args.number, args.max_reviews, args.chunk_size)
@@ -0,0 +1,56 @@
+'''
+Benchmark of parse pool scaling on the stored business fixture page.
+
+Parses the same business page N times the way Crawler.parse does:
+inline on the event loop, then in thread and process pools of growing
+size. Only the extracted dicts come back from the workers.
+
+Usage:
+    python tests/bench_workers.py -n 200 -w 1 2 4
+'''
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from YelpCrawler.parsers import parse_business_page
+from test_structures import read_fixture
+
+
+async def parse_all(pool, text: str, n: int, max_reviews: int):
+    loop = asyncio.get_running_loop()
+    if pool is None:
+        return [parse_business_page(text, max_reviews) for _ in range(n)]
+    return await asyncio.gather(*[loop.run_in_executor(pool, parse_business_page, text, max_reviews)
+                                  for _ in range(n)])
+
+
+async def bench(n: int, workers: list, max_reviews: int):
+    text = read_fixture('business_page.html')
+    print(f'Business page parse ({len(text) // 1024} KB, {n} pages, {os.cpu_count()} CPUs)'.center(60, '-'))
+    runs = [('inline', None, 0)]
+    runs += [('thread', ThreadPoolExecutor, w) for w in workers]
+    runs += [('process', ProcessPoolExecutor, w) for w in workers]
+    for name, executor, w in runs:
+        pool = executor(max_workers=w) if executor else None
+        try:
+            if pool is not None:
+                await parse_all(pool, text, w, max_reviews)
+            _start = time.perf_counter()
+            await parse_all(pool, text, n, max_reviews)
+            elapsed = time.perf_counter() - _start
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        print(f'{name:>8} x{w}: {n / elapsed:8.1f} pages/s')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="parse throughput by executor and worker count")
+    parser.add_argument("-n", "--number", type=int, default=200, help="Number of pages")
+    parser.add_argument("-w", "--workers", type=int, nargs='+', default=[1, 2, 4], help="Worker counts")
+    parser.add_argument("-mr", "--max_reviews", type=int, default=5, help="Reviews extracted per page")
+    args = parser.parse_args()
+    asyncio.run(bench(args.number, args.workers, args.max_reviews))
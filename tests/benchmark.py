@@ -0,0 +1,159 @@
+'''
+Reproducible benchmark suite of Crawler.run against the local mock server.
+
+Every scenario crawls the mock (tests/mock_server.py) with a different
+server profile. Crawler.run runs in a child process, so the server in
+this process does not count towards its resources:
+- businesses/s: gathered businesses per second of wall time
+- p50/p99 latency: time of page requests in milliseconds
+- peak RSS: maximum resident memory of the crawler process in MB
+- CPU time: user + system time of the crawler process in seconds
+
+Results can be stored as a baseline and later runs compared to it, a
+metric worse than the baseline by more than 'tolerance' is reported as a
+regression (exit code 1).
+
+Usage:
+    python tests/benchmark.py -p 200                              # run all scenarios
+    python tests/benchmark.py -s tests/benchmark_baseline.json    # store results as baseline
+    python tests/benchmark.py -b tests/benchmark_baseline.json    # compare with baseline
+'''
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from YelpCrawler.api import Crawler
+from mock_server import MockYelp
+
+scenarios = {
+    'plain': dict(),
+    'latency': dict(latency=0.02, latency_jitter=0.03),
+    'large pages': dict(padding=1000),
+    'errors': dict(error_rate=0.02, latency=0.005),
+}
+# True - higher is better
+metrics = {
+    'businesses_per_sec': True,
+    'p50_ms': False,
+    'p99_ms': False,
+    'peak_rss_mb': False,
+    'cpu_s': False,
+}
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def crawl(base_url: str, output_fn: str, options: dict) -> dict:
+    '''
+    Runs in the child process, returns metrics of one Crawler.run.
+    '''
+    crawler = Crawler(base_url=base_url, logger_fn=os.devnull, output_fn=output_fn, **options)
+    latencies = []
+    request = crawler._request
+
+    async def timed_request(session, url, *args, **kwargs):
+        _start = time.perf_counter()
+        try:
+            return await request(session, url, *args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - _start)
+
+    crawler._request = timed_request
+    _start = time.perf_counter()
+    with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+        await crawler.run()
+    elapsed = time.perf_counter() - _start
+    with open(output_fn, encoding='utf-8') as f:
+        gathered = len(json.load(f))
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'businesses': gathered,
+        'businesses_per_sec': round(gathered / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+        'cpu_s': round(usage.ru_utime + usage.ru_stime, 3),
+    }
+
+
+async def run_scenario(name: str, total_pages: int, per_page: int, options: dict, tmp: str) -> dict:
+    server = await MockYelp(total_pages=total_pages, per_page=per_page, reviews=10, **scenarios[name]).start()
+    try:
+        child = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), '--child',
+            json.dumps({'base_url': server.url, 'output_fn': os.path.join(tmp, 'output.json'), 'options': options}),
+            stdout=asyncio.subprocess.PIPE)
+        stdout, _ = await child.communicate()
+        if child.returncode:
+            raise RuntimeError(f'Scenario {name} failed with exit code {child.returncode}')
+        return json.loads(stdout.decode().strip().splitlines()[-1])
+    finally:
+        await server.stop()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    print('Comparison with baseline'.center(78, '-'))
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        for metric, higher_is_better in metrics.items():
+            old, new = baseline[name][metric], res[metric]
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            flag = ''
+            if worse > tolerance:
+                flag = 'REGRESSION'
+                regressions.append((name, metric))
+            print(f'{name:>12} {metric:>18}: {old:10} -> {new:10} ({change:+.1%}) {flag}')
+    return regressions
+
+
+async def bench(total_pages: int, per_page: int, names: list, options: dict):
+    results = dict()
+    print(f'Crawler.run ({total_pages * per_page} businesses per scenario)'.center(78, '-'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            results[name] = res = await run_scenario(name, total_pages, per_page, options, tmp)
+            print(f'{name:>12}: {res["businesses_per_sec"]:8} businesses/s, p50 {res["p50_ms"]:7} ms, '
+                  f'p99 {res["p99_ms"]:7} ms, RSS {res["peak_rss_mb"]:6} MB, CPU {res["cpu_s"]:6} s')
+    return results
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        args = json.loads(sys.argv[2])
+        print(json.dumps(asyncio.run(crawl(args['base_url'], args['output_fn'], args['options']))))
+        sys.exit(0)
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Crawler.run benchmark suite against the local mock server")
+    parser.add_argument("-p", "--total_pages", type=int, default=200, help="Number of search pages")
+    parser.add_argument("-pp", "--per_page", type=int, default=10, help="Businesses per search page")
+    parser.add_argument("-sc", "--scenarios", type=str, nargs='+', default=list(scenarios), choices=list(scenarios),
+                        help="Scenarios to run")
+    parser.add_argument("-c", "--concurrency", type=int, default=20, help="Crawler concurrency")
+    parser.add_argument("-s", "--save", type=str, default=None, help="Store results as baseline (.json)")
+    parser.add_argument("-b", "--baseline", type=str, default=None, help="Compare results with baseline (.json)")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    results = asyncio.run(bench(args.total_pages, args.per_page, args.scenarios,
+                                dict(max_reviews=5, concurrency=args.concurrency)))
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
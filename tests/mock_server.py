@@ -0,0 +1,310 @@
+'''
+Local mock of Yelp used by offline tests and benchmarks.
+
+Serves synthetic pages with the same structure the crawler expects:
+- /search?find_desc=..&find_loc=..&start=.. : search page with 'pagination_'
+  block and 'mainAttributes' business cards
+- /biz/<slug> : business page with 'biz_redir' link and reviews marked by
+  'user-passport-info', '?start=N' serves the next pages of reviews up to
+  the number of reviews on the search card
+
+With validators=True pages carry ETag/Last-Modified and conditional
+requests with matching validators get '304 Not Modified'.
+
+'latency' delays every response. With 'max_in_flight' the server sheds
+load like Yelp does: requests above that many in flight get '503' with a
+'Retry-After' header ('retry_after' seconds, None - no header).
+
+For benchmarks the mock can serve thousands of businesses
+('total_pages' x 'per_page'), 'padding' adds that many filler blocks to
+every page (about 120 bytes each), 'latency_jitter' randomizes latency by
+up to that many seconds and 'error_rate' answers that share of requests
+with 'error_status' (reproducible with 'seed').
+
+'MockProxy' is a forward HTTP proxy in front of the mock (aiohttp sends
+absolute URLs to it with 'proxy='), it answers 'deny_rate' share of
+requests with '503' itself, like a banned egress address, and counts
+'requests' and 'denied'.
+
+Usage:
+    >>> server = MockYelp(total_pages=3, per_page=10)
+    >>> await server.start()
+    >>> crawler = Crawler(base_url=server.url)
+    >>> await server.stop()
+    >>> server.requests
+    33
+'''
+import asyncio
+import hashlib
+import random
+import re
+import aiohttp
+from aiohttp import web
+
+
+def business_slug(page: int, idx: int) -> str:
+    return f'business-{page}-{idx}'
+
+
+def search_card(slug: str, idx: int, new_reviews: int = 0) -> str:
+    rating = 1 + (idx * 7 % 40) / 10
+    reviews = 10 + idx * 3 + new_reviews
+    return (f'<div class="container__09f24 mainAttributes__09f24">'
+            f'<div><div><div><div><h3><span>'
+            f'<a href="/biz/{slug}?osq=Contractors">Business {slug}</a>'
+            f'</span></h3></div></div></div></div>'
+            f'<div><div><span>{rating:.1f}</span>'
+            f'<span>({reviews} reviews)</span></div></div>'
+            f'</div>')
+
+
+def filler(blocks: int) -> str:
+    '''
+    Markup that only adds weight to the page, like menus and ads of real Yelp pages.
+    '''
+    return ''.join(f'<div class="css-{i:x} arrange__09f24"><div><a href="/filler/{i}">Link {i}</a>'
+                   f'<span class="css-{i:x}">Filler text {i}</span></div></div>'
+                   for i in range(blocks))
+
+
+def search_page(page: int, total_pages: int, per_page: int, padding: int = 0, updated: set = ()) -> str:
+    cards = ''.join(search_card(business_slug(page, idx), page * per_page + idx,
+                                int(business_slug(page, idx) in updated))
+                    for idx in range(per_page))
+    return (f'<!DOCTYPE html><html><head><title>Search</title></head><body>'
+            f'<div>{filler(padding)}</div>'
+            f'<ul><li>{cards}</li></ul>'
+            f'<div class="pagination__09f24"><div><span>prev</span></div>'
+            f'<div><span>{page + 1} of {total_pages}</span></div></div>'
+            f'</body></html>')
+
+
+def review_block(idx: int) -> str:
+    return (f'<li><div>'
+            f'<div><div class="user-passport-info border-color--default__09f24">'
+            f'<span><a href="/user_details?userid={idx}">Reviewer {idx}.</a></span>'
+            f'<div><div><span>City {idx}, CA</span></div></div></div></div>'
+            f'<div><div><div>stars</div><div><span>0{1 + idx % 9}/1{idx % 10}/2023</span></div></div></div>'
+            f'<p>{"Review text. " * 20}</p>'
+            f'</div></li>')
+
+
+def business_page(slug: str, reviews: int, padding: int = 0, start: int = 0, total: int = None) -> str:
+    '''
+    Page of 'reviews' reviews from 'start' (at most 'total' reviews in all pages).
+    '''
+    end = start + reviews if total is None else min(start + reviews, total)
+    blocks = '<li><div><span>Sponsored</span></div></li>'
+    blocks += ''.join(review_block(idx) for idx in range(start, end))
+    return (f'<!DOCTYPE html><html><head><title>{slug}</title></head><body>'
+            f'<a href="/biz_redir?url=http%3A%2F%2F{slug}.com">{slug}.com</a>'
+            f'<ul class="undefined list__09f24">{blocks}</ul>'
+            f'<div>{filler(padding)}</div>'
+            f'</body></html>')
+
+
+class MockYelp(object):
+    def __init__(self,
+                 total_pages: int = 3,
+                 per_page: int = 10,
+                 reviews: int = 10,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 validators: bool = False,
+                 latency: float = 0,
+                 max_in_flight: int = None,
+                 retry_after: float = None,
+                 padding: int = 0,
+                 latency_jitter: float = 0,
+                 error_rate: float = 0,
+                 error_status: int = 503,
+                 seed: int = 0):
+        self.total_pages = total_pages
+        self.per_page = per_page
+        self.reviews = reviews
+        self.host = host
+        self.port = port
+        self.validators = validators
+        self.latency = latency
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.padding = padding
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.errors = 0
+        self.last_modified = 'Mon, 31 Jul 2023 00:00:00 GMT'
+        self.requests = 0
+        self.not_modified = 0
+        self.sent_bytes = 0
+        self.connections = set()
+        self.rejected = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        # slugs of businesses that got a new review since the last crawl
+        self.updated = set()
+        self._runner = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def _track(self, request: web.Request):
+        self.requests += 1
+        peer = request.transport.get_extra_info('peername') if request.transport else None
+        self.connections.add(peer)
+
+    def _respond(self, request: web.Request, text: str):
+        headers = {}
+        if self.validators:
+            etag = f'"{hashlib.md5(text.encode()).hexdigest()}"'
+            if_none_match = request.headers.get('If-None-Match')
+            if if_none_match==etag or (if_none_match is None and
+                                       request.headers.get('If-Modified-Since')==self.last_modified):
+                self.not_modified += 1
+                return web.Response(status=304, headers={'ETag': etag})
+            headers = {'ETag': etag, 'Last-Modified': self.last_modified}
+        self.sent_bytes += len(text.encode())
+        return web.Response(text=text, content_type='text/html', headers=headers)
+
+    async def _serve(self, request: web.Request, render):
+        self._track(request)
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            headers = {'Retry-After': str(self.retry_after)} if self.retry_after is not None else {}
+            return web.Response(status=503, headers=headers)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            latency = self.latency + self.random.uniform(0, self.latency_jitter)
+            if latency:
+                await asyncio.sleep(latency)
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return web.Response(status=self.error_status)
+            return self._respond(request, render())
+        finally:
+            self.in_flight -= 1
+
+    async def search(self, request: web.Request):
+        page = int(request.query.get('start', 0)) // 10
+        return await self._serve(request, lambda: search_page(page, self.total_pages, self.per_page,
+                                                              self.padding, self.updated))
+
+    def review_total(self, slug: str) -> int:
+        # number of reviews shown on the search card of the business
+        match = re.fullmatch(r'business-(\d+)-(\d+)', slug)
+        if match is None:
+            # not listed on a search page (e.g. '/biz/business-7'), one page of reviews
+            return self.reviews
+        page, idx = map(int, match.groups())
+        return 10 + (page * self.per_page + idx) * 3 + int(slug in self.updated)
+
+    async def business(self, request: web.Request):
+        slug = request.match_info['slug']
+        # '?start=N' pages through reviews, 'reviews' per page
+        start = int(request.query.get('start', 0))
+        total = self.review_total(slug)
+        return await self._serve(request, lambda: business_page(slug, self.reviews, self.padding, start, total))
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/search', self.search)
+        app.router.add_get('/biz/{slug}', self.business)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class MockProxy(object):
+    # headers of the proxied response passed back to the client
+    forwarded = ('Content-Type', 'ETag', 'Last-Modified', 'Retry-After')
+
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 deny_rate: float = 0,
+                 retry_after: float = None,
+                 latency: float = 0,
+                 seed: int = 0):
+        self.host = host
+        self.port = port
+        self.deny_rate = deny_rate
+        self.retry_after = retry_after
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.denied = 0
+        self._runner = None
+        self._session = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    async def handle(self, request: web.BaseRequest):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.deny_rate and self.random.random() < self.deny_rate:
+            self.denied += 1
+            headers = {'Retry-After': str(self.retry_after)} if self.retry_after is not None else {}
+            return web.Response(status=503, headers=headers)
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in ('host', 'proxy-connection')}
+        async with self._session.get(str(request.url), headers=headers) as r:
+            body = await r.read()
+            return web.Response(status=r.status, body=body,
+                                headers={k: r.headers[k] for k in self.forwarded if k in r.headers})
+
+    async def start(self):
+        self._session = aiohttp.ClientSession()
+        self._runner = web.ServerRunner(web.Server(self.handle), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="local mock of Yelp search and business pages")
+    parser.add_argument("-p", "--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("-tp", "--total_pages", type=int, default=3, help="Number of search pages")
+    parser.add_argument("-pp", "--per_page", type=int, default=10, help="Businesses per search page")
+    parser.add_argument("-r", "--reviews", type=int, default=10, help="Reviews per business page")
+    parser.add_argument("-pd", "--padding", type=int, default=0, help="Filler blocks added to every page")
+    parser.add_argument("-lt", "--latency", type=float, default=0, help="Delay of every response in seconds")
+    parser.add_argument("-lj", "--latency_jitter", type=float, default=0, help="Random extra delay up to seconds")
+    parser.add_argument("-er", "--error_rate", type=float, default=0, help="Share of requests answered with error_status")
+    parser.add_argument("-es", "--error_status", type=int, default=503, help="Status of injected errors")
+    parser.add_argument("-mf", "--max_in_flight", type=int, default=None,
+                        help="Requests in flight above which 503 is returned")
+    parser.add_argument("-ra", "--retry_after", type=float, default=None, help="Retry-After of 503 responses")
+    args = parser.parse_args()
+
+    server = MockYelp(total_pages=args.total_pages, per_page=args.per_page, reviews=args.reviews, port=args.port,
+                      latency=args.latency, max_in_flight=args.max_in_flight, retry_after=args.retry_after,
+                      padding=args.padding, latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+                      error_status=args.error_status)
+    web.run_app(server.app(), host=server.host, port=args.port)
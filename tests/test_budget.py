@@ -0,0 +1,36 @@
+import time
+import unittest
+from YelpCrawler.budget import Budget, BudgetExhausted
+
+
+class BudgetTest(unittest.TestCase):
+    def test_max_requests(self):
+        budget = Budget(max_requests=2).start()
+        budget.acquire()
+        budget.acquire()
+        with self.assertRaises(BudgetExhausted) as cm:
+            budget.acquire()
+        self.assertEqual(cm.exception.reason, 'requests')
+        self.assertEqual(budget.stats()['requests'], 2)
+        self.assertIsNone(budget.remaining())
+
+    def test_max_bytes(self):
+        budget = Budget(max_bytes=1000).start()
+        budget.acquire(nbytes=999)
+        self.assertEqual(budget.check(nbytes=1000), 'bytes')
+        # stays exhausted
+        self.assertEqual(budget.check(nbytes=0), 'bytes')
+
+    def test_deadline(self):
+        budget = Budget(deadline=0.05).start()
+        self.assertGreater(budget.remaining(), 0)
+        budget.acquire()
+        time.sleep(0.06)
+        self.assertEqual(budget.remaining(), 0)
+        with self.assertRaises(BudgetExhausted):
+            budget.acquire()
+        self.assertEqual(budget.start().exhausted, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
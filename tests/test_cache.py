@@ -0,0 +1,121 @@
+import os
+import tempfile
+import time
+import unittest
+from YelpCrawler.api import Crawler
+from YelpCrawler.cache import Cache, MemoryCache
+from mock_server import MockYelp
+
+
+class MemoryCacheTest(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = MemoryCache(max_size=30)
+        for url in 'abc':
+            cache.set(url, url * 10)
+        cache.get('a')
+        cache.set('d', 'd' * 10)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'a' * 10)
+        self.assertEqual(cache.size, 30)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl(self):
+        cache = MemoryCache(ttl=0.01)
+        cache.set('a', 'text')
+        self.assertEqual(cache.get('a'), 'text')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 0)
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fn = os.path.join(self.tmp.name, 'cache.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_disk_persistence(self):
+        cache = Cache(max_size=10, fn=self.fn)
+        cache['a'] = '<html>' + 'a' * 1000 + '</html>'
+        cache['b'] = '<html>b</html>'
+        cache.close()
+        self.assertLess(os.path.getsize(self.fn), 16 * 1024)
+
+        cache = Cache(max_size=10, fn=self.fn)
+        self.assertEqual(cache['a'], '<html>' + 'a' * 1000 + '</html>')
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+        cache.close()
+
+    def test_disk_ttl(self):
+        cache = Cache(fn=self.fn, ttl=0.01)
+        cache['a'] = 'text'
+        cache.memory.clear()
+        time.sleep(0.02)
+        self.assertNotIn('a', cache)
+        cache.close()
+
+    def test_batched_commits(self):
+        cache = Cache(fn=self.fn)
+        cache.disk.commit_interval = 60
+        cache['a'] = 'text'
+        reader = Cache(fn=self.fn)
+        # not committed yet, visible to other connections after close
+        self.assertIsNone(reader.get('a'))
+        cache.close()
+        self.assertEqual(reader.get('a'), 'text')
+        reader.close()
+        # a closed cache is opened again
+        self.assertEqual(cache.open()['a'], 'text')
+        cache.close()
+
+
+class CachedCrawlTest(unittest.IsolatedAsyncioTestCase):
+    async def test_repeated_run(self):
+        server = await MockYelp(total_pages=2, per_page=5).start()
+        tmp = tempfile.TemporaryDirectory()
+        try:
+            for _ in range(2):
+                crawler = Crawler(base_url=server.url, logger_fn=os.devnull,
+                                  output_fn=os.path.join(tmp.name, 'output.json'),
+                                  cache_fn=os.path.join(tmp.name, 'cache.db'))
+                await crawler.run()
+            self.assertEqual(server.requests, 2 + 10)
+        finally:
+            await server.stop()
+            tmp.cleanup()
+
+
+class ConditionalRequestTest(unittest.IsolatedAsyncioTestCase):
+    async def test_not_modified(self):
+        server = await MockYelp(total_pages=2, per_page=5, validators=True).start()
+        tmp = tempfile.TemporaryDirectory()
+        validators_fn = os.path.join(tmp.name, 'validators.db')
+        try:
+            outputs = []
+            for _ in range(2):
+                server.sent_bytes = 0
+                crawler = Crawler(base_url=server.url, logger_fn=os.devnull,
+                                  output_fn=os.path.join(tmp.name, f'output{len(outputs)}.json'),
+                                  validators_fn=validators_fn)
+                await crawler.run()
+                with open(crawler.output_fn, encoding='utf-8') as f:
+                    outputs.append(sorted(f.read().splitlines()))
+            self.assertEqual(server.requests, 2 * (2 + 10))
+            self.assertEqual(server.not_modified, 12)
+            self.assertEqual(server.sent_bytes, 0)
+            self.assertEqual(crawler.validators.not_modified, 12)
+            self.assertGreater(crawler.validators.bytes_saved, 0)
+            # first search page is also read from the cache by its search stage
+            self.assertEqual(crawler._cache.hits, 12 + 1)
+            self.assertEqual(outputs[0], outputs[1])
+        finally:
+            await server.stop()
+            tmp.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
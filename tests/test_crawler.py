@@ -0,0 +1,267 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+from YelpCrawler.api import Crawler, query_output_fn, read_queries, review_page_url, merge_reviews
+from YelpCrawler.structures import Business
+from mock_server import MockYelp
+
+
+class CrawlerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await MockYelp(total_pages=3, per_page=5, reviews=7).start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output_fn = os.path.join(self.tmp.name, 'output.json')
+        self.crawler = Crawler(max_reviews=5,
+                               logger_fn=os.path.join(self.tmp.name, 'api.log'),
+                               output_fn=self.output_fn,
+                               base_url=self.server.url)
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+        self.tmp.cleanup()
+
+    async def test_run(self):
+        await self.crawler.run(category_name='Contractors', location='San Francisco, CA')
+        with open(self.output_fn, encoding='utf-8') as f:
+            res = json.load(f)
+        self.assertEqual(len(res), 15)
+        res = sorted(res, key=lambda x: x['business_yelp_url'])
+        self.assertEqual(list(res[0].keys()), ['business_name', 'business_rating', 'number_of_reviews',
+                                               'business_yelp_url', 'business_website', 'reviews'])
+        self.assertEqual(res[0]['business_yelp_url'], self.server.url + '/biz/business-0-0')
+        self.assertEqual(res[0]['business_website'], 'business-0-0.com')
+        self.assertEqual(len(res[0]['reviews']), 5)
+        self.assertEqual(list(res[0]['reviews'][0].keys()), ['reviewer_name', 'reviewer_location', 'review_date'])
+
+    async def test_parse_pool(self):
+        for executor in ('thread', 'process'):
+            self.crawler.parse_executor = executor
+            self.crawler.parse_workers = 2
+            await self.crawler.run(category_name='Contractors', location='San Francisco, CA')
+            self.assertIsNone(self.crawler.parse_pool)
+            with open(self.output_fn, encoding='utf-8') as f:
+                res = json.load(f)
+            self.assertEqual(len(res), 15)
+            self.assertTrue(all(len(business['reviews']) == 5 for business in res))
+
+    async def test_session_is_pooled(self):
+        await self.crawler.run(category_name='Contractors', location='San Francisco, CA')
+        self.assertIsNone(self.crawler.session)
+        self.assertEqual(self.server.requests, 3 + 15)
+        self.assertLessEqual(len(self.server.connections), self.crawler.session_options['limit_per_host'])
+
+    async def test_coalescing(self):
+        await self.crawler.open_session()
+        try:
+            url = self.server.url + '/biz/business-0-0'
+            res = await asyncio.gather(self.crawler.fetch_url(url),
+                                       self.crawler.fetch_url(url + '#reviews'),
+                                       self.crawler.fetch_url(url.upper().replace('/BIZ/BUSINESS', '/biz/business')))
+        finally:
+            await self.crawler.close_session()
+        self.assertEqual(len(set(res)), 1)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.crawler.coalesced, 2)
+        self.assertEqual(self.crawler._in_flight, {})
+
+    async def test_stream_coalescing(self):
+        await self.crawler.open_session()
+        try:
+            url = self.server.url + '/biz/business-0-0'
+            res = await asyncio.gather(self.crawler.fetch_business_page(url),
+                                       self.crawler.fetch_business_page(url + '#reviews'))
+        finally:
+            await self.crawler.close_session()
+        self.assertEqual(res[0], res[1])
+        self.assertEqual(len(res[0][0]['reviews']), 5)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.crawler.coalesced, 1)
+        self.assertEqual(self.crawler._in_flight, {})
+
+    async def test_streaming(self):
+        self.server.total_pages = 20
+        crawler = Crawler(max_pages=20, base_url=self.server.url, concurrency=2, queue_size=2)
+        await crawler.open_session()
+        try:
+            async for business_body in crawler.fetch_details(desc='Contractors', loc='San Francisco, CA'):
+                self.assertEqual(len(business_body.reviews), 5)
+                break
+        finally:
+            await crawler.scheduler.close()
+            await crawler.close_session()
+        self.assertLess(self.server.requests, 20 + 20 * 5)
+
+    async def test_batch(self):
+        # the mock serves the same businesses for every query
+        queries = [('Contractors', 'San Francisco, CA'), ('Plumbers', 'Oakland, CA')]
+        await self.crawler.run_batch(queries)
+        with open(self.output_fn, encoding='utf-8') as f:
+            res = json.load(f)
+        self.assertEqual(len(res), 15)
+        self.assertEqual(len({business['business_yelp_url'] for business in res}), 15)
+        self.assertEqual(self.crawler.duplicates, 15)
+        # one connection pool for both queries
+        self.assertLessEqual(len(self.server.connections), 10)
+        self.assertEqual(self.server.requests, 2 * 3 + 15)
+
+    async def test_batch_per_query(self):
+        queries = [('Contractors', 'San Francisco, CA'), ('Plumbers', 'Oakland, CA')]
+        await self.crawler.run_batch(queries, per_query=True)
+        urls = []
+        for category_name, location in queries:
+            with open(query_output_fn(self.output_fn, category_name, location), encoding='utf-8') as f:
+                urls.extend(business['business_yelp_url'] for business in json.load(f))
+        self.assertEqual(len(urls), 15)
+        self.assertEqual(len(set(urls)), 15)
+        self.assertFalse(os.path.exists(self.output_fn))
+
+    def test_read_queries(self):
+        fn = os.path.join(self.tmp.name, 'queries.tsv')
+        with open(fn, 'w', encoding='utf-8') as f:
+            f.write('# category\tlocation\nContractors\tSan Francisco, CA\n\nPlumbers\t Oakland, CA\n')
+        self.assertEqual(read_queries(fn), [('Contractors', 'San Francisco, CA'), ('Plumbers', 'Oakland, CA')])
+        self.assertEqual(query_output_fn('out/output.json.gz', 'Contractors', 'San Francisco, CA'),
+                         'out/output.Contractors.San-Francisco-CA.json.gz')
+
+    async def test_stream_parse(self):
+        self.server.padding = 2000
+        await self.crawler.run(category_name='Contractors', location='San Francisco, CA')
+        with open(self.output_fn, encoding='utf-8') as f:
+            expected = sorted(json.load(f), key=lambda x: x['business_yelp_url'])
+        crawler = Crawler(max_reviews=5, logger_fn=os.devnull, output_fn=self.output_fn,
+                          base_url=self.server.url, stream_parse=True)
+        await crawler.run(category_name='Contractors', location='San Francisco, CA')
+        with open(self.output_fn, encoding='utf-8') as f:
+            self.assertEqual(sorted(json.load(f), key=lambda x: x['business_yelp_url']), expected)
+        counters = crawler.metrics.counters
+        self.assertEqual(counters['stream_early_stops'], 15)
+        self.assertEqual(crawler.metrics.histograms['parse_business_page_stream'].count, 15)
+        # business pages are ~240 KB each with padding
+        self.assertLess(counters['stream_bytes_read'], 15 * 64 * 1024)
+
+    async def test_review_pages(self):
+        # pages overlap by 2 reviews, every business has 10 + 3 * index reviews
+        self.server.reviews = 12
+        for stream_parse in (False, True):
+            self.server.requests = 0
+            crawler = Crawler(max_reviews=25, logger_fn=os.devnull, output_fn=self.output_fn,
+                              base_url=self.server.url, stream_parse=stream_parse)
+            await crawler.run(category_name='Contractors', location='San Francisco, CA')
+            with open(self.output_fn, encoding='utf-8') as f:
+                res = json.load(f)
+            self.assertEqual(len(res), 15)
+            for business in res:
+                names = [review['reviewer_name'] for review in business['reviews']]
+                self.assertEqual(names, [f'Reviewer {idx}.'
+                                         for idx in range(min(25, business['number_of_reviews']))])
+            # 1 extra page for 13-19 reviews, 2 for 22 and more
+            self.assertEqual(crawler.metrics.counters['review_pages'], 3 + 11 * 2)
+            self.assertEqual(self.server.requests, 3 + 15 + 25)
+
+    def test_review_page_url(self):
+        self.assertEqual(review_page_url('http://localhost/biz/x', 10), 'http://localhost/biz/x?start=10')
+        self.assertEqual(review_page_url('http://localhost/biz/x?osq=A+B&start=10', 20),
+                         'http://localhost/biz/x?osq=A+B&start=20')
+        self.crawler.max_reviews = 30
+        business_body = Business(None).update({'business_yelp_url': 'http://localhost/biz/x',
+                                               'number_of_reviews': 25})
+        self.assertEqual(self.crawler.review_page_urls(business_body),
+                         ['http://localhost/biz/x?start=10', 'http://localhost/biz/x?start=20'])
+        self.crawler.max_reviews = None
+        self.assertEqual(self.crawler.review_page_urls(business_body), [])
+
+    def test_merge_reviews(self):
+        pages = [[{'reviewer_name': name} for name in 'ABC'], [{'reviewer_name': name} for name in 'CDE']]
+        # pages of 3 reviews start every 2 reviews, position 2 is served twice
+        self.assertEqual(merge_reviews(pages, per_page=2), [{'reviewer_name': name} for name in 'ABCDE'])
+        self.assertEqual(merge_reviews(pages, 3, per_page=2), [{'reviewer_name': name} for name in 'ABC'])
+        # same author, date and text at different positions are two reviews
+        same = {'reviewer_name': 'A', 'reviewer_location': 'City 0, CA', 'review_date': '2023-01-10'}
+        self.assertEqual(merge_reviews([[same, same], [same]], per_page=2), [same] * 3)
+
+    async def test_request_budget(self):
+        skipped_fn = os.path.join(self.tmp.name, 'skipped.json')
+        crawler = Crawler(max_reviews=5, logger_fn=os.devnull, output_fn=self.output_fn, base_url=self.server.url,
+                          concurrency=1, max_requests=8, priority='reviews', skipped_fn=skipped_fn)
+        await crawler.run(category_name='Contractors', location='San Francisco, CA')
+        with open(self.output_fn, encoding='utf-8') as f:
+            res = json.load(f)
+        with open(skipped_fn, encoding='utf-8') as f:
+            summary = json.load(f)
+        # first search page, 2 more search pages and 5 business pages
+        self.assertEqual(self.server.requests, 8)
+        self.assertEqual(len(res), 5)
+        self.assertEqual(summary['budget']['exhausted'], 'requests')
+        self.assertEqual(summary['budget']['requests'], 8)
+        self.assertEqual(summary['gathered'], 5)
+        self.assertEqual(summary['skipped_search_pages'], [])
+        self.assertEqual(len(summary['skipped_businesses']), 10)
+        # most reviewed businesses go first, in order of search rank the first 5 would have 10-22 reviews
+        self.assertGreaterEqual(min(business['number_of_reviews'] for business in res), 25)
+        self.assertGreater(min(business['number_of_reviews'] for business in res),
+                           max(business['number_of_reviews'] for business in summary['skipped_businesses'][:5]))
+
+    async def test_byte_budget(self):
+        # search pages are ~25 KB, business pages ~30 KB with padding
+        self.server.padding = 200
+        skipped_fn = os.path.join(self.tmp.name, 'skipped.json')
+        for stream_parse in (False, True):
+            self.server.requests = 0
+            crawler = Crawler(max_reviews=5, logger_fn=os.devnull, output_fn=self.output_fn, base_url=self.server.url,
+                              concurrency=1, max_bytes=150000, stream_parse=stream_parse, skipped_fn=skipped_fn)
+            await crawler.run(category_name='Contractors', location='San Francisco, CA')
+            with open(self.output_fn, encoding='utf-8') as f:
+                res = json.load(f)
+            with open(skipped_fn, encoding='utf-8') as f:
+                summary = json.load(f)
+            self.assertEqual(summary['budget']['exhausted'], 'bytes')
+            # streamed business pages count too
+            self.assertGreaterEqual(summary['budget']['bytes'], 150000)
+            self.assertEqual(summary['budget']['bytes'], crawler.bytes_received)
+            self.assertLess(self.server.requests, 3 + 15)
+            self.assertEqual(len(res) + len(summary['skipped_businesses']) + 5 * len(summary['skipped_search_pages']),
+                             15)
+
+    async def test_deadline(self):
+        self.server.latency = 0.1
+        skipped_fn = os.path.join(self.tmp.name, 'skipped.json')
+        crawler = Crawler(max_reviews=5, logger_fn=os.devnull, output_fn=self.output_fn, base_url=self.server.url,
+                          deadline=0.25, skipped_fn=skipped_fn)
+        _start = time.monotonic()
+        await crawler.run(category_name='Contractors', location='San Francisco, CA')
+        self.assertLess(time.monotonic() - _start, 1.0)
+        with open(self.output_fn, encoding='utf-8') as f:
+            res = json.load(f)
+        with open(skipped_fn, encoding='utf-8') as f:
+            summary = json.load(f)
+        self.assertEqual(summary['budget']['exhausted'], 'deadline')
+        self.assertLess(len(res), 15)
+        # every business is either written or skipped with its page
+        self.assertEqual(len(res) + len(summary['skipped_businesses']) + 5 * len(summary['skipped_search_pages']), 15)
+
+    async def test_injected_errors(self):
+        self.server.error_rate = 0.1
+        await self.crawler.run(category_name='Contractors', location='San Francisco, CA')
+        with open(self.output_fn, encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)), 15)
+        self.assertGreater(self.server.errors, 0)
+        self.assertEqual(self.server.requests, 3 + 15 + self.server.errors)
+
+    async def test_adaptive_concurrency(self):
+        self.server.max_in_flight = 3
+        self.server.latency = 0.02
+        self.server.retry_after = 0.1
+        await self.crawler.run(category_name='Contractors', location='San Francisco, CA')
+        with open(self.output_fn, encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)), 15)
+        self.assertGreater(self.server.rejected, 0)
+        stats = self.crawler.limiter.stats()
+        self.assertGreater(stats['decreases'], 0)
+        self.assertLess(stats['min_window'], 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import time
+import unittest
+from YelpCrawler.api import Crawler
+from YelpCrawler.distributed import WorkQueue, Worker, seed, run_distributed, merge_shards, shard_output_fn, _work
+from YelpCrawler.distributed import SEARCH, BUSINESS
+from YelpCrawler.output import open_writer
+from mock_server import MockYelp
+
+
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fn = os.path.join(self.tmp.name, 'queue.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lease(self):
+        queue = WorkQueue(self.fn, lease_time=0.1, max_attempts=2)
+        queue.put([(SEARCH, 'search-0', {'page': 0}), (SEARCH, 'search-0', {'page': 0})])
+        (job_id, kind, url, payload), = queue.lease('w0', 10)
+        self.assertEqual((kind, url, payload), (SEARCH, 'search-0', {'page': 0}))
+        self.assertEqual(queue.lease('w1', 10), [])
+        queue.complete(job_id, [(BUSINESS, 'biz-0', {}), (BUSINESS, 'biz-1', {}), (SEARCH, 'search-0', {})])
+        self.assertEqual(queue.stats(), {'pending': 2, 'leased': 0, 'done': 1, 'failed': 0})
+
+        jobs = queue.lease('w0', 10)
+        self.assertEqual([url for _, _, url, _ in jobs], ['biz-0', 'biz-1'])
+        queue.fail(jobs[0][0], 'Code 503')
+        # lease of a dead worker expires
+        time.sleep(0.15)
+        jobs = queue.lease('w1', 10)
+        self.assertEqual([url for _, _, url, _ in jobs], ['biz-0', 'biz-1'])
+        for job_id, _, _, _ in jobs:
+            queue.fail(job_id, 'Code 503')
+        self.assertEqual(queue.stats(), {'pending': 0, 'leased': 0, 'done': 1, 'failed': 2})
+        self.assertTrue(queue.finished())
+        queue.close()
+
+    def test_merge_shards(self):
+        output_fn = os.path.join(self.tmp.name, 'output.json')
+        for worker_id, urls in (('a', ['biz-0', 'biz-1']), ('b', ['biz-1', 'biz-2'])):
+            with open_writer(shard_output_fn(output_fn, worker_id), 'json') as writer:
+                for url in urls:
+                    writer.write({'business_yelp_url': url})
+        self.assertEqual(merge_shards(output_fn, remove=True), 3)
+        with open(output_fn, encoding='utf-8') as f:
+            self.assertEqual([business['business_yelp_url'] for business in json.load(f)], ['biz-0', 'biz-1', 'biz-2'])
+        self.assertEqual(os.listdir(self.tmp.name), ['output.json'])
+
+    def test_merge_keeps_existing(self):
+        output_fn = os.path.join(self.tmp.name, 'output.json')
+        with open_writer(output_fn, 'json') as writer:
+            writer.write({'business_yelp_url': 'biz-0'})
+        with open_writer(shard_output_fn(output_fn, 'c1-a'), 'json') as writer:
+            writer.write({'business_yelp_url': 'biz-1'})
+        with open_writer(shard_output_fn(output_fn, 'c0-a'), 'json') as writer:
+            writer.write({'business_yelp_url': 'biz-9'})
+        # a worker still writes this shard
+        with open(shard_output_fn(output_fn, 'c1-b'), 'w', encoding='utf-8') as f:
+            f.write('[\n  {"business_yelp_url": "biz-2"}')
+        self.assertEqual(merge_shards(output_fn, crawl_id='c1', keep_existing=True, remove=True), 2)
+        with open(output_fn, encoding='utf-8') as f:
+            self.assertEqual([business['business_yelp_url'] for business in json.load(f)], ['biz-0', 'biz-1'])
+        # only the merged shard of the crawl is removed
+        self.assertEqual(sorted(os.listdir(self.tmp.name)),
+                         ['output.json', 'output.shard-c0-a.json', 'output.shard-c1-b.json'])
+
+    def test_crawl_id(self):
+        queue = WorkQueue(self.fn)
+        crawl_id = queue.crawl_id()
+        self.assertEqual(queue.crawl_id(), crawl_id)
+        queue.reset()
+        self.assertNotEqual(queue.crawl_id(), crawl_id)
+        queue.close()
+
+
+class DistributedTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await MockYelp(total_pages=4, per_page=5, reviews=7).start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.options = dict(base_url=self.server.url, logger_fn=os.devnull, max_reviews=5,
+                            output_fn=os.path.join(self.tmp.name, 'output.json'))
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+        self.tmp.cleanup()
+
+    async def test_run_distributed(self):
+        queries = [('Contractors', 'San Francisco, CA'), ('Plumbers', 'Oakland, CA')]
+        # workers are separate processes, the mock keeps serving in this loop
+        stats = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: run_distributed(queries, os.path.join(self.tmp.name, 'queue.db'), workers=2, **self.options))
+        # both queries list the same 20 businesses of the mock
+        self.assertEqual(stats, {'pending': 0, 'leased': 0, 'done': 2 * 4 + 20, 'failed': 0})
+        with open(self.options['output_fn'], encoding='utf-8') as f:
+            res = json.load(f)
+        self.assertEqual(len({business['business_yelp_url'] for business in res}), 20)
+        self.assertTrue(all(len(business['reviews']) == 5 for business in res))
+        self.assertEqual(self.server.requests, 2 * 4 + 20)
+        # shards are kept unless remove_shards=True
+        self.assertEqual(len([fn for fn in os.listdir(self.tmp.name) if '.shard-' in fn]), 2)
+
+    async def test_resume(self):
+        queue_fn = os.path.join(self.tmp.name, 'queue.db')
+        self.server.latency = 0.02
+        seed(queue_fn, [('Contractors', 'San Francisco, CA')], **self.options)
+        # the first run is interrupted once some businesses are written, its
+        # worker id is one a local worker of the resumed run could get
+        worker_id = f'{socket.gethostname()}-0'
+        task = asyncio.create_task(_work(queue_fn, worker_id, 0.5, True, self.options))
+        queue = WorkQueue(queue_fn)
+        while queue.stats()['done'] < 4 + 5:
+            await asyncio.sleep(0.01)
+        queue.close()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        stats = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: run_distributed([], queue_fn, workers=2, lease_time=0.5, resume=True, **self.options))
+        self.assertEqual(stats, {'pending': 0, 'leased': 0, 'done': 4 + 20, 'failed': 0})
+        with open(self.options['output_fn'], encoding='utf-8') as f:
+            res = json.load(f)
+        # businesses of the interrupted run are merged too
+        self.assertEqual(len(res), 20)
+        self.assertEqual(len({business['business_yelp_url'] for business in res}), 20)
+
+    async def test_failed_worker(self):
+        queue_fn = os.path.join(self.tmp.name, 'queue.db')
+        seed(queue_fn, [('Contractors', 'San Francisco, CA')], **self.options)
+        with open_writer(self.options['output_fn'], 'json') as writer:
+            writer.write({'business_yelp_url': 'biz-0'})
+        shard_fn = shard_output_fn(self.options['output_fn'], 'c0-w0')
+        with open_writer(shard_fn, 'json') as writer:
+            writer.write({'business_yelp_url': 'biz-1'})
+        # the crawler of every worker fails on an unknown priority
+        with self.assertRaises(RuntimeError):
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: run_distributed([], queue_fn, workers=1, resume=True, remove_shards=True,
+                                              priority='unknown', **self.options))
+        with open(self.options['output_fn'], encoding='utf-8') as f:
+            self.assertEqual(json.load(f), [{'business_yelp_url': 'biz-0'}])
+        self.assertTrue(os.path.exists(shard_fn))
+
+    async def test_worker_joins_queue(self):
+        queue_fn = os.path.join(self.tmp.name, 'queue.db')
+        seed(queue_fn, [('Contractors', 'San Francisco, CA')], **self.options)
+        crawler = Crawler(**self.options)
+        queue = WorkQueue(queue_fn)
+        worker = Worker(crawler, queue, 'w0')
+        with open_writer(shard_output_fn(crawler.output_fn, 'w0'), 'ndjson') as writer:
+            await crawler.open_session()
+            try:
+                await worker.run(writer)
+            finally:
+                await crawler.scheduler.close()
+                await crawler.close_session()
+        queue.close()
+        self.assertEqual((worker.done, worker.failed, writer.count), (4 + 20, 0, 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
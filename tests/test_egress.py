@@ -0,0 +1,115 @@
+import json
+import os
+import socket
+import tempfile
+import time
+import unittest
+from YelpCrawler.api import Crawler
+from YelpCrawler.egress import EgressPool
+from mock_server import MockYelp, MockProxy
+
+
+def closed_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class EgressPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def test_healthiest_endpoint(self):
+        pool = EgressPool(['http://proxy-a:3128', 'http://proxy-b:3128', '10.0.0.2'])
+        self.assertEqual(pool.endpoints[2].local_addr, ('10.0.0.2', 0))
+        self.assertIsNone(pool.endpoints[2].proxy)
+        a, b, c = pool.endpoints
+        pool.success(a, 0.5)
+        pool.success(b, 0.1)
+        pool.success(c, 0.1)
+        pool.failure(c)
+        self.assertIs(await pool.acquire(), b)
+        # requests in flight spread the load over equally healthy endpoints
+        self.assertIs(await pool.acquire(), a)
+
+    async def test_cooldown(self):
+        pool = EgressPool(['http://proxy-a:3128', 'http://proxy-b:3128'], cooldown=0.05)
+        a, b = pool.endpoints
+        pool.failure(a, denied=True)
+        self.assertIs(await pool.acquire(), b)
+        pool.failure(b, denied=True, retry_after=0.2)
+        self.assertFalse(pool.ready())
+        _start = time.monotonic()
+        self.assertIs(await pool.acquire(), a)
+        self.assertGreaterEqual(time.monotonic() - _start, 0.04)
+        self.assertEqual(pool.waits, 1)
+        # cooldown doubles with failures in a row
+        pool.failure(a)
+        self.assertAlmostEqual(a.cooldown_until - time.monotonic(), 0.1, delta=0.02)
+        stats = pool.stats()
+        self.assertEqual((stats[0]['failures'], stats[0]['denied'], stats[0]['cooldowns']), (2, 1, 2))
+        self.assertEqual(stats[1]['denied'], 1)
+
+
+class EgressCrawlTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await MockYelp(total_pages=3, per_page=5, reviews=7).start()
+        self.healthy = await MockProxy().start()
+        self.flaky = await MockProxy(deny_rate=0.3, seed=1).start()
+        self.banned = await MockProxy(deny_rate=1.0, retry_after=60).start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output_fn = os.path.join(self.tmp.name, 'output.json')
+
+    async def asyncTearDown(self):
+        for proxy in (self.healthy, self.flaky, self.banned):
+            await proxy.stop()
+        await self.server.stop()
+        self.tmp.cleanup()
+
+    async def test_run(self):
+        dead = f'http://127.0.0.1:{closed_port()}'
+        crawler = Crawler(max_reviews=5, logger_fn=os.devnull, output_fn=self.output_fn, base_url=self.server.url,
+                          egress=[self.healthy.url, self.flaky.url, self.banned.url, dead], egress_cooldown=0.2)
+        _start = time.monotonic()
+        await crawler.run(category_name='Contractors', location='San Francisco, CA')
+        # retries go through another endpoint without backoff
+        self.assertLess(time.monotonic() - _start, 3)
+        with open(self.output_fn, encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)), 15)
+        stats = {s['endpoint']: s for s in crawler.egress.stats()}
+        # banned endpoint only gets requests sent before its first 503, then waits for Retry-After
+        self.assertEqual(stats[self.banned.url]['denied'], self.banned.requests)
+        self.assertLess(self.banned.requests, stats[self.healthy.url]['requests'])
+        self.assertGreater(stats[self.banned.url]['cooldown_left'], 50)
+        self.assertEqual(stats[dead]['successes'], 0)
+        self.assertGreater(stats[dead]['failures'], 0)
+        self.assertEqual(stats[self.flaky.url]['denied'], self.flaky.denied)
+        self.assertGreater(stats[self.healthy.url]['successes'], stats[self.flaky.url]['successes'])
+        # every page reached the site through a proxy once
+        self.assertEqual(self.server.requests, 3 + 15)
+        self.assertEqual(self.server.requests, sum(s['successes'] for s in stats.values()))
+
+    async def test_origin_errors(self):
+        self.server.error_rate = 0.1
+        self.server.error_status = 500
+        crawler = Crawler(max_reviews=5, logger_fn=os.devnull, output_fn=self.output_fn, base_url=self.server.url,
+                          egress=[self.healthy.url])
+        _start = time.monotonic()
+        await crawler.run(category_name='Contractors', location='San Francisco, CA')
+        with open(self.output_fn, encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)), 15)
+        self.assertGreater(self.server.errors, 0)
+        # '500' of the site is retried with backoff, the proxy does not cool down
+        stats = crawler.egress.stats()[0]
+        self.assertEqual((stats['failures'], stats['cooldowns']), (0, 0))
+        self.assertEqual(stats['successes'], self.server.requests)
+        self.assertLess(time.monotonic() - _start, crawler.egress.cooldown)
+
+    async def test_source_address(self):
+        crawler = Crawler(max_reviews=5, logger_fn=os.devnull, output_fn=self.output_fn, base_url=self.server.url,
+                          egress=['127.0.0.1'])
+        await crawler.run(category_name='Contractors', location='San Francisco, CA')
+        with open(self.output_fn, encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)), 15)
+        self.assertEqual(crawler.egress.stats()[0]['successes'], 3 + 15)
+
+
+if __name__ == "__main__":
+    unittest.main()
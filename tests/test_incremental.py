@@ -0,0 +1,49 @@
+import json
+import os
+import tempfile
+import unittest
+from YelpCrawler.api import Crawler
+from YelpCrawler.incremental import PreviousCrawl
+from mock_server import MockYelp
+
+
+class IncrementalTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await MockYelp(total_pages=3, per_page=5).start()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+        self.tmp.cleanup()
+
+    async def crawl(self, output_fn, **kwargs):
+        crawler = Crawler(base_url=self.server.url, logger_fn=os.devnull,
+                          output_fn=os.path.join(self.tmp.name, output_fn), **kwargs)
+        self.server.requests = 0
+        await crawler.run()
+        with open(crawler.output_fn, encoding='utf-8') as f:
+            return crawler, {business['business_yelp_url']: business for business in json.load(f)}
+
+    async def test_unchanged_are_carried_over(self):
+        _, first = await self.crawl('first.json')
+        self.server.updated = {'business-0-1', 'business-2-4'}
+        crawler, second = await self.crawl('second.json', previous_fn=os.path.join(self.tmp.name, 'first.json'))
+        self.assertEqual(self.server.requests, 3 + 2)
+        self.assertEqual(len(second), 15)
+        url = self.server.url + '/biz/business-0-1'
+        self.assertEqual(second[url]['number_of_reviews'], first[url]['number_of_reviews'] + 1)
+        report = crawler.previous.report()
+        self.assertEqual((report['skipped'], report['changed'], report['new']), (13, 2, 0))
+        self.assertEqual(report['saved_bytes'], 13 * report['fetched_bytes'] // 2)
+
+    async def test_expired(self):
+        await self.crawl('first.json', state_fn=os.path.join(self.tmp.name, 'state.db'))
+        self.assertEqual(len(PreviousCrawl(os.path.join(self.tmp.name, 'state.db'))), 15)
+        crawler, _ = await self.crawl('second.json', previous_fn=os.path.join(self.tmp.name, 'state.db'),
+                                      previous_ttl=0)
+        self.assertEqual(self.server.requests, 3 + 15)
+        self.assertEqual(crawler.previous.report()['expired'], 15)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+import unittest
+from YelpCrawler.api import Crawler
+from YelpCrawler.metrics import Histogram, Metrics
+from mock_server import MockYelp
+
+
+class MetricsTest(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.01, 0.1, 1))
+        for value in [0.005] * 50 + [0.05] * 49 + [2.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [50, 49, 0, 1])
+        self.assertEqual(histogram.percentile(0.5), 0.01)
+        self.assertEqual(histogram.percentile(0.99), 0.1)
+        self.assertEqual(histogram.percentile(1.0), 2.0)
+        self.assertEqual(histogram.summary()['count'], 100)
+
+    def test_prometheus(self):
+        metrics = Metrics(buckets=(0.1, 1))
+        metrics.observe('ttfb', 0.05)
+        metrics.inc('retries', 2)
+        self.assertEqual(metrics.prometheus(queue_depth=3).splitlines(), [
+            '# TYPE yelp_crawler_ttfb_seconds histogram',
+            'yelp_crawler_ttfb_seconds_bucket{le="0.1"} 1',
+            'yelp_crawler_ttfb_seconds_bucket{le="1"} 1',
+            'yelp_crawler_ttfb_seconds_bucket{le="+Inf"} 1',
+            'yelp_crawler_ttfb_seconds_sum 0.05',
+            'yelp_crawler_ttfb_seconds_count 1',
+            '# TYPE yelp_crawler_retries_total counter',
+            'yelp_crawler_retries_total 2',
+            '# TYPE yelp_crawler_queue_depth gauge',
+            'yelp_crawler_queue_depth 3',
+        ])
+
+
+class CrawlerMetricsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await MockYelp(total_pages=3, per_page=5, latency=0.02).start()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+        self.tmp.cleanup()
+
+    async def test_summary(self):
+        metrics_fn = os.path.join(self.tmp.name, 'metrics.json')
+        prometheus_fn = os.path.join(self.tmp.name, 'metrics.prom')
+        crawler = Crawler(base_url=self.server.url, logger_fn=os.devnull,
+                          output_fn=os.path.join(self.tmp.name, 'output.json'),
+                          metrics_fn=metrics_fn, prometheus_fn=prometheus_fn, stats_interval=0.02)
+        with self.assertLogs(level='INFO') as logs:
+            await crawler.run()
+        with open(metrics_fn, encoding='utf-8') as f:
+            summary = json.load(f)
+        histograms = summary['histograms']
+        for name in ('connect', 'ttfb', 'download', 'request', 'queue_wait'):
+            self.assertIn(name, histograms)
+        self.assertEqual(histograms['request']['count'], 3 + 15)
+        self.assertEqual(histograms['parse_search_page']['count'], 3)
+        self.assertEqual(histograms['parse_business_page']['count'], 15)
+        self.assertGreaterEqual(histograms['ttfb']['p50'], 0.02)
+        self.assertEqual(summary['counters']['requests'], self.server.requests)
+        self.assertEqual(summary['counters']['bytes_received'], self.server.sent_bytes)
+        self.assertEqual(summary['counters']['status_200'], 3 + 15)
+        self.assertIn('hit_ratio', summary['cache'])
+        with open(prometheus_fn, encoding='utf-8') as f:
+            self.assertIn('yelp_crawler_requests_total 18', f.read())
+        self.assertTrue(any('Stats: ' in line for line in logs.output))
+        self.assertTrue(any('Metrics: ' in line for line in logs.output))
+
+    async def test_stream_parse(self):
+        crawler = Crawler(base_url=self.server.url, logger_fn=os.devnull,
+                          output_fn=os.path.join(self.tmp.name, 'output.json'), stream_parse=True)
+        await crawler.run()
+        histograms = crawler.metrics.histograms
+        counters = crawler.metrics.counters
+        # streamed business pages are timed and counted like the ones read at once
+        self.assertEqual(histograms['request'].count, 3 + 15)
+        self.assertEqual(histograms['download'].count, 3 + 15)
+        self.assertEqual(counters['bytes_received'], self.server.sent_bytes)
+        self.assertGreater(counters['bytes_received'], counters['stream_bytes_read'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from YelpCrawler.output import open_writer, read_records
+
+sample_fn = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'output.json')
+
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(sample_fn, encoding='utf-8') as f:
+            self.sample = f.read()
+        self.businesses = json.loads(self.sample)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, fn, businesses, *args, **kwargs):
+        fn = os.path.join(self.tmp.name, fn)
+        with open_writer(fn, *args, **kwargs) as writer:
+            for business in businesses:
+                writer.write(business)
+        self.assertEqual(writer.count, len(businesses))
+        return fn
+
+    def test_json_array_is_byte_compatible(self):
+        fn = self.write('output.json', self.businesses, 'json')
+        with open(fn, encoding='utf-8') as f:
+            self.assertEqual(f.read(), self.sample)
+
+    def test_empty_json_array(self):
+        fn = self.write('output.json', [], 'json')
+        with open(fn, encoding='utf-8') as f:
+            self.assertEqual(f.read(), json.dumps([], indent=2))
+
+    def test_ndjson_gzip(self):
+        fn = self.write('output.ndjson.gz', self.businesses, 'ndjson')
+        with gzip.open(fn, 'rt', encoding='utf-8') as f:
+            self.assertEqual([json.loads(line) for line in f], self.businesses)
+        self.assertEqual(list(read_records(fn)), self.businesses)
+
+    def test_read_json_array(self):
+        self.assertEqual(list(read_records(sample_fn)), self.businesses)
+
+    def test_flush_interval(self):
+        fn = os.path.join(self.tmp.name, 'output.ndjson')
+        with open_writer(fn, 'ndjson', flush_interval=0) as writer:
+            writer.write(self.businesses[0])
+            with open(fn, encoding='utf-8') as f:
+                self.assertEqual(json.loads(f.read()), self.businesses[0])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            open_writer('output.xml', 'xml')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from YelpCrawler.parsers import parse_search_page, parse_business_page, BusinessPageParser
+from test_structures import read_fixture
+
+
+class ParsersTest(unittest.TestCase):
+    def test_search_page(self):
+        page = parse_search_page(read_fixture('search_page.html'), 'http://localhost', max_business=2)
+        self.assertEqual(page['total_pages'], 24)
+        self.assertEqual(len(page['businesses']), 2)
+        self.assertEqual(page['businesses'][1]['business_yelp_url'], 'http://localhost/biz/business-0-1')
+
+    def test_business_page(self):
+        page = parse_business_page(read_fixture('business_page.html'), max_reviews=5)
+        self.assertEqual(page['business_website'], 'business-0-0.com')
+        self.assertEqual(len(page['reviews']), 5)
+        self.assertEqual(page['reviews'][0], {'reviewer_name': 'Reviewer 0.',
+                                              'reviewer_location': 'City 0, CA',
+                                              'review_date': '2023-01-10'})
+
+    def test_streaming_business_page(self):
+        text = read_fixture('business_page.html')
+        body = text.encode('utf-8')
+        for max_reviews in (1, 5, None):
+            for chunk_size in (1024, 16384):
+                parser = BusinessPageParser(max_reviews)
+                for i in range(0, len(body), chunk_size):
+                    parser.feed(body[i:i + chunk_size])
+                    if parser.done:
+                        break
+                self.assertEqual(parser.close(), parse_business_page(text, max_reviews))
+                if max_reviews:
+                    # reviews are at the top of the page, filler is skipped
+                    self.assertLess(parser.bytes_read, len(body) // 4)
+                else:
+                    self.assertEqual(parser.bytes_read, len(body))
+
+    def test_process_pool(self):
+        text = read_fixture('business_page.html')
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            res = list(pool.map(parse_business_page, [text] * 4, [None] * 4))
+        self.assertEqual(res, [parse_business_page(text)] * 4)
+        self.assertEqual(len(res[0]['reviews']), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import pstats
+import tempfile
+import unittest
+from YelpCrawler.api import Crawler
+from YelpCrawler.profiling import Profiler
+from mock_server import MockYelp
+
+
+class ProfilerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await MockYelp(total_pages=3, per_page=5, latency=0.01).start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.crawler = Crawler(base_url=self.server.url, logger_fn=os.devnull,
+                               output_fn=os.path.join(self.tmp.name, 'output.json'))
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+        self.tmp.cleanup()
+
+    async def test_cprofile(self):
+        prefix = os.path.join(self.tmp.name, 'profile')
+        with Profiler(prefix, mode='cprofile', top=5) as self.crawler.profiler:
+            await self.crawler.run()
+        self.assertEqual(self.crawler.profiler.files, [prefix + '.pstats', prefix + '.txt', prefix + '.alloc.txt'])
+        functions = {func for _, _, func in pstats.Stats(prefix + '.pstats').stats}
+        self.assertIn('parse_business_page', functions)
+        with open(prefix + '.alloc.txt', encoding='utf-8') as f:
+            report = f.read()
+        for stage in ('setup: ', 'first_business: ', 'crawl: ', 'finish: '):
+            self.assertIn(stage, report)
+
+    async def test_sampling(self):
+        prefix = os.path.join(self.tmp.name, 'profile')
+        with Profiler(prefix, mode='sampling', interval=0.001, trace_malloc=False) as self.crawler.profiler:
+            await self.crawler.run()
+        self.assertEqual(self.crawler.profiler.files, [prefix + '.collapsed', prefix + '.alloc.txt'])
+        with open(prefix + '.collapsed', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        self.assertIn(';', stack)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import asyncio
+import time
+import unittest
+from YelpCrawler.scheduler import Scheduler, TokenBucket, AdaptiveLimiter, parse_retry_after
+
+
+class SchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.peak = 0
+        self.hosts = dict()
+        self.peak_host = 0
+
+    async def job(self, url):
+        host = url.split('/')[2]
+        self.hosts[host] = self.hosts.get(host, 0) + 1
+        self.peak_host = max(self.peak_host, self.hosts[host])
+        self.peak = max(self.peak, self.scheduler.in_flight)
+        await asyncio.sleep(0.01)
+        self.hosts[host] -= 1
+        return url
+
+    async def test_concurrency_caps(self):
+        self.scheduler = Scheduler(concurrency=8, per_host=3, queue_size=4)
+        urls = [f'http://host{i % 2}/page/{i}' for i in range(40)]
+        res = await self.scheduler.map(self.job, urls)
+        await self.scheduler.close()
+        self.assertEqual(res, urls)
+        self.assertLessEqual(self.peak, 6)
+        self.assertLessEqual(self.peak_host, 3)
+        self.assertEqual(self.scheduler.stats(), {'queue_depth': 0, 'in_flight': 0, 'submitted': 40,
+                                                  'completed': 40, 'failed': 0})
+
+    async def test_backpressure(self):
+        self.scheduler = Scheduler(concurrency=1, queue_size=2)
+        blocker = asyncio.Event()
+
+        async def wait(url):
+            await blocker.wait()
+
+        for i in range(3):
+            await self.scheduler.submit(wait, i)
+        await asyncio.sleep(0)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.scheduler.submit(wait, 3), 0.05)
+        self.assertEqual(self.scheduler.queue_depth, 2)
+        blocker.set()
+        await self.scheduler.close()
+
+    async def test_priority(self):
+        self.scheduler = Scheduler(concurrency=1, queue_size=10)
+        blocker = asyncio.Event()
+        order = []
+
+        async def record(url):
+            await blocker.wait()
+            order.append(url)
+
+        futures = [await self.scheduler.submit(record, 'first')]
+        await asyncio.sleep(0)
+        for url, priority in (('a', 0), ('b', -5), ('c', 0), ('d', -5), ('e', 3)):
+            futures.append(await self.scheduler.submit(record, url, priority=priority))
+        blocker.set()
+        await asyncio.gather(*futures)
+        await self.scheduler.close()
+        self.assertEqual(order, ['first', 'b', 'd', 'a', 'c', 'e'])
+
+    async def test_rate_limit(self):
+        self.scheduler = Scheduler(concurrency=10, rate=50)
+        _start = time.monotonic()
+        await self.scheduler.map(self.job, [f'http://host/{i}' for i in range(100)])
+        await self.scheduler.close()
+        self.assertGreaterEqual(time.monotonic() - _start, 1.0)
+
+    async def test_failed_job(self):
+        self.scheduler = Scheduler(concurrency=2)
+
+        async def fail(url):
+            raise ConnectionError(url)
+
+        with self.assertRaises(ConnectionError):
+            await self.scheduler.map(fail, ['http://host/0'])
+        await self.scheduler.close()
+        self.assertEqual(self.scheduler.failed, 1)
+
+    async def test_cancelled_while_running(self):
+        self.scheduler = Scheduler(concurrency=1)
+
+        async def slow(url):
+            await asyncio.sleep(0.05)
+            return url
+
+        future = await self.scheduler.submit(slow, 'http://host/0')
+        await asyncio.sleep(0.01)
+        future.cancel()
+        # the worker survives the cancelled future and runs the next job
+        self.assertEqual(await asyncio.wait_for(await self.scheduler.submit(slow, 'http://host/1'), 1),
+                         'http://host/1')
+        self.assertTrue(all(not worker.done() for worker in self.scheduler._workers))
+        await self.scheduler.close()
+        self.assertEqual(self.scheduler.completed, 2)
+
+
+class AdaptiveLimiterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_cut_once_per_epoch(self):
+        limiter = AdaptiveLimiter(max_window=8)
+        epochs = [await limiter.acquire() for _ in range(8)]
+        for epoch in epochs:
+            limiter.failure(epoch)
+        self.assertEqual(limiter.window, 4)
+        self.assertEqual(limiter.decreases, 1)
+        for _ in range(8):
+            await limiter.release()
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(asyncio.gather(*[limiter.acquire() for _ in range(5)]), 0.05)
+
+    async def test_grows_back(self):
+        bucket = TokenBucket(rate=10)
+        limiter = AdaptiveLimiter(max_window=4, bucket=bucket)
+        limiter.failure(limiter.epoch)
+        self.assertEqual((limiter.window, bucket.rate), (2, 5))
+        for _ in range(20):
+            limiter.success(limiter.epoch, 0.01)
+        self.assertEqual((limiter.window, bucket.rate), (4, 10))
+        self.assertEqual(limiter.stats()['min_window'], 2)
+
+    async def test_latency_spike(self):
+        limiter = AdaptiveLimiter(max_window=4)
+        for _ in range(10):
+            limiter.success(limiter.epoch, 0.01)
+        limiter.success(limiter.epoch, 1.0)
+        self.assertEqual(limiter.window, 2)
+
+    async def test_retry_after(self):
+        self.assertEqual(parse_retry_after('2'), 2)
+        self.assertIsNone(parse_retry_after('soon'))
+        limiter = AdaptiveLimiter(max_window=4)
+        limiter.failure(limiter.epoch, retry_after=0.2)
+        _start = time.monotonic()
+        await limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - _start, 0.15)
+        self.assertEqual(limiter.pauses, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from YelpCrawler.api import Crawler
+from YelpCrawler.state import CrawlState
+from mock_server import MockYelp
+
+
+class CrawlStateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fn = os.path.join(self.tmp.name, 'state.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_progress(self):
+        state = CrawlState(self.fn)
+        state.set_total_pages('search-0', 3)
+        state.mark_search('search-0', [{'business_yelp_url': 'biz-0'}, {'business_yelp_url': 'biz-1'}])
+        state.mark_business('biz-0', {'business_yelp_url': 'biz-0', 'reviews': []})
+        state.close()
+
+        state = CrawlState(self.fn)
+        self.assertEqual(state.total_pages('search-0'), 3)
+        self.assertTrue(state.search_done('search-0'))
+        self.assertFalse(state.search_done('search-1'))
+        self.assertTrue(state.business_done('biz-0'))
+        self.assertEqual(state.pending_businesses('search-0'), [{'business_yelp_url': 'biz-1'}])
+        self.assertEqual(list(state.finished()), [{'business_yelp_url': 'biz-0', 'reviews': []}])
+        self.assertEqual(list(state.finished(search_prefix='search-')), [{'business_yelp_url': 'biz-0', 'reviews': []}])
+        self.assertEqual(list(state.finished(search_prefix='other-')), [])
+        self.assertEqual(state.stats(), {'searches': 1, 'businesses': 2, 'finished': 1})
+        state.reset()
+        self.assertEqual(state.stats(), {'searches': 0, 'businesses': 0, 'finished': 0})
+        state.close()
+
+
+class ResumeTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await MockYelp(total_pages=3, per_page=5).start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output_fn = os.path.join(self.tmp.name, 'output.json')
+        self.state_fn = os.path.join(self.tmp.name, 'state.db')
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+        self.tmp.cleanup()
+
+    async def crawl(self, resume):
+        crawler = Crawler(base_url=self.server.url, logger_fn=os.devnull, output_fn=self.output_fn,
+                          state_fn=self.state_fn, resume=resume)
+        await crawler.run()
+        with open(self.output_fn, encoding='utf-8') as f:
+            return json.load(f)
+
+    async def test_resume(self):
+        first = await self.crawl(resume=False)
+        self.assertEqual(self.server.requests, 3 + 15)
+
+        # interrupted crawl: last search page and every third business are unfinished
+        db = sqlite3.connect(self.state_fn)
+        db.execute('UPDATE searches SET done_at=NULL WHERE url LIKE "%start=20"')
+        db.execute('DELETE FROM businesses WHERE url LIKE "%business-2-%"')
+        db.execute('UPDATE businesses SET record=NULL WHERE rowid % 3 = 0')
+        db.commit()
+        missing, = db.execute('SELECT COUNT(*) FROM businesses WHERE record IS NULL').fetchone()
+        db.close()
+
+        self.server.requests = 0
+        res = await self.crawl(resume=True)
+        self.assertEqual(self.server.requests, 1 + 5 + missing)
+        key = lambda x: x['business_yelp_url']
+        self.assertEqual(sorted(res, key=key), sorted(first, key=key))
+
+        self.server.requests = 0
+        res = await self.crawl(resume=True)
+        self.assertEqual(self.server.requests, 0)
+        self.assertEqual(len(res), 15)
+
+
+if __name__ == "__main__":
+    unittest.main()
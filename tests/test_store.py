@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+import unittest
+from YelpCrawler.api import Crawler
+from YelpCrawler.incremental import PreviousCrawl
+from YelpCrawler.output import open_writer, read_records, export_records
+from YelpCrawler.store import ResultStore, is_result_store
+from mock_server import MockYelp
+
+sample_fn = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'output.json')
+
+
+class ResultStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fn = os.path.join(self.tmp.name, 'output.db')
+        with open(sample_fn, encoding='utf-8') as f:
+            self.businesses = json.load(f)
+        # the sample lists two businesses twice, the store keeps the first position and the last values
+        self.unique = dict()
+        for business in self.businesses:
+            self.unique[business['business_yelp_url']] = business
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_export_is_byte_compatible(self):
+        with open_writer(self.fn, 'sqlite') as writer:
+            for business in self.businesses:
+                writer.write(business)
+        self.assertTrue(is_result_store(self.fn))
+        self.assertFalse(is_result_store(sample_fn))
+        output_fn = os.path.join(self.tmp.name, 'output.json')
+        self.assertEqual(export_records(self.fn, output_fn), len(self.unique))
+        with open(output_fn, encoding='utf-8') as f:
+            self.assertEqual(f.read(), json.dumps(list(self.unique.values()), indent=2))
+
+    def test_upsert(self):
+        store = ResultStore(self.fn, batch_size=100)
+        for business in self.businesses:
+            store.add(business)
+        self.assertEqual(len(store), len(self.unique))
+        updated = dict(self.businesses[0], business_rating=1.0, reviews=self.businesses[0]['reviews'][:1])
+        store.add(updated)
+        store.close()
+
+        store = ResultStore(self.fn)
+        self.assertEqual(store.get(updated['business_yelp_url']), updated)
+        self.assertIsNone(store.get('https://www.yelp.com/biz/missing'))
+        records = list(store.records())
+        self.assertEqual(records[0], updated)
+        self.assertEqual(records[1:], list(self.unique.values())[1:])
+        self.assertEqual(store._db.execute('SELECT COUNT(*) FROM reviews WHERE business_yelp_url=?',
+                                           (updated['business_yelp_url'],)).fetchone()[0], 1)
+        store.close()
+
+    def test_find(self):
+        store = ResultStore(self.fn)
+        for business in self.businesses:
+            store.add(business)
+        top = list(store.find(min_rating=4.5, limit=5))
+        expected = sorted((b for b in self.unique.values() if (b['business_rating'] or 0) >= 4.5),
+                          key=lambda b: -b['number_of_reviews'])[:5]
+        self.assertEqual([b['number_of_reviews'] for b in top], [b['number_of_reviews'] for b in expected])
+        name = self.businesses[3]['business_name']
+        self.assertIn(self.businesses[3]['business_yelp_url'],
+                      [b['business_yelp_url'] for b in store.find(name=name[:4])])
+        best = next(store.find(order_by='business_rating'))
+        self.assertEqual(best['business_rating'], max(b['business_rating'] or 0 for b in self.businesses))
+        query_plan = ' '.join(row[-1] for row in store._db.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM businesses WHERE number_of_reviews >= 100'))
+        self.assertIn('businesses_reviews', query_plan)
+        store.close()
+
+
+class SqliteOutputTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await MockYelp(total_pages=3, per_page=5, reviews=7).start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output_fn = os.path.join(self.tmp.name, 'output.db')
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+        self.tmp.cleanup()
+
+    async def test_runs_merge(self):
+        crawler = Crawler(max_reviews=5, max_pages=2, logger_fn=os.devnull, output_fn=self.output_fn,
+                          output_format='sqlite', base_url=self.server.url)
+        await crawler.run(category_name='Contractors', location='San Francisco, CA')
+        self.assertEqual(len(list(read_records(self.output_fn))), 10)
+        # a later run updates stored businesses and adds new ones
+        self.server.updated.add('business-0-0')
+        crawler = Crawler(max_reviews=5, logger_fn=os.devnull, output_fn=self.output_fn,
+                          output_format='sqlite', base_url=self.server.url)
+        await crawler.run(category_name='Contractors', location='San Francisco, CA')
+        records = list(read_records(self.output_fn))
+        self.assertEqual(len(records), 15)
+        self.assertEqual(records[0]['business_yelp_url'], self.server.url + '/biz/business-0-0')
+        self.assertEqual(records[0]['number_of_reviews'], 11)
+        self.assertEqual(len(records[0]['reviews']), 5)
+        # the store serves as previous crawl of an incremental run
+        previous = PreviousCrawl(self.output_fn)
+        self.assertEqual(len(previous), 15)
+        self.assertEqual(previous.carry_over(records[1]), records[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
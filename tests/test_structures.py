@@ -0,0 +1,59 @@
+import os
+import unittest
+from unittest import mock
+from YelpCrawler.api import Crawler
+from lxml import html
+from YelpCrawler.structures import SearchPage, Schema, Field, to_int
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def read_fixture(fn):
+    with open(os.path.join(fixtures, fn), encoding='utf-8') as f:
+        return f.read()
+
+
+class SearchPageTest(unittest.TestCase):
+    def setUp(self):
+        self.crawler = Crawler(logger_fn=os.devnull)
+        self.text = read_fixture('search_page.html')
+
+    def test_single_parse(self):
+        with mock.patch('YelpCrawler.structures.html.fromstring', wraps=html.fromstring) as fromstring:
+            page = SearchPage(self.text, self.crawler.fetch_business)
+        self.assertEqual(fromstring.call_count, 1)
+        self.assertEqual(page.total_pages, 24)
+        self.assertEqual(len(page.businesses), 10)
+
+    def test_business_fields(self):
+        business_body = SearchPage(self.text, self.crawler.fetch_business, max_business=3).businesses[0]
+        self.assertIsNone(business_body.html_element)
+        self.assertEqual(dict(business_body), {
+            'business_name': 'Business business-0-0',
+            'business_rating': 1.0,
+            'number_of_reviews': 10,
+            'business_yelp_url': 'https://www.yelp.com/biz/business-0-0',
+            'business_website': None,
+            'reviews': [],
+        })
+
+
+class SchemaTest(unittest.TestCase):
+    def setUp(self):
+        self.el = html.fromstring('<div><p>Sample business</p><p><b>12 reviews</b></p></div>')
+
+    def test_extract(self):
+        schema = Schema(business_name=Field('.//p[1]/text()'),
+                        number_of_reviews=Field('.//p/b/text()', to_int, default=0),
+                        business_website=Field('.//a/text()', default=None))
+        self.assertEqual(schema.extract(self.el), {'business_name': 'Sample business',
+                                                   'number_of_reviews': 12,
+                                                   'business_website': None})
+
+    def test_required(self):
+        with self.assertRaises(KeyError):
+            Field('.//a/text()')(self.el)
+
+
+if __name__ == "__main__":
+    unittest.main()